@@ -0,0 +1,4 @@
+from dotenv import load_dotenv
+
+# .env читается один раз, до того как модули app прочитают окружение
+load_dotenv()
@@ -1,50 +1,57 @@
-from fastapi import APIRouter, HTTPException, Query
-from beanie import PydanticObjectId
+from fastapi import APIRouter, HTTPException, Query, Request
 from datetime import datetime
+import logging
 
-from app.models.agent import Agent, Memory
+from app.models.agent import Memory
 from app.models.event import Event, EventType
 from app.models.log import LogCategory
 from app.services.builder import EventBuilder, LogBuilder
+from app.services.memories import trim_memories
+from app.services.write_batch import WriteBatch
+from app.services.responses import FastJSONResponse
+from app.services import world_versions
+from app.db.repository import agent_repo, event_repo, log_repo
 from app.schemas.schemas import (
     WorldEventCreate, AgentEventCreate, EventResponse,
     EventListResponse, EventFeedResponse,
 )
 
 router = APIRouter(prefix="/action", tags=["Action"])
+logger = logging.getLogger(__name__)
+
+
+def event_fields(e: Event) -> dict:
+    return {
+        "id": str(e.id), "event_type": e.event_type, "description": e.description,
+        "agent_id": e.agent_id, "agent_name": e.agent_name,
+        "target_agent_id": e.target_agent_id, "target_agent_name": e.target_agent_name,
+        "content": e.content, "metadata": e.metadata, "timestamp": e.timestamp,
+    }
 
 
 def to_resp(e: Event) -> EventResponse:
-    return EventResponse(
-        id=str(e.id), event_type=e.event_type, description=e.description,
-        agent_id=e.agent_id, agent_name=e.agent_name,
-        target_agent_id=e.target_agent_id, target_agent_name=e.target_agent_name,
-        content=e.content, metadata=e.metadata, timestamp=e.timestamp,
-    )
+    return EventResponse(**event_fields(e))
 
 
 @router.get("/feed", response_model=EventFeedResponse)
-async def feed(limit: int = Query(20, ge=1, le=100), cursor: str | None = None,
+async def feed(request: Request, limit: int = Query(20, ge=1, le=100), cursor: str | None = None,
                event_type: EventType | None = None, agent_id: str | None = None):
-    q = {}
+    tag = await world_versions.check(request, "events")
+    before = None
     if cursor:
-        try:
-            ce = await Event.get(PydanticObjectId(cursor))
-            if ce: q["timestamp"] = {"$lt": ce.timestamp}
-        except: pass
-    if event_type: q["event_type"] = event_type.value
-    if agent_id: q["$or"] = [{"agent_id": agent_id}, {"target_agent_id": agent_id}]
-
-    events = await Event.find(q).sort("-timestamp").limit(limit + 1).to_list()
+        ce = await event_repo().get(cursor)
+        if ce: before = ce.timestamp
+
+    events = await event_repo().feed(limit + 1, before, event_type.value if event_type else None, agent_id)
     has_more = len(events) > limit
     events = events[:limit]
-    return EventFeedResponse(events=[to_resp(e) for e in events], has_more=has_more,
-                             next_cursor=str(events[-1].id) if events and has_more else None)
+    return FastJSONResponse({"events": [event_fields(e) for e in events], "has_more": has_more,
+                             "next_cursor": str(events[-1].id) if events and has_more else None},
+                            headers=world_versions.headers(tag))
 
 
 @router.post("/world-event", response_model=EventResponse, status_code=201)
 async def world_event(data: WorldEventCreate):
-    from app.models.agent import Agent, Memory
     from app.models.event import EventType
     from app.services.gigachat_service import chat
     from app.models.log import LogCategory, LogLevel
@@ -53,15 +60,16 @@ async def world_event(data: WorldEventCreate):
     
     ev = EventBuilder().set_type(EventType.WORLD_EVENT).set_description(data.description).build()
     ev.metadata = data.metadata
-    await ev.insert()
+    await event_repo().insert(ev)
 
-    await LogBuilder().category(LogCategory.WORLD_EVENT).message(f"Событие: {data.description}").build().insert()
+    await log_repo().insert(LogBuilder().category(LogCategory.WORLD_EVENT).message(f"Событие: {data.description}").build())
     
     # Агенты реагируют на мировое событие
-    agents = await Agent.find({"is_active": True}).to_list()
+    agents = await agent_repo().find_all(active_only=True)
     if agents:
         # Выбираем случайных агентов для реакции (1-3 агента)
         reacting_agents = random.sample(agents, min(3, len(agents)))
+        batch = WriteBatch(reacting_agents)
         
         for agent in reacting_agents:
             try:
@@ -74,7 +82,7 @@ async def world_event(data: WorldEventCreate):
                 ).set_source(str(agent.id), agent.name).set_content(
                     reaction
                 ).build()
-                await reaction_ev.insert()
+                await event_repo().insert(reaction_ev)
                 
                 # Добавляем в память агента
                 agent.memories.append(Memory(
@@ -97,32 +105,27 @@ async def world_event(data: WorldEventCreate):
                     if agent.emotion.mood in [Mood.HAPPY, Mood.EXCITED]:
                         agent.emotion.mood = Mood.ANXIOUS
                 
-                # Суммаризация памяти
-                MAX_MEMORIES = 50
-                if len(agent.memories) > MAX_MEMORIES:
-                    agent.memories.sort(key=lambda m: m.importance)
-                    old = agent.memories[:len(agent.memories) - MAX_MEMORIES]
-                    summary = Memory(content="[Сводка] " + "; ".join(m.content[:60] for m in old[:5]), importance=0.3)
-                    agent.memories = [summary] + agent.memories[len(old):]
+                trim_memories(agent)
                 
                 agent.updated_at = datetime.utcnow()
-                await agent.save()
+                batch.mark(agent)
                 
             except Exception as e:
-                print(f"Ошибка реакции агента {agent.name} на событие: {e}")
+                logger.error("Ошибка реакции агента %s на событие: %s", agent.name, e)
+        await batch.flush()
     
     return to_resp(ev)
 
 
 @router.post("/agent-event", response_model=EventResponse, status_code=201)
 async def agent_event(data: AgentEventCreate):
-    agent = await Agent.get(PydanticObjectId(data.agent_id))
+    agent = await agent_repo().get(data.agent_id)
     if not agent:
         raise HTTPException(404, "Агент не найден")
 
     b = EventBuilder().set_type(data.event_type).set_description(data.description).set_source(data.agent_id, agent.name)
     if data.target_agent_id:
-        target = await Agent.get(PydanticObjectId(data.target_agent_id))
+        target = await agent_repo().get(data.target_agent_id)
         if not target: raise HTTPException(404, "Целевой агент не найден")
         b.set_target(data.target_agent_id, target.name)
     if data.content:
@@ -130,38 +133,36 @@ async def agent_event(data: AgentEventCreate):
 
     ev = b.build()
     ev.metadata = data.metadata
-    await ev.insert()
+    await event_repo().insert(ev)
 
-    await LogBuilder().category(LogCategory.ACTION_EXECUTED).message(f"{agent.name}: {data.description}").agent(str(agent.id), agent.name).build().insert()
+    await log_repo().insert(LogBuilder().category(LogCategory.ACTION_EXECUTED).message(f"{agent.name}: {data.description}").agent(str(agent.id), agent.name).build())
     return to_resp(ev)
 
 
 @router.get("/events/{event_id}", response_model=EventResponse)
 async def get_event(event_id: str):
-    ev = await Event.get(PydanticObjectId(event_id))
+    ev = await event_repo().get(event_id)
     if not ev: raise HTTPException(404, "Не найдено")
     return to_resp(ev)
 
 
 @router.get("/events/agent/{agent_id}", response_model=EventListResponse)
-async def agent_events(agent_id: str, skip: int = 0, limit: int = 50, event_type: EventType | None = None):
-    q = {"$or": [{"agent_id": agent_id}, {"target_agent_id": agent_id}]}
-    if event_type: q["event_type"] = event_type.value
-    events = await Event.find(q).sort("-timestamp").skip(skip).limit(limit).to_list()
-    total = await Event.find(q).count()
-    return EventListResponse(events=[to_resp(e) for e in events], total=total)
+async def agent_events(agent_id: str, request: Request, skip: int = 0, limit: int = 50,
+                       event_type: EventType | None = None):
+    tag = await world_versions.check(request, "events", agent_id)
+    events, total = await event_repo().for_agent(agent_id, event_type.value if event_type else None, skip, limit)
+    return FastJSONResponse({"events": [event_fields(e) for e in events], "total": total},
+                            headers=world_versions.headers(tag))
 
 
 @router.get("/events/between/{a1}/{a2}", response_model=EventListResponse)
-async def between(a1: str, a2: str, skip: int = 0, limit: int = 50):
-    q = {"$or": [{"agent_id": a1, "target_agent_id": a2}, {"agent_id": a2, "target_agent_id": a1}]}
-    events = await Event.find(q).sort("-timestamp").skip(skip).limit(limit).to_list()
-    total = await Event.find(q).count()
-    return EventListResponse(events=[to_resp(e) for e in events], total=total)
+async def between(a1: str, a2: str, request: Request, skip: int = 0, limit: int = 50):
+    tag = await world_versions.check(request, "events", a1, a2)
+    events, total = await event_repo().between(a1, a2, skip, limit)
+    return FastJSONResponse({"events": [event_fields(e) for e in events], "total": total},
+                            headers=world_versions.headers(tag))
 
 
 @router.delete("/events/{event_id}", status_code=204)
 async def delete_event(event_id: str):
-    ev = await Event.get(PydanticObjectId(event_id))
-    if not ev: raise HTTPException(404, "Не найдено")
-    await ev.delete()
+    if not await event_repo().delete(event_id): raise HTTPException(404, "Не найдено")
@@ -0,0 +1,43 @@
+from fastapi import APIRouter, HTTPException, Query
+from datetime import datetime, timedelta
+
+from app.db.repository import usage_repo
+from app.services import llm_usage
+
+router = APIRouter(prefix="/llm", tags=["LLM"])
+
+
+@router.get("/usage")
+async def usage(group_by: str = Query("kind", description="kind / agent / source / minute"),
+                minutes: int = Query(60, ge=1, le=60 * 24 * 31, description="окно, если не задан since"),
+                since: datetime | None = None, until: datetime | None = None,
+                agent_id: str | None = None, kind: str | None = None,
+                top: int = Query(50, ge=1, le=1000)):
+    """Расход токенов и задержка LLM за окно (UTC) по поминутным сверткам"""
+    if since is None:
+        since = (until or datetime.utcnow()) - timedelta(minutes=minutes)
+    try:
+        return await llm_usage.summarize(since, until, group_by, agent_id, kind, top)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+@router.get("/usage/calls")
+async def usage_calls(agent_id: str | None = None, kind: str | None = None,
+                      skip: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=500)):
+    """Последние вызовы LLM из журнала, новые первыми"""
+    await llm_usage.flush()
+    calls, total = await usage_repo().calls(agent_id, kind, skip, limit)
+    return {"calls": [c.model_dump(exclude={"id", "revision_id"}) for c in calls], "total": total}
+
+
+@router.get("/usage/stats")
+async def usage_stats():
+    """Счетчики процесса с момента старта (включая еще не сброшенные вызовы)"""
+    return dict(llm_usage.USAGE_STATS)
+
+
+@router.delete("/usage")
+async def clear_usage(days: int = Query(30, ge=1)):
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    return {"deleted": await usage_repo().delete_before(cutoff)}
@@ -1,42 +1,58 @@
-from fastapi import APIRouter, HTTPException, Query
-from beanie import PydanticObjectId
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from datetime import datetime
+import logging
 
 from app.models.agent import Agent, Relationship, Memory
 from app.models.event import EventType
 from app.models.log import LogCategory
+from app.services.memories import trim_memories
 from app.services.builder import AgentBuilder, EventBuilder, LogBuilder
+from app.db.repository import agent_repo, event_repo, log_repo, history_repo
+from app.services.occ import OCC_STATS, conflict_rate, mutate_agent
+from app.services.agent_bulk import export_ndjson, import_ndjson
+from app.services.agent_history import HISTORY_STATS, rebuild_agent, record_deletion
+from app.services.lifecycle_service import STATS
+from app.services.write_batch import FLUSH_STATS
+from app.services.sharding import NUM_PARTITIONS, lease_table, publish_time_speed, sync_time_speed
+from app.services.world_snapshot import list_snapshots, save_snapshot, snapshot_path
+from app.services.stall_watchdog import STALL_STATS, recent_stalls
+from app.services.responses import FastJSONResponse
+from app.services import world_versions
 from app.schemas.schemas import (
     AgentCreate, AgentUpdate, AgentResponse, AgentDetailResponse,
     AgentListResponse, MoodUpdate, RelationshipUpdate, MemoryAdd,
-    RelationshipGraphResponse, RelationshipGraphNode, RelationshipGraphEdge,
+    RelationshipGraphResponse,
 )
 
 router = APIRouter(prefix="/system", tags=["System"])
+logger = logging.getLogger(__name__)
 
-MAX_MEMORIES = 50
+
+
+def agent_fields(a: Agent) -> dict:
+    """Поля AgentResponse из документа. Вложенные модели — как есть: документ
+    уже проверен, FastJSONResponse сериализует их без повторной валидации"""
+    return {
+        "id": str(a.id), "name": a.name, "bio": a.bio, "avatar_url": a.avatar_url,
+        "personality": a.personality, "emotion": a.emotion,
+        "relationships": a.relationships, "memories_count": len(a.memories),
+        "current_plan": a.current_plan, "current_goal": a.current_goal,
+        "is_active": a.is_active, "created_at": a.created_at, "updated_at": a.updated_at,
+        "revision": a.revision,
+    }
+
+
+def detail_fields(a: Agent) -> dict:
+    return {**agent_fields(a), "memories": a.memories, "system_prompt": a.system_prompt}
 
 
 def to_response(a: Agent) -> AgentResponse:
-    return AgentResponse(
-        id=str(a.id), name=a.name, bio=a.bio, avatar_url=a.avatar_url,
-        personality=a.personality, emotion=a.emotion,
-        relationships=a.relationships, memories_count=len(a.memories),
-        current_plan=a.current_plan, current_goal=a.current_goal,
-        is_active=a.is_active, created_at=a.created_at, updated_at=a.updated_at,
-    )
+    return AgentResponse(**agent_fields(a))
 
 
 def to_detail(a: Agent) -> AgentDetailResponse:
-    return AgentDetailResponse(
-        id=str(a.id), name=a.name, bio=a.bio, avatar_url=a.avatar_url,
-        personality=a.personality, emotion=a.emotion,
-        relationships=a.relationships, memories=a.memories,
-        memories_count=len(a.memories), current_plan=a.current_plan,
-        current_goal=a.current_goal, is_active=a.is_active,
-        system_prompt=a.system_prompt, created_at=a.created_at,
-        updated_at=a.updated_at,
-    )
+    return AgentDetailResponse(**detail_fields(a))
 
 
 async def _log(cat, msg, agent=None, **details):
@@ -45,7 +61,7 @@ async def _log(cat, msg, agent=None, **details):
         b.agent(str(agent.id), agent.name)
     for k, v in details.items():
         b.detail(k, v)
-    await b.build().insert()
+    await log_repo().insert(b.build())
 
 
 '''CRUD'''
@@ -64,45 +80,65 @@ async def create_agent(data: AgentCreate):
         builder.set_system_prompt(data.system_prompt)
 
     agent = builder.build()
-    await agent.insert()
+    await agent_repo().insert(agent)
     await _log(LogCategory.AGENT_CREATED, f"Создан: {agent.name}", agent)
     return to_response(agent)
 
 
+@router.post("/agents:bulk")
+async def bulk_create_agents(request: Request):
+    """Массовое создание из NDJSON в теле запроса (поток, порции insert_many).
+    Строки экспорта с "_id" сохраняют идентификаторы"""
+    result = await import_ndjson(request.stream())
+    await _log(LogCategory.AGENT_CREATED, f"Массовый импорт: {result['created']} агентов",
+               created=result["created"], kept_ids=result["kept_ids"], failed=result["failed"],
+               seconds=result["seconds"])
+    return result
+
+
+@router.get("/agents:export")
+async def export_agents(active_only: bool = False):
+    """Все агенты в NDJSON потоком с курсора (формат — как у агентов в снимке мира)"""
+    filename = f"agents-{datetime.utcnow():%Y%m%d-%H%M%S}.ndjson"
+    return StreamingResponse(export_ndjson(active_only), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 @router.get("/agents", response_model=AgentListResponse)
-async def list_agents(active_only: bool = False, skip: int = 0, limit: int = 20):
+async def list_agents(request: Request, active_only: bool = False, skip: int = 0, limit: int = 20):
+    tag = await world_versions.check(request, "agents")
     try:
-        q = {"is_active": True} if active_only else {}
-        agents = await Agent.find(q).skip(skip).limit(limit).to_list()
-        total = await Agent.find(q).count()
-        print(f"[API] GET /agents: найдено {total} агентов, возвращаем {len(agents)}")
-        return AgentListResponse(agents=[to_response(a) for a in agents], total=total)
+        agents = await agent_repo().find_all(active_only, skip, limit)
+        total = await agent_repo().count(active_only)
+        logger.debug("GET /agents: найдено %d агентов, возвращаем %d", total, len(agents))
+        return FastJSONResponse({"agents": [agent_fields(a) for a in agents], "total": total},
+                                headers=world_versions.headers(tag))
     except Exception as e:
-        print(f"[API] Ошибка в GET /agents: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Ошибка в GET /agents: %s", e)
         raise
 
 
 @router.get("/agents/{agent_id}", response_model=AgentDetailResponse)
-async def get_agent(agent_id: str):
-    agent = await Agent.get(PydanticObjectId(agent_id))
+async def get_agent(agent_id: str, request: Request):
+    tag = await world_versions.check(request, "agents", agent_id)
+    agent = await agent_repo().get(agent_id)
     if not agent:
         raise HTTPException(404, "Агент не найден")
-    return to_detail(agent)
+    return FastJSONResponse(detail_fields(agent), headers=world_versions.headers(tag))
 
 
 @router.patch("/agents/{agent_id}", response_model=AgentResponse)
 async def update_agent(agent_id: str, data: AgentUpdate):
-    agent = await Agent.get(PydanticObjectId(agent_id))
-    if not agent:
-        raise HTTPException(404, "Агент не найден")
-
     fields = data.model_dump(exclude_unset=True)
     fields["updated_at"] = datetime.utcnow()
-    for k, v in fields.items():
-        setattr(agent, k, v)
-    await agent.save()
+
+    def apply(agent: Agent):
+        for k, v in fields.items():
+            setattr(agent, k, v)
+
+    agent = await mutate_agent(agent_id, apply)
+    if not agent:
+        raise HTTPException(404, "Агент не найден")
 
     await _log(LogCategory.AGENT_UPDATED, f"Обновлён: {agent.name}", agent, fields=list(fields.keys()))
     return to_response(agent)
@@ -110,28 +146,32 @@ async def update_agent(agent_id: str, data: AgentUpdate):
 
 @router.delete("/agents/{agent_id}", status_code=204)
 async def delete_agent(agent_id: str):
-    agent = await Agent.get(PydanticObjectId(agent_id))
+    agent = await agent_repo().get(agent_id)
     if not agent:
         raise HTTPException(404, "Агент не найден")
     await _log(LogCategory.AGENT_DELETED, f"Удалён: {agent.name}", agent)
-    await agent.delete()
+    await agent_repo().delete(agent_id)
+    await record_deletion(agent)
 
 
 '''Настроение'''
 
 @router.patch("/agents/{agent_id}/mood", response_model=AgentResponse)
 async def update_mood(agent_id: str, data: MoodUpdate):
-    agent = await Agent.get(PydanticObjectId(agent_id))
+    seen = {}
+
+    def apply(agent: Agent):
+        seen["old"] = agent.emotion.mood
+        agent.emotion.mood = data.mood
+        if data.energy is not None: agent.emotion.energy = data.energy
+        if data.stress is not None: agent.emotion.stress = data.stress
+        if data.happiness is not None: agent.emotion.happiness = data.happiness
+        agent.updated_at = datetime.utcnow()
+
+    agent = await mutate_agent(agent_id, apply)
     if not agent:
         raise HTTPException(404, "Агент не найден")
-
-    old = agent.emotion.mood
-    agent.emotion.mood = data.mood
-    if data.energy is not None: agent.emotion.energy = data.energy
-    if data.stress is not None: agent.emotion.stress = data.stress
-    if data.happiness is not None: agent.emotion.happiness = data.happiness
-    agent.updated_at = datetime.utcnow()
-    await agent.save()
+    old = seen["old"]
 
     event = (EventBuilder()
         .set_type(EventType.MOOD_CHANGE)
@@ -141,7 +181,7 @@ async def update_mood(agent_id: str, data: MoodUpdate):
         .add_meta("old_mood", old.value)
         .add_meta("new_mood", data.mood.value)
         .build())
-    await event.insert()
+    await event_repo().insert(event)
     await _log(LogCategory.MOOD_CHANGED, f"{agent.name}: {old.value} → {data.mood.value}", agent)
     return to_response(agent)
 
@@ -150,27 +190,27 @@ async def update_mood(agent_id: str, data: MoodUpdate):
 
 @router.patch("/agents/{agent_id}/relationship", response_model=AgentResponse)
 async def update_relationship(agent_id: str, data: RelationshipUpdate):
-    agent = await Agent.get(PydanticObjectId(agent_id))
-    if not agent:
-        raise HTTPException(404, "Агент не найден")
-    target = await Agent.get(PydanticObjectId(data.target_agent_id))
+    target = await agent_repo().get(data.target_agent_id)
     if not target:
         raise HTTPException(404, "Целевой агент не найден")
 
-    rel = next((r for r in agent.relationships if r.agent_id == data.target_agent_id), None)
-    if rel:
-        rel.sympathy = max(-1.0, min(1.0, rel.sympathy + data.sympathy_delta))
-        if data.description: rel.description = data.description
-        rel.last_interaction = datetime.utcnow()
-    else:
-        agent.relationships.append(Relationship(
-            agent_id=data.target_agent_id, agent_name=target.name,
-            sympathy=max(-1.0, min(1.0, data.sympathy_delta)),
-            description=data.description or "", last_interaction=datetime.utcnow(),
-        ))
-
-    agent.updated_at = datetime.utcnow()
-    await agent.save()
+    def apply(agent: Agent):
+        rel = next((r for r in agent.relationships if r.agent_id == data.target_agent_id), None)
+        if rel:
+            rel.sympathy = max(-1.0, min(1.0, rel.sympathy + data.sympathy_delta))
+            if data.description: rel.description = data.description
+            rel.last_interaction = datetime.utcnow()
+        else:
+            agent.relationships.append(Relationship(
+                agent_id=data.target_agent_id, agent_name=target.name,
+                sympathy=max(-1.0, min(1.0, data.sympathy_delta)),
+                description=data.description or "", last_interaction=datetime.utcnow(),
+            ))
+        agent.updated_at = datetime.utcnow()
+
+    agent = await mutate_agent(agent_id, apply)
+    if not agent:
+        raise HTTPException(404, "Агент не найден")
 
     event = (EventBuilder()
         .set_type(EventType.RELATIONSHIP)
@@ -178,7 +218,7 @@ async def update_relationship(agent_id: str, data: RelationshipUpdate):
         .set_source(str(agent.id), agent.name)
         .set_target(str(target.id), target.name)
         .build())
-    await event.insert()
+    await event_repo().insert(event)
     await _log(LogCategory.RELATIONSHIP_CHANGED, f"{agent.name} → {target.name}", agent)
     return to_response(agent)
 
@@ -186,92 +226,146 @@ async def update_relationship(agent_id: str, data: RelationshipUpdate):
 
 @router.post("/agents/{agent_id}/memory", response_model=AgentDetailResponse)
 async def add_memory(agent_id: str, data: MemoryAdd):
-    agent = await Agent.get(PydanticObjectId(agent_id))
-    if not agent:
-        raise HTTPException(404, "Агент не найден")
+    memory = Memory(content=data.content, importance=data.importance, related_agent_id=data.related_agent_id)
 
-    agent.memories.append(Memory(content=data.content, importance=data.importance, related_agent_id=data.related_agent_id))
+    def apply(agent: Agent):
+        agent.memories.append(memory)
+        trim_memories(agent)
+        agent.updated_at = datetime.utcnow()
 
-    if len(agent.memories) > MAX_MEMORIES:
-        agent.memories.sort(key=lambda m: m.importance)
-        old = agent.memories[:len(agent.memories) - MAX_MEMORIES]
-        summary = Memory(content="[Сводка] " + "; ".join(m.content[:60] for m in old[:5]), importance=0.3)
-        agent.memories = [summary] + agent.memories[len(old):]
-
-    agent.updated_at = datetime.utcnow()
-    await agent.save()
+    agent = await mutate_agent(agent_id, apply)
+    if not agent:
+        raise HTTPException(404, "Агент не найден")
     await _log(LogCategory.MEMORY_ADDED, f"Память: {data.content[:50]}", agent)
     return to_detail(agent)
 
 
 @router.get("/agents/{agent_id}/memories")
 async def get_memories(agent_id: str, min_importance: float = Query(0.0, ge=0.0, le=1.0)):
-    agent = await Agent.get(PydanticObjectId(agent_id))
+    agent = await agent_repo().get(agent_id)
     if not agent:
         raise HTTPException(404, "Агент не найден")
     mems = sorted([m for m in agent.memories if m.importance >= min_importance], key=lambda m: m.timestamp, reverse=True)
     return {"memories": mems, "total": len(mems)}
 
 
+'''История состояния'''
+
+@router.get("/agents/{agent_id}/history")
+async def get_history(agent_id: str, skip: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=500)):
+    events, total = await history_repo().for_agent(agent_id, skip, limit)
+    return {"events": [e.model_dump(exclude={"id", "revision_id"}) for e in events], "total": total}
+
+
+@router.get("/agents/{agent_id}/at", response_model=AgentDetailResponse)
+async def get_agent_at(agent_id: str, at: datetime = Query(..., description="момент мирового времени (UTC)")):
+    agent = await rebuild_agent(agent_id, at)
+    if not agent:
+        raise HTTPException(404, "Нет истории агента на этот момент")
+    return to_detail(agent)
+
+
+@router.post("/agents/{agent_id}/revert", response_model=AgentDetailResponse)
+async def revert_agent(agent_id: str, at: datetime = Query(..., description="момент мирового времени (UTC)")):
+    """Вернуть агента в состояние на момент at. Откат — обычная запись:
+    он сам попадает в историю и его тоже можно откатить"""
+    past = await rebuild_agent(agent_id, at)
+    if not past:
+        raise HTTPException(404, "Нет истории агента на этот момент")
+
+    def apply(agent: Agent):
+        for name in Agent.model_fields:
+            if name not in ("id", "revision_id", "revision", "created_at"):
+                setattr(agent, name, getattr(past, name))
+        agent.updated_at = datetime.utcnow()
+
+    agent = await mutate_agent(agent_id, apply)
+    if not agent:
+        raise HTTPException(404, "Агент не найден")
+    await _log(LogCategory.AGENT_UPDATED, f"Откат: {agent.name} на {at.isoformat()}", agent, revision=past.revision)
+    return to_detail(agent)
+
+
 '''Граф отношений'''
 
 @router.get("/agents/graph/relationships", response_model=RelationshipGraphResponse)
-async def get_graph():
-    agents = await Agent.find({"is_active": True}).to_list()
-    nodes = [RelationshipGraphNode(id=str(a.id), name=a.name, mood=a.emotion.mood, avatar_url=a.avatar_url) for a in agents]
-
-    # Создаем словарь для быстрого поиска агентов по ID
-    agents_dict = {str(a.id): a for a in agents}
-    
-    # Словарь для хранения связей с учетом обеих сторон
-    edges_dict = {}
-    
+async def get_graph(request: Request):
+    """Граф отношений активных агентов. Связь пары — одна, симпатия — среднее
+    двух сторон (или одной, если другая агента не знает)"""
+    tag = await world_versions.check(request, "agents")
+    agents = await agent_repo().find_all(active_only=True)
+    nodes = [{"id": str(a.id), "name": a.name, "mood": a.emotion.mood, "avatar_url": a.avatar_url} for a in agents]
+
+    sympathy = {(str(a.id), r.agent_id): r.sympathy for a in agents for r in a.relationships}
+    edges: dict[tuple[str, str], dict] = {}
     for a in agents:
+        source = str(a.id)
         for r in a.relationships:
-            # Создаем уникальный ключ для связи (независимо от направления)
-            key = tuple(sorted([str(a.id), r.agent_id]))
-            key_str = f"{key[0]}-{key[1]}"
-            
-            if key_str not in edges_dict:
-                # Проверяем обратную связь
-                target_agent = agents_dict.get(r.agent_id)
-                reverse_sympathy = 0.0
-                reverse_rel = None
-                if target_agent:
-                    reverse_rel = next((rel for rel in target_agent.relationships if rel.agent_id == str(a.id)), None)
-                    if reverse_rel:
-                        reverse_sympathy = reverse_rel.sympathy
-                
-                # Вычисляем среднее значение симпатии (или используем прямое, если обратного нет)
-                if reverse_rel:
-                    avg_sympathy = (r.sympathy + reverse_sympathy) / 2
-                else:
-                    avg_sympathy = r.sympathy
-                
-                edges_dict[key_str] = RelationshipGraphEdge(
-                    source=str(a.id),
-                    target=r.agent_id,
-                    sympathy=avg_sympathy,
-                    description=r.description or "знакомый"
-                )
-    
-    edges = list(edges_dict.values())
-    print(f"[GRAPH] Возвращаем граф: {len(nodes)} узлов, {len(edges)} связей")
-    for edge in edges:
-        print(f"[GRAPH] Связь: {edge.source} -> {edge.target}, симпатия: {edge.sympathy:.2f}")
-    return RelationshipGraphResponse(nodes=nodes, edges=edges)
+            key = (source, r.agent_id) if source < r.agent_id else (r.agent_id, source)
+            if key in edges:
+                continue
+            reverse = sympathy.get((r.agent_id, source))
+            edges[key] = {"source": source, "target": r.agent_id,
+                          "sympathy": r.sympathy if reverse is None else (r.sympathy + reverse) / 2,
+                          "description": r.description or "знакомый"}
+
+    logger.debug("Граф: %d узлов, %d связей", len(nodes), len(edges))
+    return FastJSONResponse({"nodes": nodes, "edges": list(edges.values())}, headers=world_versions.headers(tag))
 
 
 '''Управление скоростью времени'''
 
 @router.get("/world/time-speed")
 async def get_time_speed():
-    from app.services.world_state import get_time_speed
-    return {"time_speed": get_time_speed()}
+    return {"time_speed": await sync_time_speed()}
 
 
 @router.post("/world/time-speed")
 async def set_time_speed(speed: float = Query(ge=0.1, le=5.0)):
-    from app.services.world_state import set_time_speed, get_time_speed
-    set_time_speed(speed)
-    return {"time_speed": get_time_speed(), "message": f"Скорость времени установлена: {speed}x"}
+    return {"time_speed": await publish_time_speed(speed), "message": f"Скорость времени установлена: {speed}x"}
+
+
+@router.get("/world/lifecycle-stats")
+async def lifecycle_stats():
+    flushes = FLUSH_STATS["flushes"]
+    return {
+        "lifecycle": dict(STATS),
+        "flush": {**FLUSH_STATS, "avg_ms": round(FLUSH_STATS["total_ms"] / flushes, 3) if flushes else 0.0},
+        "occ": {**OCC_STATS, "conflict_rate": conflict_rate()},
+        "history": dict(HISTORY_STATS),
+    }
+
+
+@router.get("/world/leases")
+async def lifecycle_leases():
+    return {"partitions": NUM_PARTITIONS, "leases": await lease_table()}
+
+
+'''Снимки мира'''
+
+@router.post("/world/snapshots", status_code=201)
+async def create_snapshot(name: str | None = Query(None, max_length=100),
+                          events: int = Query(10000, ge=0, le=1_000_000)):
+    """Записать мир (агенты с отношениями и памятью, последние события) в SNAPSHOT_DIR.
+    Восстановление — python -m app.snapshot restore"""
+    name = name or f"world-{datetime.utcnow():%Y%m%d-%H%M%S}"
+    try:
+        path = snapshot_path(name)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    result = await save_snapshot(path, events)
+    await _log(LogCategory.SYSTEM, f"Снимок мира: {path}", agents=result["agents"], events=result["events"])
+    return result
+
+
+@router.get("/world/snapshots")
+async def get_snapshots():
+    return {"snapshots": list_snapshots()}
+
+
+'''Отладка'''
+
+@router.get("/debug/stalls")
+async def get_stalls(limit: int = Query(20, ge=1, le=100)):
+    """Последние зависания цикла событий со стеком виновника (app.services.stall_watchdog)"""
+    return {"stats": dict(STALL_STATS), "stalls": recent_stalls(limit)}
@@ -1,21 +1,39 @@
 from fastapi import APIRouter, HTTPException
-from beanie import PydanticObjectId
-from datetime import datetime
+from fastapi.responses import StreamingResponse
+from bson import ObjectId
+import asyncio
+import json
+import logging
+import time
 
-from app.models.agent import Agent, Memory, Relationship
+from app.models.agent import Agent, Memory, Mood, Relationship
 from app.models.event import EventType
 from app.models.log import LogLevel, LogCategory
+from app.services import llm_budget
 from app.services.builder import EventBuilder, LogBuilder
 from app.services.gigachat_service import chat, reflect, dialogue
-from app.schemas.schemas import SendMessage, ChatResponse, ReflectionResponse, DialogueResponse
+from app.services.llm_usage import usage_source
+from app.services.memories import trim_memories
+from app.services.world_state import get_params, now
+from app.services.write_batch import WriteBatch
+from app.db.repository import agent_repo, event_repo, log_repo
+from app.schemas.schemas import SendMessage, BroadcastMessage, ChatResponse, ReflectionResponse, DialogueResponse
 
 router = APIRouter(prefix="/text", tags=["Text"])
+logger = logging.getLogger(__name__)
 
 
-async def update_relationship_after_interaction(agent: Agent, target_agent_id: str, message: str, is_positive: bool = True):
-    """Автоматически обновляет отношения между агентами после взаимодействия"""
+
+async def update_relationship_after_interaction(agent: Agent, target_agent_id: str, message: str, is_positive: bool = True,
+                                               batch: WriteBatch = None):
+    """Автоматически обновляет отношения между агентами после взаимодействия.
+    С batch цель берется из пакета и изменения пишутся при его сбросе;
+    исходного агента сохраняет вызывающий код."""
     if not target_agent_id:
         return None
+    own_batch = batch is None
+    if own_batch:
+        batch = WriteBatch()
     
     # Расширенный анализ тона сообщения
     positive_words = ['спасибо', 'благодарю', 'отлично', 'хорошо', 'рад', 'нравится', 'люблю', 'друг', 'помощь', 'приятно', 'замечательно', 'прекрасно', 'весело', 'интересно', 'классно']
@@ -34,21 +52,22 @@ async def update_relationship_after_interaction(agent: Agent, target_agent_id: s
     rude_count = sum(1 for word in rude_words if word in message_lower)
     
     # Определяем изменение симпатии на основе тона
+    params = get_params()
     if aggressive_count > 0 or rude_count > 0:
         # Агрессивное или грубое взаимодействие - сильное негативное изменение
-        sympathy_delta = -0.2 - (aggressive_count * 0.1) - (rude_count * 0.15)
+        sympathy_delta = params.sympathy_aggressive_base - (aggressive_count * 0.1) - (rude_count * 0.15)
         is_positive = False
     elif offended_count > 0:
         # Обиженное взаимодействие - среднее негативное изменение
-        sympathy_delta = -0.15 - (offended_count * 0.08)
+        sympathy_delta = params.sympathy_offended_base - (offended_count * 0.08)
         is_positive = False
     elif negative_count > positive_count:
         # Негативное взаимодействие
-        sympathy_delta = -0.1 - (negative_count * 0.05)
+        sympathy_delta = params.sympathy_negative_base + negative_count * params.sympathy_negative_per_word
         is_positive = False
     elif positive_count > negative_count:
         # Позитивное взаимодействие
-        sympathy_delta = 0.1 + (positive_count * 0.05)
+        sympathy_delta = params.sympathy_positive_base + positive_count * params.sympathy_positive_per_word
         is_positive = True
     else:
         # Нейтральное взаимодействие
@@ -59,13 +78,13 @@ async def update_relationship_after_interaction(agent: Agent, target_agent_id: s
     if rel and rel.sympathy < -0.3:
         # Если отношения уже плохие, негативные взаимодействия сильнее влияют
         if sympathy_delta < 0:
-            sympathy_delta *= 1.3
+            sympathy_delta *= params.sympathy_hostile_amplifier
     
     # Ограничиваем изменение
     sympathy_delta = max(-0.4, min(0.3, sympathy_delta))
     
     # Получаем целевого агента
-    target = await Agent.get(PydanticObjectId(target_agent_id))
+    target = await batch.get_agent(target_agent_id)
     if not target:
         return None
     
@@ -73,14 +92,14 @@ async def update_relationship_after_interaction(agent: Agent, target_agent_id: s
     rel = next((r for r in agent.relationships if r.agent_id == target_agent_id), None)
     if rel:
         rel.sympathy = max(-1.0, min(1.0, rel.sympathy + sympathy_delta))
-        rel.last_interaction = datetime.utcnow()
+        rel.last_interaction = now()
     else:
         agent.relationships.append(Relationship(
             agent_id=target_agent_id,
             agent_name=target.name,
             sympathy=max(-1.0, min(1.0, sympathy_delta)),
             description="",
-            last_interaction=datetime.utcnow()
+            last_interaction=now()
         ))
     
     # Обновляем отношения в ОБОИХ направлениях
@@ -88,89 +107,49 @@ async def update_relationship_after_interaction(agent: Agent, target_agent_id: s
     target_rel = next((r for r in target.relationships if r.agent_id == str(agent.id)), None)
     if target_rel:
         # Взаимное изменение (обычно меньше, чем прямое)
-        mutual_delta = sympathy_delta * 0.5  # Взаимное изменение в 2 раза меньше
+        mutual_delta = sympathy_delta * params.sympathy_mutual_factor  # Взаимное изменение меньше прямого
         target_rel.sympathy = max(-1.0, min(1.0, target_rel.sympathy + mutual_delta))
-        target_rel.last_interaction = datetime.utcnow()
+        target_rel.last_interaction = now()
     else:
         # Создаем обратное отношение
-        mutual_delta = sympathy_delta * 0.5
+        mutual_delta = sympathy_delta * params.sympathy_mutual_factor
         target.relationships.append(Relationship(
             agent_id=str(agent.id),
             agent_name=agent.name,
             sympathy=max(-1.0, min(1.0, mutual_delta)),
             description="",
-            last_interaction=datetime.utcnow()
+            last_interaction=now()
         ))
-    await target.save()
+    batch.mark(target)
     
     # Создаем событие об изменении отношений, если изменение значительное
     if abs(sympathy_delta) > 0.05:
         ev = EventBuilder().set_type(EventType.RELATIONSHIP).set_description(
             f"{agent.name} ↔ {target.name}: {sympathy_delta:+.2f}"
         ).set_source(str(agent.id), agent.name).set_target(str(target.id), target.name).build()
-        await ev.insert()
-        await _log(LogCategory.RELATIONSHIP_CHANGED, f"{agent.name} ↔ {target.name}: {sympathy_delta:+.2f}", agent)
-    
+        batch.add_event(ev)
+        batch.add_log(_make_log(LogCategory.RELATIONSHIP_CHANGED, f"{agent.name} ↔ {target.name}: {sympathy_delta:+.2f}", agent))
+
+    if own_batch:
+        await batch.flush()
     return sympathy_delta
 
 
-async def _log(cat, msg, agent=None, lvl=LogLevel.INFO, **details):
+def _make_log(cat, msg, agent=None, lvl=LogLevel.INFO, **details):
     b = LogBuilder().level(lvl).category(cat).message(msg)
     if agent:
         b.agent(str(agent.id), agent.name)
     for k, v in details.items():
         b.detail(k, v)
-    await b.build().insert()
+    return b.build()
 
 
-@router.post("/agents/{agent_id}/message", response_model=ChatResponse)
-async def send_message(agent_id: str, data: SendMessage):
-    agent = await Agent.get(PydanticObjectId(agent_id))
-    if not agent:
-        raise HTTPException(404, "Агент не найден")
-
-    from_name = "Пользователь"
-    if not data.from_user and data.from_agent_id:
-        sender = await Agent.get(PydanticObjectId(data.from_agent_id))
-        from_name = sender.name if sender else "Неизвестный"
-
-    await _log(LogCategory.LLM_REQUEST, f"Запрос к GigaChat: {agent.name}", agent, user_message=data.content)
-
-    ev_type = EventType.USER_MESSAGE if data.from_user else EventType.CHAT
-    ev_in = EventBuilder().set_type(ev_type).set_description(f"{from_name} → {agent.name}").set_target(str(agent.id), agent.name).set_content(data.content).build()
-    if not data.from_user and data.from_agent_id:
-        ev_in.agent_id = data.from_agent_id
-        ev_in.agent_name = from_name
-    await ev_in.insert()
-
-    # Структурированное воспоминание о полученном сообщении
-    memory_content = f"[Сообщение] От {from_name}: \"{data.content[:150]}\""
-    agent.memories.append(Memory(
-        content=memory_content,
-        importance=0.6,
-        related_agent_id=data.from_agent_id,
-        timestamp=datetime.utcnow()
-    ))
-
-    try:
-        reply = await chat(agent, data.content)
-    except Exception as e:
-        await _log(LogCategory.LLM_ERROR, f"Ошибка: {e}", agent, lvl=LogLevel.ERROR)
-        reply = f"[Ошибка GigaChat: {e}]"
+async def _log(cat, msg, agent=None, lvl=LogLevel.INFO, **details):
+    await log_repo().insert(_make_log(cat, msg, agent, lvl, **details))
 
-    ev_out = EventBuilder().set_type(EventType.CHAT).set_description(f"{agent.name} → {from_name}").set_source(str(agent.id), agent.name).set_content(reply).build()
-    await ev_out.insert()
 
-    # Структурированное воспоминание о ответе
-    memory_content = f"[Ответ] Ответил {from_name}: \"{reply[:150]}\""
-    agent.memories.append(Memory(
-        content=memory_content,
-        importance=0.5,
-        timestamp=datetime.utcnow()
-    ))
-    
-    # Улучшенное динамическое изменение настроения на основе ответа
-    from app.models.agent import Mood
+def _react_to_reply(agent: Agent, message: str, reply: str) -> Mood:
+    """Изменить эмоции агента по его ответу и по тону сообщения. Возвращает прежнее настроение"""
     old_mood = agent.emotion.mood
     reply_lower = reply.lower()
     
@@ -186,7 +165,7 @@ async def send_message(agent_id: str, data: SendMessage):
     angry_count = sum(1 for word in angry_words if word in reply_lower)
     
     # Анализируем также само сообщение пользователя на негатив
-    message_lower = data.content.lower()
+    message_lower = message.lower()
     user_aggressive = any(word in message_lower for word in ['ненавижу', 'презираю', 'злой', 'тупой', 'идиот', 'дурак', 'заткнись', 'уйди', 'отстань', 'бесит'])
     user_offensive = any(word in message_lower for word in ['обидел', 'несправедливо', 'предал', 'обманул'])
     user_negative = any(word in message_lower for word in ['плохо', 'грустно', 'не нравится', 'неприятно'])
@@ -215,43 +194,210 @@ async def send_message(agent_id: str, data: SendMessage):
         agent.emotion.stress = min(1.0, agent.emotion.stress + 0.1)
         if agent.emotion.happiness < 0.3:
             agent.emotion.mood = Mood.SAD
+    return old_mood
+
+
+@router.post("/agents/{agent_id}/message", response_model=ChatResponse)
+async def send_message(agent_id: str, data: SendMessage):
+    agent = await agent_repo().get(agent_id)
+    if not agent:
+        raise HTTPException(404, "Агент не найден")
+    # Ответ LLM долгий: изменения копятся в пакете и при конфликте сливаются
+    batch = WriteBatch([agent])
+
+    from_name = "Пользователь"
+    if not data.from_user and data.from_agent_id:
+        sender = await agent_repo().get(data.from_agent_id)
+        from_name = sender.name if sender else "Неизвестный"
+
+    await _log(LogCategory.LLM_REQUEST, f"Запрос к GigaChat: {agent.name}", agent, user_message=data.content)
+
+    ev_type = EventType.USER_MESSAGE if data.from_user else EventType.CHAT
+    ev_in = EventBuilder().set_type(ev_type).set_description(f"{from_name} → {agent.name}").set_target(str(agent.id), agent.name).set_content(data.content).build()
+    if not data.from_user and data.from_agent_id:
+        ev_in.agent_id = data.from_agent_id
+        ev_in.agent_name = from_name
+    await event_repo().insert(ev_in)
+    if data.from_user:
+        # Собеседник пользователя получает бюджет LLM жизненного цикла в первую очередь
+        await llm_budget.note_attention(agent.id, now())
+
+    # Структурированное воспоминание о полученном сообщении
+    memory_content = f"[Сообщение] От {from_name}: \"{data.content[:150]}\""
+    agent.memories.append(Memory(
+        content=memory_content,
+        importance=0.6,
+        related_agent_id=data.from_agent_id,
+        timestamp=now()
+    ))
+
+    try:
+        reply = await chat(agent, data.content)
+    except Exception as e:
+        await _log(LogCategory.LLM_ERROR, f"Ошибка: {e}", agent, lvl=LogLevel.ERROR)
+        reply = f"[Ошибка GigaChat: {e}]"
+
+    ev_out = EventBuilder().set_type(EventType.CHAT).set_description(f"{agent.name} → {from_name}").set_source(str(agent.id), agent.name).set_content(reply).build()
+    await event_repo().insert(ev_out)
+
+    # Структурированное воспоминание о ответе
+    memory_content = f"[Ответ] Ответил {from_name}: \"{reply[:150]}\""
+    agent.memories.append(Memory(
+        content=memory_content,
+        importance=0.5,
+        timestamp=now()
+    ))
+    
+    # Улучшенное динамическое изменение настроения на основе ответа
+    old_mood = _react_to_reply(agent, data.content, reply)
     
-    # Сохраняем изменения настроения СРАЗУ после изменения
     if old_mood != agent.emotion.mood:
-        print(f"[TEXT_CONTROLLER] {agent.name} изменил настроение: {old_mood} -> {agent.emotion.mood}")
-        agent.updated_at = datetime.utcnow()
-        await agent.save()
+        logger.info("%s изменил настроение: %s -> %s", agent.name, old_mood.value, agent.emotion.mood.value)
     
     # Обновляем отношения, если сообщение от другого агента
     if not data.from_user and data.from_agent_id:
-        await update_relationship_after_interaction(agent, data.from_agent_id, reply, is_positive=True)
+        await update_relationship_after_interaction(agent, data.from_agent_id, reply, is_positive=True, batch=batch)
     
     # Автоматическая суммаризация памяти при превышении лимита
-    MAX_MEMORIES = 50
-    if len(agent.memories) > MAX_MEMORIES:
-        agent.memories.sort(key=lambda m: m.importance)
-        old = agent.memories[:len(agent.memories) - MAX_MEMORIES]
-        summary = Memory(
-            content="[Сводка] " + "; ".join(m.content[:60] for m in old[:5]),
-            importance=0.3,
-            timestamp=datetime.utcnow()
-        )
-        agent.memories = [summary] + agent.memories[len(old):]
+    trim_memories(agent)
     
-    agent.updated_at = datetime.utcnow()
-    await agent.save()
-    print(f"[TEXT_CONTROLLER] {agent.name} сохранен: настроение={agent.emotion.mood}, счастье={agent.emotion.happiness:.2f}, доброжелательность={agent.personality.agreeableness:.2f}")
+    agent.updated_at = now()
+    batch.mark(agent)
+    await batch.flush()
+    logger.debug("%s сохранен: настроение=%s, счастье=%.2f, доброжелательность=%.2f", agent.name,
+                 agent.emotion.mood.value, agent.emotion.happiness, agent.personality.agreeableness)
 
     await _log(LogCategory.LLM_RESPONSE, f"Ответ: {agent.name}", agent, reply=reply[:200])
 
     return ChatResponse(agent_id=str(agent.id), agent_name=agent.name, user_message=data.content, agent_reply=reply, event_id=str(ev_out.id))
 
 
+async def _broadcast_targets(data: BroadcastMessage) -> WriteBatch:
+    if data.target == "ids":
+        batch = WriteBatch()
+        ids = [i for i in data.agent_ids if ObjectId.is_valid(i)]
+        for agent, base in await agent_repo().load_with_base(ids):
+            batch.track(agent, base=base)
+        return batch
+    batch = await WriteBatch.load_active()
+    if data.target == "mood":
+        moods = set(data.moods)
+        batch.agents = {k: a for k, a in batch.agents.items() if a.emotion.mood in moods}
+    return batch
+
+
+async def _broadcast_reply(agent: Agent, content: str, batch: WriteBatch) -> dict:
+    """Ответ одного агента на объявление; изменения — в пакет"""
+    agent.memories.append(Memory(
+        content=f"[Объявление] \"{content[:150]}\"",
+        importance=0.6,
+        timestamp=now()
+    ))
+    error = None
+    try:
+        reply = await chat(agent, content)
+    except Exception as e:
+        error = str(e)
+        reply = f"[Ошибка GigaChat: {e}]"
+        batch.add_log(_make_log(LogCategory.LLM_ERROR, f"Ошибка: {e}", agent, lvl=LogLevel.ERROR))
+
+    batch.add_event(EventBuilder().set_type(EventType.CHAT).set_description(f"{agent.name} → Пользователь")
+                    .set_source(str(agent.id), agent.name).set_content(reply).add_meta("broadcast", True).build())
+    agent.memories.append(Memory(
+        content=f"[Ответ] Ответил на объявление: \"{reply[:150]}\"",
+        importance=0.5,
+        timestamp=now()
+    ))
+    old_mood = _react_to_reply(agent, content, reply)
+    trim_memories(agent)
+    agent.updated_at = now()
+    batch.mark(agent)
+    return {"agent_id": str(agent.id), "agent_name": agent.name, "reply": reply,
+            "mood": agent.emotion.mood.value, "old_mood": old_mood.value, "error": error}
+
+
+# Рассылки доводятся до конца, даже если клиент отключился от потока
+_broadcasts: set[asyncio.Task] = set()
+BROADCAST_FLUSH_EVERY = 500
+
+
+async def _run_broadcast(data: BroadcastMessage, batch: WriteBatch, out: asyncio.Queue):
+    started = time.perf_counter()
+    agents = list(batch.agents.values())
+    batch.add_event(EventBuilder().set_type(EventType.USER_MESSAGE).set_description(f"Объявление для {len(agents)} агентов")
+                    .set_content(data.content).add_meta("target", data.target).add_meta("recipients", len(agents)).build())
+    # Ответы параллельно, не больше max_parallel_steps сразу (как шаги тика):
+    # воркеры берут агентов из общего итератора, задачи на всех не создаются.
+    # Вызовы идут из бюджета LLM жизненного цикла (источник "broadcast")
+    queue = iter(agents)
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def worker():
+        with usage_source("broadcast"):
+            for agent in queue:
+                try:
+                    results.put_nowait(await _broadcast_reply(agent, data.content, batch))
+                except Exception as e:
+                    results.put_nowait(e)
+
+    parallel = min(len(agents), max(1, get_params().max_parallel_steps))
+    workers = [asyncio.create_task(worker()) for _ in range(parallel)]
+    summary = {"done": True, "recipients": len(agents), "replies": 0, "errors": 0, "mood_changed": 0}
+    try:
+        for _ in agents:
+            item = await results.get()
+            if isinstance(item, Exception):
+                logger.error("Ошибка рассылки: %s", item)
+                summary["errors"] += 1
+                continue
+            summary["replies"] += 1
+            summary["errors"] += item["error"] is not None
+            summary["mood_changed"] += item["mood"] != item["old_mood"]
+            out.put_nowait(item)
+            if batch.pending >= BROADCAST_FLUSH_EVERY:
+                await batch.flush()
+        summary["seconds"] = round(time.perf_counter() - started, 3)
+        batch.add_log(_make_log(LogCategory.MESSAGE_SENT, f"Объявление: {len(agents)} агентов", **summary))
+        await batch.flush()
+        await llm_budget.settle()
+    except Exception as e:
+        logger.exception("Ошибка записи рассылки: %s", e)
+        summary["error"] = str(e)
+    finally:
+        for w in workers:
+            w.cancel()
+    out.put_nowait(summary)
+
+
+async def _stream_queue(out: asyncio.Queue):
+    while True:
+        item = await out.get()
+        yield json.dumps(item, ensure_ascii=False) + "\n"
+        if item.get("done"):
+            return
+
+
+@router.post("/broadcast")
+async def broadcast(data: BroadcastMessage):
+    """Сообщение многим агентам сразу. Ответы идут потоком NDJSON по мере
+    готовности, последняя строка — итог ("done": true). Все изменения
+    пишутся пакетами WriteBatch"""
+    batch = await _broadcast_targets(data)
+    if not batch.agents:
+        raise HTTPException(404, "Нет агентов для рассылки")
+    out: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(_run_broadcast(data, batch, out))
+    _broadcasts.add(task)
+    task.add_done_callback(_broadcasts.discard)
+    return StreamingResponse(_stream_queue(out), media_type="application/x-ndjson")
+
+
 @router.post("/agents/{agent_id}/reflect", response_model=ReflectionResponse)
 async def do_reflect(agent_id: str):
-    agent = await Agent.get(PydanticObjectId(agent_id))
+    agent = await agent_repo().get(agent_id)
     if not agent:
         raise HTTPException(404, "Агент не найден")
+    batch = WriteBatch([agent])
 
     try:
         result = await reflect(agent)
@@ -260,11 +406,12 @@ async def do_reflect(agent_id: str):
         raise HTTPException(500, f"Ошибка GigaChat: {e}")
 
     ev = EventBuilder().set_type(EventType.REFLECTION).set_description(f"{agent.name}: рефлексия").set_source(str(agent.id), agent.name).set_content(result).build()
-    await ev.insert()
+    await event_repo().insert(ev)
 
-    agent.memories.append(Memory(content=f"Рефлексия: {result}", importance=0.7))
-    agent.updated_at = datetime.utcnow()
-    await agent.save()
+    agent.memories.append(Memory(content=f"Рефлексия: {result}", importance=0.7, timestamp=now()))
+    agent.updated_at = now()
+    batch.mark(agent)
+    await batch.flush()
 
     await _log(LogCategory.REFLECTION, f"{agent.name}: рефлексия", agent)
     return ReflectionResponse(agent_id=str(agent.id), agent_name=agent.name, reflection=result)
@@ -272,10 +419,11 @@ async def do_reflect(agent_id: str):
 
 @router.post("/dialogue/{agent1_id}/{agent2_id}", response_model=DialogueResponse)
 async def do_dialogue(agent1_id: str, agent2_id: str, context: str = ""):
-    a1 = await Agent.get(PydanticObjectId(agent1_id))
-    a2 = await Agent.get(PydanticObjectId(agent2_id))
+    a1 = await agent_repo().get(agent1_id)
+    a2 = await agent_repo().get(agent2_id)
     if not a1 or not a2:
         raise HTTPException(404, "Агент не найден")
+    batch = WriteBatch([a1, a2])
 
     try:
         r1 = await dialogue(a1, a2, context)
@@ -286,14 +434,14 @@ async def do_dialogue(agent1_id: str, agent2_id: str, context: str = ""):
 
     for agent, reply, target in [(a1, r1, a2), (a2, r2, a1)]:
         ev = EventBuilder().set_type(EventType.CHAT).set_description(f"{agent.name} → {target.name}").set_source(str(agent.id), agent.name).set_target(str(target.id), target.name).set_content(reply).build()
-        await ev.insert()
+        await event_repo().insert(ev)
         # Структурированное воспоминание о диалоге
         memory_content = f"[Диалог] Общался с {target.name}: \"{reply[:150]}\""
         agent.memories.append(Memory(
             content=memory_content,
             importance=0.6,
             related_agent_id=str(target.id),
-            timestamp=datetime.utcnow()
+            timestamp=now()
         ))
         
         # Определяем, было ли взаимодействие позитивным или негативным
@@ -305,22 +453,17 @@ async def do_dialogue(agent1_id: str, agent2_id: str, context: str = ""):
         is_positive_interaction = not (any(word in reply_lower for word in aggressive_words + offended_words + negative_words))
         
         # Обновляем отношения между агентами после диалога (двусторонне)
-        await update_relationship_after_interaction(agent, str(target.id), reply, is_positive=is_positive_interaction)
+        await update_relationship_after_interaction(agent, str(target.id), reply, is_positive=is_positive_interaction, batch=batch)
         
         # Автоматическая суммаризация памяти при превышении лимита
-        MAX_MEMORIES = 50
-        if len(agent.memories) > MAX_MEMORIES:
-            agent.memories.sort(key=lambda m: m.importance)
-            old = agent.memories[:len(agent.memories) - MAX_MEMORIES]
-            summary = Memory(content="[Сводка] " + "; ".join(m.content[:60] for m in old[:5]), importance=0.3)
-            agent.memories = [summary] + agent.memories[len(old):]
+        trim_memories(agent)
         
-        await agent.save()
+        batch.mark(agent)
     
     # Обновляем данные обоих агентов после диалога
-    await a1.save()
-    await a2.save()
-    print(f"[TEXT_CONTROLLER] Диалог сохранен: {a1.name} (настроение={a1.emotion.mood}, счастье={a1.emotion.happiness:.2f}), {a2.name} (настроение={a2.emotion.mood}, счастье={a2.emotion.happiness:.2f})")
+    await batch.flush()
+    logger.debug("Диалог сохранен: %s (настроение=%s, счастье=%.2f), %s (настроение=%s, счастье=%.2f)",
+                 a1.name, a1.emotion.mood.value, a1.emotion.happiness, a2.name, a2.emotion.mood.value, a2.emotion.happiness)
 
     await _log(LogCategory.DIALOGUE, f"{a1.name} ↔ {a2.name}")
     return DialogueResponse(
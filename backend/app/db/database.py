@@ -3,25 +3,78 @@ from beanie import init_beanie
 from app.models.agent import Agent
 from app.models.event import Event
 from app.models.log import Log
+from app.models.lease import Lease
+from app.models.agent_history import AgentCheckpoint, AgentEvent
+from app.models.llm_usage import LlmCall, LlmUsageMinute
+from app.db.repository import set_storage, get_storage
+from app.services.metrics import MongoCommandMetrics
+import logging
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
+import time
 
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DATABASE_NAME", "virtual_world")
+# mongo — MongoDB-сервер; embedded — встроенное хранилище в процессе (app.db.embedded)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+EMBEDDED_DATA_DIR = os.getenv("EMBEDDED_DATA_DIR", "data")
+# 1 — не сверять индексы при подключении: их создает python -m app.migrate
+# (init_beanie на каждой коллекции делает list_indexes/create_indexes)
+SKIP_INDEX_CHECKS = os.getenv("DB_SKIP_INDEX_CHECKS", "0") == "1"
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_MODELS = [Agent, Event, Log, Lease, AgentEvent, AgentCheckpoint, LlmCall, LlmUsageMinute]
 
 client: AsyncIOMotorClient = None
 
 
-async def connect():
+async def connect(db_name: str = None, backend: str = None, persist: bool = True, skip_indexes: bool = None):
+    """Подключить хранилище. persist=False для встроенного хранилища —
+    только память, без журнала на диске (временные базы симуляций).
+    skip_indexes — не сверять индексы MongoDB (по умолчанию DB_SKIP_INDEX_CHECKS)"""
     global client
-    client = AsyncIOMotorClient(MONGODB_URL)
-    await init_beanie(database=client[DB_NAME], document_models=[Agent, Event, Log])
-    print(f"MongoDB connected: {DB_NAME}")
+    started = time.perf_counter()
+    db_name = db_name or DB_NAME
+    backend = backend or STORAGE_BACKEND
+    if backend == "embedded":
+        from app.db.embedded import EmbeddedStorage, StubDatabase
+        await init_beanie(database=StubDatabase(), document_models=DOCUMENT_MODELS, skip_indexes=True)
+        storage = EmbeddedStorage(os.path.join(EMBEDDED_DATA_DIR, db_name) if persist else None)
+        await storage.open()
+        set_storage(storage)
+        logger.info("Встроенное хранилище подключено: %s%s", db_name, "" if persist else " (в памяти)")
+        return
+    if backend != "mongo":
+        raise ValueError(f"Неизвестный STORAGE_BACKEND: {backend}")
+
+    from app.db.mongo_repository import MongoStorage
+    if skip_indexes is None:
+        skip_indexes = SKIP_INDEX_CHECKS
+    client = AsyncIOMotorClient(MONGODB_URL, event_listeners=[MongoCommandMetrics()])
+    await init_beanie(database=client[db_name], document_models=DOCUMENT_MODELS, skip_indexes=skip_indexes)
+    set_storage(MongoStorage(client, db_name))
+    logger.info("MongoDB connected: %s (%.0f мс, индексы %s)", db_name,
+                (time.perf_counter() - started) * 1000, "не проверялись" if skip_indexes else "проверены")
+
+
+async def ensure_indexes(db_name: str = None, drop_unknown: bool = False) -> dict[str, list[str]]:
+    """Создать индексы всех коллекций (drop_unknown — удалить не описанные
+    в моделях). Возвращает имена индексов по коллекциям"""
+    db = AsyncIOMotorClient(MONGODB_URL)[db_name or DB_NAME]
+    try:
+        await init_beanie(database=db, document_models=DOCUMENT_MODELS, allow_index_dropping=drop_unknown)
+        return {m.Settings.name: sorted((await db[m.Settings.name].index_information()).keys())
+                for m in DOCUMENT_MODELS}
+    finally:
+        db.client.close()
 
 
 async def disconnect():
     global client
-    if client:
-        client.close()
+    try:
+        storage = get_storage()
+    except RuntimeError:
+        return
+    await storage.close()
+    set_storage(None)
+    client = None
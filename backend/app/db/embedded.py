@@ -0,0 +1,821 @@
+"""
+Встроенное хранилище: все данные в памяти процесса, долговечность —
+журнал упреждающей записи (WAL) и периодические снимки на диске.
+
+- Каждое изменение дописывается в буфер журнала (NDJSON). Фоновая задача
+  раз в EMBEDDED_FSYNC_INTERVAL сбрасывает буфер одним write + fsync
+  (групповой коммит): при падении теряется не больше этого интервала.
+- Каждые EMBEDDED_SNAPSHOT_EVERY записей (и при остановке) пишется
+  снимок всех данных, журнал переключается на новое поколение
+  wal.<N>.ndjson, старые поколения удаляются.
+- При старте читается снимок и поверх него проигрываются журналы
+  поколений не старше снимка.
+
+События и логи хранятся в порядке времени с вторичными индексами
+(участник, пара участников, тип; уровень, категория, агент), поэтому
+лента, between и фильтры логов не сканируют все данные.
+
+Хранилище рассчитано на один процесс: воркеры и --workers uvicorn
+требуют MongoDB.
+"""
+import asyncio
+import bisect
+import glob
+import itertools
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+from enum import Enum
+
+from beanie import PydanticObjectId
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from app.db.repository import (
+    AgentRepository, EventRepository, HistoryRepository, LogRepository, Storage, UsageRepository,
+)
+from app.models.agent import Agent
+from app.models.agent_history import AgentEvent
+from app.models.event import Event
+from app.models.llm_usage import LlmCall
+from app.models.log import Log
+from app.services import world_versions
+
+FSYNC_INTERVAL = float(os.getenv("EMBEDDED_FSYNC_INTERVAL", "0.05"))
+SNAPSHOT_EVERY = int(os.getenv("EMBEDDED_SNAPSHOT_EVERY", "50000"))
+VERSIONED = {"agents", "events"}  # коллекции с версиями для ETag (world_versions)
+
+logger = logging.getLogger(__name__)
+
+
+def _oid(value) -> PydanticObjectId | None:
+    try:
+        return PydanticObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Не сериализуется в JSON: {type(value).__name__}")
+
+
+def _dumps(record: dict) -> bytes:
+    return json.dumps(record, ensure_ascii=False, default=_json_default).encode() + b"\n"
+
+
+def _touched(op: str, collection: str, payload: dict) -> tuple[list, bool]:
+    """Элементы, чьи версии поднимает запись журнала, и сброс всех элементов
+    (world_versions.keys)"""
+    if op == "put":
+        doc = payload["doc"]
+        if collection == "agents":
+            return [doc["_id"]], False
+        return [doc.get("agent_id"), doc.get("target_agent_id")], False
+    if op == "del" and collection == "agents":
+        return [payload["id"]], False
+    # Удаление события (участники в журнале не записаны) и очистка — сброс
+    return [], True
+
+
+def _agent_doc(agent: Agent) -> dict:
+    return agent.model_dump(exclude={"id", "revision_id"})
+
+
+class TimeIndex:
+    """Список ключей (timestamp, seq, id), упорядоченный по времени,
+    с подсписками по значениям полей"""
+
+    def __init__(self):
+        self.all: list[tuple] = []
+        self.by: dict[str, dict[object, list[tuple]]] = {}
+
+    def add(self, key: tuple, fields: dict):
+        bisect.insort(self.all, key)
+        for name, values in fields.items():
+            bucket = self.by.setdefault(name, {})
+            for value in values:
+                if value is not None:
+                    bisect.insort(bucket.setdefault(value, []), key)
+
+    def remove(self, key: tuple, fields: dict):
+        _remove_sorted(self.all, key)
+        for name, values in fields.items():
+            for value in values:
+                keys = self.by.get(name, {}).get(value)
+                if keys is not None:
+                    _remove_sorted(keys, key)
+
+    def keys(self, name: str = None, value=None) -> list[tuple]:
+        if name is None:
+            return self.all
+        return self.by.get(name, {}).get(value, [])
+
+
+def _history_key(doc: dict) -> tuple:
+    return doc["revision"], doc.get("seq", 0)
+
+
+def _insert_ordered(items: list, item):
+    # История почти всегда дописывается по порядку ревизий
+    if not items or _history_key(items[-1]) <= _history_key(item):
+        items.append(item)
+    else:
+        bisect.insort(items, item, key=_history_key)
+
+
+def _call_time(call: dict) -> datetime:
+    return call["timestamp"]
+
+
+USAGE_KEY = ("minute", "kind", "source", "agent_id")
+
+
+def _usage_key(doc: dict) -> tuple:
+    return tuple(doc.get(k) for k in USAGE_KEY)
+
+
+def _remove_sorted(keys: list, key: tuple):
+    i = bisect.bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        keys.pop(i)
+
+
+def _page(keys: list[tuple], items: dict, predicate, skip: int, limit: int,
+          before: datetime = None) -> tuple[list, int]:
+    """Страница от новых к старым по упорядоченным ключам"""
+    end = bisect.bisect_left(keys, (before,)) if before else len(keys)
+    if predicate is None:
+        start = max(0, end - skip - limit) if limit else 0
+        page = [items[k[2]] for k in reversed(keys[start:max(0, end - skip)])]
+        return page, end
+    matched = (items[k[2]] for k in reversed(keys[:end]) if predicate(items[k[2]]))
+    total, page = 0, []
+    for item in matched:
+        if skip <= total and (not limit or len(page) < limit):
+            page.append(item)
+        total += 1
+    return page, total
+
+
+class EmbeddedEngine:
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self.agents: dict[PydanticObjectId, dict] = {}
+        self.events: dict[PydanticObjectId, Event] = {}
+        self.logs: dict[PydanticObjectId, Log] = {}
+        self.event_index = TimeIndex()
+        self.log_index = TimeIndex()
+        # История агентов: agent_id → события / чекпоинты (сырые документы) по порядку ревизий
+        self.agent_events: dict[str, list[dict]] = {}
+        self.checkpoints: dict[str, list[dict]] = {}
+        # Журнал расхода LLM: вызовы по времени и свертки по (minute, kind, source, agent_id)
+        self.llm_calls: list[dict] = []
+        self.usage_minutes: dict[tuple, dict] = {}
+        # id → ключ в индексе
+        self._event_keys: dict[PydanticObjectId, tuple] = {}
+        self._log_keys: dict[PydanticObjectId, tuple] = {}
+        self._seq = itertools.count()
+        self._generation = 0
+        self._buffer: list[bytes] = []
+        self._since_snapshot = 0
+        self._file = None
+        self._io_lock = asyncio.Lock()
+        self._snapshot_lock = asyncio.Lock()
+        self._flusher: asyncio.Task | None = None
+        # Массовая загрузка (восстановление снимка мира): журнал не пишется,
+        # в конце сразу делается снимок хранилища
+        self.bulk_loading = False
+
+    # --- индексы ---
+
+    @staticmethod
+    def _event_fields(e: Event) -> dict:
+        pair = tuple(sorted((e.agent_id, e.target_agent_id))) if e.agent_id and e.target_agent_id else None
+        participants = {e.agent_id, e.target_agent_id} - {None}
+        return {"agent": participants, "pair": [pair], "type": [e.event_type.value]}
+
+    @staticmethod
+    def _log_fields(l: Log) -> dict:
+        return {"level": [l.level.value], "category": [l.category.value], "agent": [l.agent_id]}
+
+    def _key(self, item) -> tuple:
+        return item.timestamp, next(self._seq), item.id
+
+    def put_event(self, event: Event):
+        self.events[event.id] = event
+        key = self._event_keys[event.id] = self._key(event)
+        self.event_index.add(key, self._event_fields(event))
+
+    def drop_event(self, event_id) -> bool:
+        event = self.events.pop(event_id, None)
+        if event is None:
+            return False
+        self.event_index.remove(self._event_keys.pop(event_id), self._event_fields(event))
+        return True
+
+    def clear_events(self):
+        self.events.clear()
+        self._event_keys.clear()
+        self.event_index = TimeIndex()
+
+    def put_log(self, log: Log):
+        self.logs[log.id] = log
+        key = self._log_keys[log.id] = self._key(log)
+        self.log_index.add(key, self._log_fields(log))
+
+    def drop_logs_before(self, cutoff: datetime) -> int:
+        before = len(self.logs)
+        self.logs = {k: l for k, l in self.logs.items() if l.timestamp >= cutoff}
+        self._log_keys = {k: key for k, key in self._log_keys.items() if k in self.logs}
+        self.log_index = TimeIndex()
+        for log_id, log in self.logs.items():
+            self.log_index.add(self._log_keys[log_id], self._log_fields(log))
+        return before - len(self.logs)
+
+    def clear_logs(self):
+        self.logs.clear()
+        self._log_keys.clear()
+        self.log_index = TimeIndex()
+
+    def put_agent_event(self, event: dict):
+        _insert_ordered(self.agent_events.setdefault(event["agent_id"], []), event)
+
+    def put_checkpoint(self, checkpoint: dict):
+        _insert_ordered(self.checkpoints.setdefault(checkpoint["agent_id"], []), checkpoint)
+
+    def clear_history(self):
+        self.agent_events.clear()
+        self.checkpoints.clear()
+
+    def put_llm_call(self, call: dict):
+        if not self.llm_calls or self.llm_calls[-1]["timestamp"] <= call["timestamp"]:
+            self.llm_calls.append(call)
+        else:
+            bisect.insort(self.llm_calls, call, key=_call_time)
+
+    def put_usage_minute(self, doc: dict):
+        self.usage_minutes[_usage_key(doc)] = doc
+
+    def drop_usage_before(self, cutoff: datetime) -> int:
+        i = bisect.bisect_left(self.llm_calls, cutoff, key=_call_time)
+        del self.llm_calls[:i]
+        self.usage_minutes = {k: m for k, m in self.usage_minutes.items() if m["minute"] >= cutoff}
+        return i
+
+    def clear_usage(self):
+        self.llm_calls.clear()
+        self.usage_minutes.clear()
+
+    # --- журнал ---
+
+    def record(self, op: str, collection: str, **payload):
+        """Зафиксировать изменение в журнале (сбрасывается фоновой задачей)"""
+        if collection in VERSIONED:
+            world_versions.bump(collection, *_touched(op, collection, payload))
+        if self.path is None or self.bulk_loading:
+            return
+        self._buffer.append(_dumps({"op": op, "c": collection, **payload}))
+        self._since_snapshot += 1
+
+    def _apply(self, rec: dict):
+        op, c = rec["op"], rec["c"]
+        if c == "agents":
+            if op == "put":
+                agent = Agent.model_validate(rec["doc"])
+                self.agents[agent.id] = _agent_doc(agent)
+            elif op == "del":
+                self.agents.pop(PydanticObjectId(rec["id"]), None)
+            elif op == "clear":
+                self.agents.clear()
+        elif c == "events":
+            if op == "put":
+                self.put_event(Event.model_validate(rec["doc"]))
+            elif op == "del":
+                self.drop_event(PydanticObjectId(rec["id"]))
+            elif op == "clear":
+                self.clear_events()
+        elif c == "logs":
+            if op == "put":
+                self.put_log(Log.model_validate(rec["doc"]))
+            elif op == "del_before":
+                self.drop_logs_before(datetime.fromisoformat(rec["ts"]))
+            elif op == "clear":
+                self.clear_logs()
+        elif c == "agent_events" and op == "put":
+            self.put_agent_event(_with_time(rec["doc"]))
+        elif c == "agent_checkpoints" and op == "put":
+            self.put_checkpoint(_with_time(rec["doc"]))
+        elif c == "history" and op == "clear":
+            self.clear_history()
+        elif c == "llm_calls" and op == "put":
+            self.put_llm_call(_with_time(rec["doc"]))
+        elif c == "llm_usage_minutes" and op == "put":
+            self.put_usage_minute(_with_time(rec["doc"], "minute"))
+        elif c == "llm_usage":
+            if op == "del_before":
+                self.drop_usage_before(datetime.fromisoformat(rec["ts"]))
+            elif op == "clear":
+                self.clear_usage()
+
+    def _wal_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"wal.{generation:06d}.ndjson")
+
+    def open(self):
+        """Восстановить состояние со снимка и журналов, начать запись журнала"""
+        if self.path is None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        snapshot_path = os.path.join(self.path, "snapshot.ndjson")
+        snapshot_gen = 0
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                snapshot_gen = header["generation"]
+                for line in f:
+                    self._apply(json.loads(line))
+        replayed = 0
+        for wal in sorted(glob.glob(os.path.join(self.path, "wal.*.ndjson"))):
+            generation = int(os.path.basename(wal).split(".")[1])
+            if generation < snapshot_gen:
+                os.remove(wal)
+                continue
+            with open(wal, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # недописанная последняя строка при падении
+                    self._apply(rec)
+                    replayed += 1
+            self._generation = max(self._generation, generation)
+        self._generation = max(self._generation, snapshot_gen)
+        self._since_snapshot = replayed
+        self._file = open(self._wal_path(self._generation), "ab")
+        self._flusher = asyncio.get_running_loop().create_task(self._run_flusher())
+        logger.info("%s: агентов %d, событий %d, логов %d, из журнала %d записей",
+                    self.path, len(self.agents), len(self.events), len(self.logs), replayed)
+
+    def _write(self, file, data: bytes):
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+    async def flush(self):
+        """Групповой коммит: дописать буфер журнала и сделать fsync"""
+        async with self._io_lock:
+            if not self._buffer or self._file is None:
+                return
+            data = b"".join(self._buffer)
+            self._buffer.clear()
+            await asyncio.to_thread(self._write, self._file, data)
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(FSYNC_INTERVAL)
+            try:
+                await self.flush()
+                if self._since_snapshot >= SNAPSHOT_EVERY:
+                    await self.snapshot()
+            except Exception as e:
+                logger.error("Ошибка записи журнала: %s", e)
+
+    async def snapshot(self):
+        """Снимок всех данных и переключение журнала на новое поколение"""
+        if self.path is None:
+            return
+        await self.flush()
+        async with self._snapshot_lock:
+            async with self._io_lock:
+                # Под замком — только копии ссылок: хранимые документы заменяются
+                # целиком, а не меняются на месте, так что снимок согласован
+                generation = self._generation + 1
+                state = (list(self.agents.items()), list(self.events.values()), list(self.logs.values()),
+                         [e for events in self.agent_events.values() for e in events],
+                         [cp for checkpoints in self.checkpoints.values() for cp in checkpoints],
+                         list(self.llm_calls), list(self.usage_minutes.values()))
+                old_file, old_gen = self._file, self._generation
+                self._generation = generation
+                self._file = open(self._wal_path(generation), "ab")
+                self._since_snapshot = 0
+            # Сериализация и запись — вне цикла событий; при падении посередине
+            # старый снимок и журналы поколений с old_gen еще на месте
+            await asyncio.to_thread(self._write_snapshot, generation, *state)
+            old_file.close()
+            for gen in range(old_gen, generation):
+                if os.path.exists(self._wal_path(gen)):
+                    os.remove(self._wal_path(gen))
+
+    def _write_snapshot(self, generation: int, agents, events, logs, agent_events, checkpoints,
+                        llm_calls, usage_minutes):
+        lines = [_dumps({"generation": generation})]
+        lines += [_dumps({"op": "put", "c": "agents", "doc": {**doc, "_id": oid}}) for oid, doc in agents]
+        lines += [_dumps({"op": "put", "c": "events", "doc": e.model_dump(mode="json", by_alias=True)})
+                  for e in events]
+        lines += [_dumps({"op": "put", "c": "logs", "doc": l.model_dump(mode="json", by_alias=True)})
+                  for l in logs]
+        lines += [_dumps({"op": "put", "c": "agent_events", "doc": e}) for e in agent_events]
+        lines += [_dumps({"op": "put", "c": "agent_checkpoints", "doc": cp}) for cp in checkpoints]
+        lines += [_dumps({"op": "put", "c": "llm_calls", "doc": call}) for call in llm_calls]
+        lines += [_dumps({"op": "put", "c": "llm_usage_minutes", "doc": m}) for m in usage_minutes]
+        tmp = os.path.join(self.path, "snapshot.tmp")
+        with open(tmp, "wb") as f:
+            self._write(f, b"".join(lines))
+        os.replace(tmp, os.path.join(self.path, "snapshot.ndjson"))
+
+    async def close(self):
+        if self.path is None:
+            return
+        if self._flusher:
+            self._flusher.cancel()
+        await self.snapshot()
+        self._file.close()
+        self._file = None
+
+
+class EmbeddedAgentRepository(AgentRepository):
+
+    def __init__(self, engine: EmbeddedEngine):
+        self.engine = engine
+
+    def _load(self, oid, doc) -> Agent:
+        return Agent.model_validate({**doc, "_id": oid})
+
+    def _items(self, active_only: bool):
+        return ((oid, doc) for oid, doc in self.engine.agents.items()
+                if not active_only or doc.get("is_active", True))
+
+    def _store(self, oid, doc: dict):
+        self.engine.agents[oid] = doc
+        self.engine.record("put", "agents", doc={**doc, "_id": oid})
+
+    async def get(self, agent_id):
+        oid = _oid(agent_id)
+        doc = self.engine.agents.get(oid) if oid else None
+        return self._load(oid, doc) if doc is not None else None
+
+    async def find_all(self, active_only=False, skip=0, limit=0):
+        items = itertools.islice(self._items(active_only), skip, skip + limit if limit else None)
+        return [self._load(oid, doc) for oid, doc in items]
+
+    async def count(self, active_only=False):
+        if not active_only:
+            return len(self.engine.agents)
+        return sum(1 for _ in self._items(True))
+
+    async def iter_all(self, batch_size=500):
+        items = list(self.engine.agents.items())
+        for i in range(0, len(items), batch_size):
+            for oid, doc in items[i:i + batch_size]:
+                yield self._load(oid, doc)
+            await asyncio.sleep(0)
+
+    async def iter_docs(self, active_only=False, batch_size=500):
+        items = list(self._items(active_only))
+        for i in range(0, len(items), batch_size):
+            for oid, doc in items[i:i + batch_size]:
+                yield {"_id": oid, **doc}
+            await asyncio.sleep(0)
+
+    async def ids(self, active_only=False):
+        return [oid for oid, _ in self._items(active_only)]
+
+    async def load_with_base(self, ids=None, active_only=False):
+        if ids is None:
+            items = self._items(active_only)
+        else:
+            agents = self.engine.agents
+            items = ((oid, agents[oid]) for oid in map(PydanticObjectId, ids) if oid in agents)
+            if active_only:
+                items = ((oid, doc) for oid, doc in items if doc.get("is_active", True))
+        # base — свежий дамп, а не хранимый документ: пакет волен его менять
+        loaded = [self._load(oid, doc) for oid, doc in items]
+        return [(agent, _agent_doc(agent)) for agent in loaded]
+
+    async def insert(self, agent):
+        if agent.id is None:
+            agent.id = PydanticObjectId()
+        self._store(agent.id, _agent_doc(agent))
+        return agent
+
+    async def insert_many(self, agents):
+        # Как у MongoDB: занятый идентификатор — ошибка, а не замена
+        taken = [str(a.id) for a in agents if a.id is not None and a.id in self.engine.agents]
+        if taken:
+            raise ValueError(f"Агенты с такими id уже есть: {', '.join(taken[:5])}")
+        for agent in agents:
+            await self.insert(agent)
+
+    async def delete(self, agent_id):
+        oid = _oid(agent_id)
+        if oid is None or self.engine.agents.pop(oid, None) is None:
+            return False
+        self.engine.record("del", "agents", id=oid)
+        return True
+
+    async def delete_all(self):
+        n = len(self.engine.agents)
+        self.engine.agents.clear()
+        self.engine.record("clear", "agents")
+        return n
+
+    def _replace(self, agent: Agent, doc: dict) -> bool | None:
+        current = self.engine.agents.get(agent.id)
+        if current is None:
+            return None
+        if (current.get("revision") or 0) != agent.revision:
+            return False
+        self._store(agent.id, doc)
+        return True
+
+    async def replace_if_revision(self, agent, doc):
+        return bool(self._replace(agent, doc))
+
+    async def bulk_replace_if_revision(self, items):
+        failed, deleted = set(), set()
+        for i, (agent, doc) in enumerate(items):
+            ok = self._replace(agent, doc)
+            if ok is None:
+                deleted.add(i)
+            elif not ok:
+                failed.add(i)
+        return failed, deleted
+
+
+class EmbeddedEventRepository(EventRepository):
+
+    def __init__(self, engine: EmbeddedEngine):
+        self.engine = engine
+
+    async def get(self, event_id):
+        oid = _oid(event_id)
+        return self.engine.events.get(oid) if oid else None
+
+    async def insert(self, event):
+        if event.id is None:
+            event.id = PydanticObjectId()
+        self.engine.put_event(event)
+        self.engine.record("put", "events", doc=event.model_dump(mode="json", by_alias=True))
+        return event
+
+    async def insert_many(self, events):
+        for event in events:
+            await self.insert(event)
+
+    async def delete(self, event_id):
+        oid = _oid(event_id)
+        if oid is None or not self.engine.drop_event(oid):
+            return False
+        self.engine.record("del", "events", id=oid)
+        return True
+
+    async def delete_all(self):
+        n = len(self.engine.events)
+        self.engine.clear_events()
+        self.engine.record("clear", "events")
+        return n
+
+    async def iter_recent(self, limit=0, batch_size=500):
+        keys = self.engine.event_index.keys()
+        keys = keys[-limit:] if limit else list(keys)
+        for i, key in enumerate(reversed(keys)):
+            event = self.engine.events.get(key[2])
+            if event is not None:
+                yield event
+            if i % batch_size == batch_size - 1:
+                await asyncio.sleep(0)
+
+    async def feed(self, limit, before=None, event_type=None, agent_id=None):
+        index = self.engine.event_index
+        if agent_id:
+            keys = index.keys("agent", agent_id)
+            predicate = (lambda e: e.event_type.value == event_type) if event_type else None
+        elif event_type:
+            keys, predicate = index.keys("type", event_type), None
+        else:
+            keys, predicate = index.keys(), None
+        events, _ = _page(keys, self.engine.events, predicate, 0, limit, before)
+        return events
+
+    async def for_agent(self, agent_id, event_type=None, skip=0, limit=50):
+        predicate = (lambda e: e.event_type.value == event_type) if event_type else None
+        return _page(self.engine.event_index.keys("agent", agent_id), self.engine.events, predicate, skip, limit)
+
+    async def between(self, agent1_id, agent2_id, skip=0, limit=50):
+        pair = tuple(sorted((agent1_id, agent2_id)))
+        return _page(self.engine.event_index.keys("pair", pair), self.engine.events, None, skip, limit)
+
+
+class EmbeddedLogRepository(LogRepository):
+
+    def __init__(self, engine: EmbeddedEngine):
+        self.engine = engine
+
+    async def insert(self, log):
+        if log.id is None:
+            log.id = PydanticObjectId()
+        self.engine.put_log(log)
+        self.engine.record("put", "logs", doc=log.model_dump(mode="json", by_alias=True))
+        return log
+
+    async def insert_many(self, logs):
+        for log in logs:
+            await self.insert(log)
+
+    async def query(self, levels=None, category=None, agent_id=None, skip=0, limit=50):
+        index, logs = self.engine.log_index, self.engine.logs
+        levels = set(levels or ())
+        checks = []
+        if levels: checks.append(lambda l: l.level.value in levels)
+        if category: checks.append(lambda l: l.category.value == category)
+        if agent_id: checks.append(lambda l: l.agent_id == agent_id)
+
+        # Самый узкий индекс, остальные условия — фильтром
+        if agent_id:
+            keys = index.keys("agent", agent_id)
+            checks.pop()
+        elif category:
+            keys = index.keys("category", category)
+            checks.pop()
+        elif len(levels) == 1:
+            keys = index.keys("level", next(iter(levels)))
+            checks = []
+        elif levels:
+            keys = sorted(k for lvl in levels for k in index.keys("level", lvl))
+            checks = []
+        else:
+            keys = index.keys()
+        predicate = (lambda l: all(c(l) for c in checks)) if checks else None
+        return _page(keys, logs, predicate, skip, limit)
+
+    async def count(self):
+        return len(self.engine.logs)
+
+    async def count_by(self, field):
+        buckets = self.engine.log_index.by.get(field, {})
+        return {value: len(keys) for value, keys in buckets.items() if keys}
+
+    async def delete_before(self, cutoff):
+        deleted = self.engine.drop_logs_before(cutoff)
+        self.engine.record("del_before", "logs", ts=cutoff)
+        return deleted
+
+    async def delete_all(self):
+        n = len(self.engine.logs)
+        self.engine.clear_logs()
+        self.engine.record("clear", "logs")
+        return n
+
+
+def _with_time(doc: dict, field: str = "timestamp") -> dict:
+    doc[field] = datetime.fromisoformat(doc[field])
+    return doc
+
+
+class EmbeddedHistoryRepository(HistoryRepository):
+
+    def __init__(self, engine: EmbeddedEngine):
+        self.engine = engine
+
+    async def append(self, events, checkpoints=()):
+        for event in events:
+            self.engine.put_agent_event(event)
+            self.engine.record("put", "agent_events", doc=event)
+        for cp in checkpoints:
+            self.engine.put_checkpoint(cp)
+            self.engine.record("put", "agent_checkpoints", doc=cp)
+
+    async def latest_checkpoint(self, agent_id, at=None):
+        for cp in reversed(self.engine.checkpoints.get(agent_id, ())):
+            if at is None or cp["timestamp"] <= at:
+                return cp
+        return None
+
+    async def stream(self, agent_id, after_revision=-1, until=None, batch_size=1000):
+        events = self.engine.agent_events.get(agent_id, [])
+        i = bisect.bisect_right(events, (after_revision, float("inf")), key=_history_key)
+        n = 0
+        while i < len(events):
+            event = events[i]
+            i += 1
+            if until is None or event["timestamp"] <= until:
+                yield event
+            n += 1
+            if n % batch_size == 0:
+                await asyncio.sleep(0)
+
+    async def for_agent(self, agent_id, skip=0, limit=50):
+        events = self.engine.agent_events.get(agent_id, [])
+        end = len(events) - skip
+        page = events[max(0, end - limit):max(0, end)][::-1]
+        return [AgentEvent.model_validate(e) for e in page], len(events)
+
+    async def count(self):
+        return sum(len(events) for events in self.engine.agent_events.values())
+
+    async def delete_all(self):
+        n = await self.count()
+        self.engine.clear_history()
+        self.engine.record("clear", "history")
+        return n
+
+
+class EmbeddedUsageRepository(UsageRepository):
+
+    def __init__(self, engine: EmbeddedEngine):
+        self.engine = engine
+
+    async def append(self, calls, minutes=()):
+        for call in calls:
+            self.engine.put_llm_call(call)
+            self.engine.record("put", "llm_calls", doc=call)
+        for m in minutes:
+            current = self.engine.usage_minutes.get(_usage_key(m))
+            if current is not None:
+                merged = {k: v if k in USAGE_KEY else current.get(k, 0) + v for k, v in m.items()}
+                merged["latency_ms_max"] = max(current["latency_ms_max"], m["latency_ms_max"])
+                m = merged
+            else:
+                m = dict(m)
+            self.engine.put_usage_minute(m)
+            self.engine.record("put", "llm_usage_minutes", doc=m)
+
+    async def calls(self, agent_id=None, kind=None, skip=0, limit=50):
+        matched = [c for c in reversed(self.engine.llm_calls)
+                   if (agent_id is None or c.get("agent_id") == agent_id) and (kind is None or c["kind"] == kind)]
+        return [LlmCall.model_validate(c) for c in matched[skip:skip + limit]], len(matched)
+
+    async def minutes(self, since=None, until=None, agent_id=None, kind=None):
+        rows = [m for m in self.engine.usage_minutes.values()
+                if (since is None or m["minute"] >= since) and (until is None or m["minute"] < until)
+                and (agent_id is None or m.get("agent_id") == agent_id) and (kind is None or m["kind"] == kind)]
+        return sorted(rows, key=lambda m: m["minute"])
+
+    async def delete_before(self, cutoff):
+        deleted = self.engine.drop_usage_before(cutoff)
+        self.engine.record("del_before", "llm_usage", ts=cutoff)
+        return deleted
+
+    async def delete_all(self):
+        n = len(self.engine.llm_calls)
+        self.engine.clear_usage()
+        self.engine.record("clear", "llm_usage")
+        return n
+
+
+class EmbeddedStorage(Storage):
+    name = "embedded"
+
+    def __init__(self, path: str | None):
+        self.engine = EmbeddedEngine(path)
+        super().__init__(EmbeddedAgentRepository(self.engine), EmbeddedEventRepository(self.engine),
+                         EmbeddedLogRepository(self.engine), EmbeddedHistoryRepository(self.engine),
+                         EmbeddedUsageRepository(self.engine))
+
+    async def open(self):
+        self.engine.open()
+
+    @asynccontextmanager
+    async def bulk_load(self):
+        # Вместо журнала на каждую запись — один снимок хранилища в конце
+        self.engine.bulk_loading = True
+        try:
+            yield
+        finally:
+            self.engine.bulk_loading = False
+        await self.engine.snapshot()
+
+    async def close(self):
+        await self.engine.close()
+
+
+class StubDatabase:
+    """Заглушка базы для init_beanie: модели Beanie используются как
+    pydantic-модели, а в MongoDB встроенное хранилище не ходит"""
+    name = "embedded"
+
+    async def command(self, *args, **kwargs):
+        return {"version": "7.0.0", "versionArray": [7, 0, 0, 0]}
+
+    def __getitem__(self, name):
+        return _StubCollection(name)
+
+    def __getattr__(self, name):
+        return _StubCollection(name)
+
+
+class _StubCollection:
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, attr):
+        raise RuntimeError(f"Коллекция {self.name}: прямой доступ к MongoDB недоступен во встроенном хранилище")
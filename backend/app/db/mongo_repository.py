@@ -0,0 +1,366 @@
+"""
+Репозитории поверх MongoDB (Beanie + motor)
+"""
+import uuid
+from datetime import datetime
+
+import bson
+from beanie import PydanticObjectId
+from bson.errors import InvalidId
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+
+from app.db.repository import (
+    AgentRepository, EventRepository, HistoryRepository, LogRepository, Storage, UsageRepository,
+)
+from app.models.agent import Agent
+from app.models.agent_history import AgentCheckpoint, AgentEvent
+from app.models.event import Event
+from app.models.llm_usage import LlmCall, LlmUsageMinute
+from app.models.log import Log
+from app.services import world_versions
+
+VERSIONS_ID = "world"
+
+
+def _oid(value) -> PydanticObjectId | None:
+    try:
+        return PydanticObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def _revision_filter(agent: Agent) -> dict:
+    if agent.revision:
+        return {"_id": agent.id, "revision": agent.revision}
+    # Документы, созданные до появления поля, ревизии не имеют
+    return {"_id": agent.id, "revision": {"$in": [0, None]}}
+
+
+def _stored(doc: dict) -> dict:
+    """Документ в том виде, в каком его вернет MongoDB (даты с точностью до мс)"""
+    return bson.decode(bson.encode(doc))
+
+
+def _without_id(doc: dict) -> dict:
+    return {k: v for k, v in doc.items() if k != "_id"}
+
+
+def _versions():
+    return Agent.get_motor_collection().database["world_versions"]
+
+
+def _item_versions():
+    return Agent.get_motor_collection().database["world_item_versions"]
+
+
+async def _bump(resource: str, items=(), reset: bool = False):
+    """Поднять общие версии мира после записи (world_versions): сразу или
+    в конце блока world_versions.deferred()"""
+    if not world_versions.defer(resource, items, reset):
+        await _bump_now(world_versions.keys(resource, items, reset))
+
+
+async def _bump_now(resources: set[str]):
+    items = [k for k in resources if world_versions.is_item(k)]
+    if items:
+        await _item_versions().bulk_write([UpdateOne({"_id": k}, {"$inc": {"v": 1}}, upsert=True) for k in items],
+                                          ordered=False)
+        world_versions.forget(items)
+    shared = resources.difference(items)
+    doc = await _versions().find_one_and_update(
+        {"_id": VERSIONS_ID},
+        {"$inc": {"world": 1, **dict.fromkeys(shared, 1)}, "$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}},
+        upsert=True, return_document=ReturnDocument.AFTER,
+    )
+    world_versions.observe(doc)
+
+
+class MongoAgentRepository(AgentRepository):
+
+    def _query(self, active_only: bool) -> dict:
+        return {"is_active": True} if active_only else {}
+
+    async def get(self, agent_id):
+        oid = _oid(agent_id)
+        return await Agent.get(oid) if oid else None
+
+    async def find_all(self, active_only=False, skip=0, limit=0):
+        q = Agent.find(self._query(active_only)).skip(skip)
+        if limit:
+            q = q.limit(limit)
+        return await q.to_list()
+
+    async def count(self, active_only=False):
+        return await Agent.find(self._query(active_only)).count()
+
+    async def iter_all(self, batch_size=500):
+        async for doc in Agent.get_motor_collection().find({}).batch_size(batch_size):
+            yield Agent.model_validate(doc)
+
+    async def iter_docs(self, active_only=False, batch_size=500):
+        cursor = Agent.get_motor_collection().find(self._query(active_only), {"revision_id": 0})
+        async for doc in cursor.batch_size(batch_size):
+            yield doc
+
+    async def ids(self, active_only=False):
+        cursor = Agent.get_motor_collection().find(self._query(active_only), {"_id": 1})
+        return [doc["_id"] async for doc in cursor]
+
+    async def load_with_base(self, ids=None, active_only=False):
+        query = self._query(active_only)
+        if ids is not None:
+            query["_id"] = {"$in": [PydanticObjectId(i) for i in ids]}
+        return [(Agent.model_validate(doc), _without_id(doc))
+                async for doc in Agent.get_motor_collection().find(query)]
+
+    async def insert(self, agent):
+        agent = await agent.insert()
+        await _bump("agents", [agent.id])
+        return agent
+
+    async def insert_many(self, agents):
+        if agents:
+            await Agent.insert_many(agents)
+            # Без заданных id не известно, какие агенты появились (импорт может вернуть удаленных)
+            ids = [a.id for a in agents]
+            await _bump("agents", ids, reset=None in ids)
+
+    async def delete(self, agent_id):
+        oid = _oid(agent_id)
+        if not oid:
+            return False
+        result = await Agent.get_motor_collection().delete_one({"_id": oid})
+        if result.deleted_count:
+            await _bump("agents", [oid])
+        return result.deleted_count > 0
+
+    async def delete_all(self):
+        result = await Agent.get_motor_collection().delete_many({})
+        if result.deleted_count:
+            await _bump("agents", reset=True)
+        return result.deleted_count
+
+    async def replace_if_revision(self, agent, doc):
+        result = await Agent.get_motor_collection().replace_one(_revision_filter(agent), doc)
+        if result.matched_count:
+            await _bump("agents", [agent.id])
+        return result.matched_count > 0
+
+    async def bulk_replace_if_revision(self, items):
+        """Один bulk_write условных замен без upsert, поэтому удаленный агент
+        не создается заново. Если совпали не все фильтры, отдельно читаются
+        текущие документы: агента нет — он удален; документ отличается от
+        записанного нами — конфликт ревизии. Документ, который конкурент успел
+        перезаписать уже после нас, тоже считается конфликтом."""
+        collection = Agent.get_motor_collection()
+        result = await collection.bulk_write([ReplaceOne(_revision_filter(a), doc) for a, doc in items],
+                                             ordered=False)
+        failed, deleted = set(), set()
+        if result.matched_count < len(items):
+            current = {d["_id"]: d async for d in collection.find({"_id": {"$in": [a.id for a, _ in items]}})}
+            for i, (agent, doc) in enumerate(items):
+                found = current.get(agent.id)
+                if found is None:
+                    deleted.add(i)
+                elif _without_id(found) != _stored(doc):
+                    failed.add(i)
+        if result.matched_count:
+            await _bump("agents", [a.id for i, (a, _) in enumerate(items) if i not in failed and i not in deleted])
+        return failed, deleted
+
+
+class MongoEventRepository(EventRepository):
+
+    async def get(self, event_id):
+        oid = _oid(event_id)
+        return await Event.get(oid) if oid else None
+
+    async def insert(self, event):
+        event = await event.insert()
+        await _bump("events", [event.agent_id, event.target_agent_id])
+        return event
+
+    async def insert_many(self, events):
+        if events:
+            await Event.insert_many(events)
+            await _bump("events", {i for e in events for i in (e.agent_id, e.target_agent_id)})
+
+    async def delete(self, event_id):
+        oid = _oid(event_id)
+        if not oid:
+            return False
+        deleted = await Event.get_motor_collection().find_one_and_delete(
+            {"_id": oid}, {"agent_id": 1, "target_agent_id": 1})
+        if deleted is not None:
+            await _bump("events", [deleted.get("agent_id"), deleted.get("target_agent_id")])
+        return deleted is not None
+
+    async def delete_all(self):
+        result = await Event.get_motor_collection().delete_many({})
+        if result.deleted_count:
+            await _bump("events", reset=True)
+        return result.deleted_count
+
+    async def iter_recent(self, limit=0, batch_size=500):
+        cursor = Event.get_motor_collection().find({}).sort("timestamp", -1).batch_size(batch_size)
+        if limit:
+            cursor = cursor.limit(limit)
+        async for doc in cursor:
+            yield Event.model_validate(doc)
+
+    async def feed(self, limit, before=None, event_type=None, agent_id=None):
+        q = {}
+        if before: q["timestamp"] = {"$lt": before}
+        if event_type: q["event_type"] = event_type
+        if agent_id: q["$or"] = [{"agent_id": agent_id}, {"target_agent_id": agent_id}]
+        return await Event.find(q).sort("-timestamp").limit(limit).to_list()
+
+    async def _page(self, q: dict, skip: int, limit: int):
+        events = await Event.find(q).sort("-timestamp").skip(skip).limit(limit).to_list()
+        return events, await Event.find(q).count()
+
+    async def for_agent(self, agent_id, event_type=None, skip=0, limit=50):
+        q = {"$or": [{"agent_id": agent_id}, {"target_agent_id": agent_id}]}
+        if event_type: q["event_type"] = event_type
+        return await self._page(q, skip, limit)
+
+    async def between(self, agent1_id, agent2_id, skip=0, limit=50):
+        q = {"$or": [{"agent_id": agent1_id, "target_agent_id": agent2_id},
+                     {"agent_id": agent2_id, "target_agent_id": agent1_id}]}
+        return await self._page(q, skip, limit)
+
+
+class MongoLogRepository(LogRepository):
+
+    async def insert(self, log):
+        return await log.insert()
+
+    async def insert_many(self, logs):
+        if logs:
+            await Log.insert_many(logs)
+
+    async def query(self, levels=None, category=None, agent_id=None, skip=0, limit=50):
+        q = {}
+        if levels: q["level"] = {"$in": list(levels)}
+        if category: q["category"] = category
+        if agent_id: q["agent_id"] = agent_id
+        logs = await Log.find(q).sort("-timestamp").skip(skip).limit(limit).to_list()
+        return logs, await Log.find(q).count()
+
+    async def count(self):
+        return await Log.count()
+
+    async def count_by(self, field):
+        pipeline = [{"$group": {"_id": f"${field}", "n": {"$sum": 1}}}]
+        cursor = Log.get_motor_collection().aggregate(pipeline)
+        return {doc["_id"]: doc["n"] async for doc in cursor if doc["_id"] is not None}
+
+    async def delete_before(self, cutoff: datetime):
+        result = await Log.get_motor_collection().delete_many({"timestamp": {"$lt": cutoff}})
+        return result.deleted_count
+
+    async def delete_all(self):
+        result = await Log.get_motor_collection().delete_many({})
+        return result.deleted_count
+
+
+class MongoHistoryRepository(HistoryRepository):
+
+    async def append(self, events, checkpoints=()):
+        if events:
+            await AgentEvent.get_motor_collection().insert_many(events, ordered=False)
+        if checkpoints:
+            await AgentCheckpoint.get_motor_collection().insert_many(list(checkpoints), ordered=False)
+
+    async def latest_checkpoint(self, agent_id, at=None):
+        q = {"agent_id": agent_id}
+        if at: q["timestamp"] = {"$lte": at}
+        return await AgentCheckpoint.get_motor_collection().find_one(q, sort=[("revision", -1)])
+
+    async def stream(self, agent_id, after_revision=-1, until=None, batch_size=1000):
+        q = {"agent_id": agent_id, "revision": {"$gt": after_revision}}
+        if until: q["timestamp"] = {"$lte": until}
+        cursor = AgentEvent.get_motor_collection().find(q).sort([("revision", 1), ("seq", 1)])
+        async for doc in cursor.batch_size(batch_size):
+            yield doc
+
+    async def for_agent(self, agent_id, skip=0, limit=50):
+        q = {"agent_id": agent_id}
+        events = await AgentEvent.find(q).sort([("revision", -1), ("seq", -1)]).skip(skip).limit(limit).to_list()
+        return events, await AgentEvent.find(q).count()
+
+    async def count(self):
+        return await AgentEvent.count()
+
+    async def delete_all(self):
+        await AgentCheckpoint.get_motor_collection().delete_many({})
+        result = await AgentEvent.get_motor_collection().delete_many({})
+        return result.deleted_count
+
+
+USAGE_KEY = ("minute", "kind", "source", "agent_id")
+
+
+class MongoUsageRepository(UsageRepository):
+
+    async def append(self, calls, minutes=()):
+        if calls:
+            await LlmCall.get_motor_collection().insert_many(calls, ordered=False)
+        if minutes:
+            ops = [UpdateOne({k: m[k] for k in USAGE_KEY},
+                             {"$inc": {k: v for k, v in m.items() if k not in USAGE_KEY and k != "latency_ms_max"},
+                              "$max": {"latency_ms_max": m["latency_ms_max"]}},
+                             upsert=True)
+                   for m in minutes]
+            await LlmUsageMinute.get_motor_collection().bulk_write(ops, ordered=False)
+
+    async def calls(self, agent_id=None, kind=None, skip=0, limit=50):
+        q = {}
+        if agent_id: q["agent_id"] = agent_id
+        if kind: q["kind"] = kind
+        calls = await LlmCall.find(q).sort("-timestamp").skip(skip).limit(limit).to_list()
+        return calls, await LlmCall.find(q).count()
+
+    async def minutes(self, since=None, until=None, agent_id=None, kind=None):
+        q = {}
+        if since or until:
+            q["minute"] = {**({"$gte": since} if since else {}), **({"$lt": until} if until else {})}
+        if agent_id: q["agent_id"] = agent_id
+        if kind: q["kind"] = kind
+        cursor = LlmUsageMinute.get_motor_collection().find(q, {"_id": 0}).sort("minute", 1)
+        return [doc async for doc in cursor]
+
+    async def delete_before(self, cutoff):
+        await LlmUsageMinute.get_motor_collection().delete_many({"minute": {"$lt": cutoff}})
+        result = await LlmCall.get_motor_collection().delete_many({"timestamp": {"$lt": cutoff}})
+        return result.deleted_count
+
+    async def delete_all(self):
+        await LlmUsageMinute.get_motor_collection().delete_many({})
+        result = await LlmCall.get_motor_collection().delete_many({})
+        return result.deleted_count
+
+
+class MongoStorage(Storage):
+    name = "mongo"
+
+    def __init__(self, client, db_name: str):
+        super().__init__(MongoAgentRepository(), MongoEventRepository(), MongoLogRepository(),
+                         MongoHistoryRepository(), MongoUsageRepository())
+        self.client = client
+        self.db_name = db_name
+
+    async def close(self):
+        self.client.close()
+
+    async def read_versions(self):
+        return await _versions().find_one({"_id": VERSIONS_ID})
+
+    async def read_item_versions(self, keys):
+        return {doc["_id"]: doc["v"] async for doc in _item_versions().find({"_id": {"$in": keys}})}
+
+    async def bump_versions(self, resources):
+        await _bump_now(resources)
+
+    async def drop(self):
+        await self.client.drop_database(self.db_name)
@@ -0,0 +1,264 @@
+"""
+Слой репозиториев: контроллеры и сервисы работают с агентами, событиями
+и логами только через эти интерфейсы и не знают, где лежат данные.
+
+Реализации:
+- app.db.mongo_repository — MongoDB через Beanie/motor (по умолчанию);
+- app.db.embedded — встроенное хранилище в памяти процесса с журналом
+  на диске (STORAGE_BACKEND=embedded), не требует сервера MongoDB.
+
+Выборки "по времени" везде отсортированы от новых к старым.
+"""
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator
+
+from app.models.agent import Agent
+from app.models.agent_history import AgentEvent
+from app.models.event import Event
+from app.models.llm_usage import LlmCall
+from app.models.log import Log
+
+
+class AgentRepository(ABC):
+
+    @abstractmethod
+    async def get(self, agent_id: str) -> Agent | None: ...
+
+    @abstractmethod
+    async def find_all(self, active_only: bool = False, skip: int = 0, limit: int = 0) -> list[Agent]:
+        """limit=0 — без ограничения"""
+
+    @abstractmethod
+    async def count(self, active_only: bool = False) -> int: ...
+
+    @abstractmethod
+    def iter_all(self, batch_size: int = 500) -> AsyncIterator[Agent]:
+        """Потоковый обход всех агентов без загрузки всех сразу"""
+
+    @abstractmethod
+    def iter_docs(self, active_only: bool = False, batch_size: int = 500) -> AsyncIterator[dict]:
+        """Потоковый обход документов агентов (с "_id") без сборки моделей.
+        Документы только для чтения"""
+
+    @abstractmethod
+    async def ids(self, active_only: bool = False) -> list:
+        """Только идентификаторы (дешево, без загрузки документов)"""
+
+    @abstractmethod
+    async def load_with_base(self, ids: list = None, active_only: bool = False) -> list[tuple[Agent, dict]]:
+        """Агенты вместе с прочитанными документами (base для слияния при конфликте).
+        Документы только для чтения."""
+
+    @abstractmethod
+    async def insert(self, agent: Agent) -> Agent: ...
+
+    @abstractmethod
+    async def insert_many(self, agents: list[Agent]): ...
+
+    @abstractmethod
+    async def delete(self, agent_id: str) -> bool: ...
+
+    @abstractmethod
+    async def delete_all(self) -> int: ...
+
+    @abstractmethod
+    async def replace_if_revision(self, agent: Agent, doc: dict) -> bool:
+        """Заменить документ, если его revision в хранилище равна agent.revision"""
+
+    @abstractmethod
+    async def bulk_replace_if_revision(self, items: list[tuple[Agent, dict]]) -> tuple[set[int], set[int]]:
+        """Пакет условных замен. Возвращает (индексы конфликтов, индексы удаленных агентов)"""
+
+
+class EventRepository(ABC):
+
+    @abstractmethod
+    async def get(self, event_id: str) -> Event | None: ...
+
+    @abstractmethod
+    async def insert(self, event: Event) -> Event: ...
+
+    @abstractmethod
+    async def insert_many(self, events: list[Event]): ...
+
+    @abstractmethod
+    async def delete(self, event_id: str) -> bool: ...
+
+    @abstractmethod
+    async def delete_all(self) -> int: ...
+
+    @abstractmethod
+    def iter_recent(self, limit: int = 0, batch_size: int = 500) -> AsyncIterator[Event]:
+        """Потоковый обход последних limit событий (0 — всех), от новых к старым"""
+
+    @abstractmethod
+    async def feed(self, limit: int, before: datetime = None, event_type: str = None,
+                   agent_id: str = None) -> list[Event]:
+        """Лента: события старше before, с фильтром по типу и участнику"""
+
+    @abstractmethod
+    async def for_agent(self, agent_id: str, event_type: str = None,
+                        skip: int = 0, limit: int = 50) -> tuple[list[Event], int]: ...
+
+    @abstractmethod
+    async def between(self, agent1_id: str, agent2_id: str,
+                      skip: int = 0, limit: int = 50) -> tuple[list[Event], int]: ...
+
+
+class LogRepository(ABC):
+
+    @abstractmethod
+    async def insert(self, log: Log) -> Log: ...
+
+    @abstractmethod
+    async def insert_many(self, logs: list[Log]): ...
+
+    @abstractmethod
+    async def query(self, levels: list[str] = None, category: str = None, agent_id: str = None,
+                    skip: int = 0, limit: int = 50) -> tuple[list[Log], int]: ...
+
+    @abstractmethod
+    async def count(self) -> int: ...
+
+    @abstractmethod
+    async def count_by(self, field: str) -> dict[str, int]:
+        """Количество логов по значениям поля level или category"""
+
+    @abstractmethod
+    async def delete_before(self, cutoff: datetime) -> int: ...
+
+    @abstractmethod
+    async def delete_all(self) -> int: ...
+
+
+class HistoryRepository(ABC):
+    """Доменные события и чекпоинты агентов (app.services.agent_history).
+    На горячем пути — сырые документы с полями моделей AgentEvent /
+    AgentCheckpoint: их пишут на каждый тик, и конструирование Document
+    обходится дороже самой записи."""
+
+    @abstractmethod
+    async def append(self, events: list[dict], checkpoints: list[dict] = ()): ...
+
+    @abstractmethod
+    async def latest_checkpoint(self, agent_id: str, at: datetime = None) -> dict | None:
+        """Чекпоинт с наибольшей ревизией не позже at (None — самый свежий)"""
+
+    @abstractmethod
+    def stream(self, agent_id: str, after_revision: int = -1, until: datetime = None,
+               batch_size: int = 1000) -> AsyncIterator[dict]:
+        """События агента с ревизией больше after_revision и не позже until,
+        по порядку (revision, seq)"""
+
+    @abstractmethod
+    async def for_agent(self, agent_id: str, skip: int = 0, limit: int = 50) -> tuple[list[AgentEvent], int]: ...
+
+    @abstractmethod
+    async def count(self) -> int: ...
+
+    @abstractmethod
+    async def delete_all(self) -> int: ...
+
+
+class UsageRepository(ABC):
+    """Журнал расхода LLM (app.services.llm_usage): вызовы и поминутные свертки.
+    Пишутся сырые документы с полями моделей LlmCall / LlmUsageMinute."""
+
+    @abstractmethod
+    async def append(self, calls: list[dict], minutes: list[dict] = ()):
+        """Дописать вызовы; счетчики сверток прибавляются к уже записанным
+        за ту же (minute, kind, source, agent_id), максимум задержки — максимум"""
+
+    @abstractmethod
+    async def calls(self, agent_id: str = None, kind: str = None,
+                    skip: int = 0, limit: int = 50) -> tuple[list[LlmCall], int]: ...
+
+    @abstractmethod
+    async def minutes(self, since: datetime = None, until: datetime = None,
+                      agent_id: str = None, kind: str = None) -> list[dict]:
+        """Свертки с минутой в [since, until), по возрастанию минуты"""
+
+    @abstractmethod
+    async def delete_before(self, cutoff: datetime) -> int:
+        """Удалить вызовы и свертки старше cutoff. Возвращает число вызовов"""
+
+    @abstractmethod
+    async def delete_all(self) -> int: ...
+
+
+class Storage:
+    """Набор репозиториев одного бэкенда"""
+    name = ""
+
+    def __init__(self, agents: AgentRepository, events: EventRepository, logs: LogRepository,
+                 history: HistoryRepository, usage: UsageRepository):
+        self.agents = agents
+        self.events = events
+        self.logs = logs
+        self.history = history
+        self.usage = usage
+
+    async def close(self):
+        pass
+
+    @asynccontextmanager
+    async def bulk_load(self):
+        """Массовая загрузка (восстановление снимка мира): бэкенд может
+        отключить на это время поштучное журналирование"""
+        yield
+
+    async def read_versions(self) -> dict | None:
+        """Общие счетчики версий мира, если хранилище разделяют процессы
+        (app.services.world_versions). None — версии ведет сам процесс"""
+        return None
+
+    async def read_item_versions(self, keys: list[str]) -> dict[str, int] | None:
+        """Общие версии элементов ("agents/<id>"); None — версии ведет сам процесс"""
+        return None
+
+    async def bump_versions(self, resources: set[str]):
+        """Поднять общие версии отложенных записей (world_versions.deferred)"""
+
+    async def drop(self):
+        """Удалить все данные (для временных баз симуляции)"""
+        await self.agents.delete_all()
+        await self.events.delete_all()
+        await self.logs.delete_all()
+        await self.history.delete_all()
+        await self.usage.delete_all()
+
+
+_storage: Storage | None = None
+
+
+def set_storage(storage: Storage | None):
+    global _storage
+    _storage = storage
+
+
+def get_storage() -> Storage:
+    if _storage is None:
+        raise RuntimeError("Хранилище не подключено: вызовите app.db.database.connect()")
+    return _storage
+
+
+def agent_repo() -> AgentRepository:
+    return get_storage().agents
+
+
+def event_repo() -> EventRepository:
+    return get_storage().events
+
+
+def log_repo() -> LogRepository:
+    return get_storage().logs
+
+
+def history_repo() -> HistoryRepository:
+    return get_storage().history
+
+
+def usage_repo() -> UsageRepository:
+    return get_storage().usage
@@ -0,0 +1,138 @@
+"""
+Замер горячих GET-эндпоинтов API в процессе (без сети и uvicorn):
+задержка ответа и размер тела — без сжатия и с Accept-Encoding.
+
+Мир — во встроенном хранилище в памяти: --agents агентов с полной
+памятью (MAX_MEMORIES воспоминаний) и отношениями, --events событий и
+столько же записей лога. Каждый эндпоинт запрашивается --requests раз
+подряд через ASGI-транспорт httpx; первые запросы прогревают кэши.
+
+Примеры:
+    python -m app.endpoint_bench
+    python -m app.endpoint_bench --agents 100 --requests 300 --out bench.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault("LLM_BACKEND", "offline")
+os.environ.setdefault("LIFECYCLE_ROLE", "api")
+os.environ.setdefault("STALL_WATCHDOG", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("LLM_USAGE", "0")
+
+WARMUP = 20
+ENCODINGS = ("identity", "gzip", "br")
+
+
+def _endpoints(agent_id: str) -> dict[str, str]:
+    return {
+        "agents": "/api/v1/system/agents?limit=100",
+        "agent_detail": f"/api/v1/system/agents/{agent_id}",
+        "feed": "/api/v1/action/feed?limit=100",
+        "agent_events": f"/api/v1/action/events/agent/{agent_id}?limit=100",
+        "logs": "/api/v1/logs/?limit=100",
+    }
+
+
+async def seed(agents: int, events: int):
+    from beanie import PydanticObjectId
+    from app.db.repository import agent_repo, event_repo, log_repo
+    from app.models.agent import Memory, Relationship
+    from app.models.event import EventType
+    from app.models.log import LogCategory
+    from app.services.builder import AgentBuilder, EventBuilder, LogBuilder
+    from app.services.memories import MAX_MEMORIES
+
+    built = []
+    for i in range(agents):
+        agent = AgentBuilder().set_name(f"Агент {i}").set_bio("Житель виртуального мира, любит долгие разговоры.").build()
+        agent.memories = [Memory(content=f"[Взаимодействие] Диалог номер {j}: \"Мне кажется, сегодня обычный день.\"",
+                                 importance=random.random()) for j in range(MAX_MEMORIES)]
+        agent.id = PydanticObjectId()
+        built.append(agent)
+    for agent in built:
+        agent.relationships = [Relationship(agent_id=str(other.id), agent_name=other.name,
+                                            sympathy=round(random.uniform(-1, 1), 2), description="знакомый")
+                               for other in random.sample(built, min(10, len(built))) if other is not agent]
+    await agent_repo().insert_many(built)
+
+    await event_repo().insert_many([
+        EventBuilder().set_type(EventType.CHAT).set_description(f"{a.name} → {b.name}")
+        .set_source(str(a.id), a.name).set_target(str(b.id), b.name)
+        .set_content("Я думаю, стоит об этом поговорить подробнее.").build()
+        for a, b in (random.sample(built, 2) if len(built) > 1 else (built[0], built[0]) for _ in range(events))
+    ])
+    await log_repo().insert_many([
+        LogBuilder().category(LogCategory.AGENT_UPDATED).message(f"Обновлен: {a.name}")
+        .agent(str(a.id), a.name).detail("field", "emotion").build()
+        for a in (random.choice(built) for _ in range(events))
+    ])
+    return built[0]
+
+
+async def measure(client, url: str, requests: int) -> dict:
+    for _ in range(WARMUP):
+        (await client.get(url)).raise_for_status()
+    gc.collect()  # мусор прогрева и предыдущего эндпоинта не попадает в замер
+    times = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        resp = await client.get(url, headers={"Accept-Encoding": "identity"})
+        times.append((time.perf_counter() - started) * 1000)
+        resp.raise_for_status()
+    result = {"median_ms": round(statistics.median(times), 3),
+              "p95_ms": round(sorted(times)[int(len(times) * 0.95) - 1], 3)}
+    for encoding in ENCODINGS:
+        resp = await client.get(url, headers={"Accept-Encoding": encoding})
+        # Размер на проводе: httpx отдает распакованное тело, длина сжатого — в заголовке
+        result[f"bytes_{encoding}"] = int(resp.headers.get("content-length", len(resp.content)))
+        result[f"served_{encoding}"] = resp.headers.get("content-encoding", "identity")
+    return result
+
+
+async def run(args) -> dict:
+    import httpx
+    from app.db.database import connect, disconnect
+    from app.main import app
+
+    random.seed(args.seed)
+    await connect(backend="embedded", persist=False)
+    try:
+        first = await seed(args.agents, args.events)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            results = {}
+            for name, url in _endpoints(str(first.id)).items():
+                results[name] = await measure(client, url, args.requests)
+    finally:
+        await disconnect()
+    return {"agents": args.agents, "events": args.events, "requests": args.requests, "endpoints": results}
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Замер горячих GET-эндпоинтов API")
+    p.add_argument("--agents", type=int, default=100)
+    p.add_argument("--events", type=int, default=300, help="событий и записей лога")
+    p.add_argument("--requests", type=int, default=200, help="запросов на эндпоинт")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--out", default=None, help="записать результат в JSON-файл")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,66 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import asyncio
+import os
 
 from app.db.database import connect, disconnect
 from app.controllers.system_controller import router as system_router
 from app.controllers.text_controller import router as text_router
 from app.controllers.action_controller import router as action_router
 from app.controllers.logger_controller import router as logger_router
+from app.controllers.llm_controller import router as llm_router
 from app.services.lifecycle_service import run_lifecycle_loop
 from app.services.seed_agents import seed_initial_agents
+from app.services.occ import ConcurrentModificationError, OCC_STATS
+from app.services.responses import CompressionMiddleware
+from app.services import (console_log, gigachat_service, llm_budget, llm_cassette, llm_resilience, llm_usage, metrics,
+                          neighborhoods, stall_watchdog, world_versions)
+from app.services.lifecycle_service import STATS as LIFECYCLE_STATS, THINK_STATS as LIFECYCLE_THINK_STATS
+from app.services.write_batch import FLUSH_STATS
+from app.services.agent_history import HISTORY_STATS
+
+# all — API и жизненный цикл в одном процессе; api — только API
+LIFECYCLE_ROLE = os.getenv("LIFECYCLE_ROLE", "all")
+
+console_log.setup_logging()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # SDK GigaChat импортируется в потоке параллельно с подключением к базе
+    sdk_preload = asyncio.create_task(asyncio.to_thread(gigachat_service.preload_sdk))
     await connect()
     # Создаем базовых агентов, если их еще нет
     await seed_initial_agents()
-    # Запускаем фоновый цикл жизнедеятельности агентов
-    lifecycle_task = asyncio.create_task(run_lifecycle_loop())
+    # Запускаем фоновый цикл жизнедеятельности агентов (роль "api" — только HTTP,
+    # симуляцию тогда ведут отдельные процессы python -m app.worker)
+    lifecycle_task = None
+    if LIFECYCLE_ROLE != "api":
+        # Первый тик сразу обращается к LLM — SDK к этому моменту нужен
+        await sdk_preload
+        lifecycle_task = asyncio.create_task(run_lifecycle_loop())
+    loop_monitor = asyncio.create_task(metrics.monitor_event_loop())
+    usage_sink = asyncio.create_task(llm_usage.run_usage_sink())
+    if stall_watchdog.WATCHDOG_ENABLED:
+        stall_watchdog.start()
     yield
-    lifecycle_task.cancel()
+    sdk_preload.cancel()
+    stall_watchdog.stop()
+    loop_monitor.cancel()
+    usage_sink.cancel()
     try:
-        await lifecycle_task
+        await usage_sink  # дописывает остаток журнала расхода
     except asyncio.CancelledError:
         pass
+    llm_cassette.close_cassette()
+    if lifecycle_task:
+        lifecycle_task.cancel()
+        try:
+            await lifecycle_task
+        except asyncio.CancelledError:
+            pass
     await disconnect()
 
 
@@ -35,6 +71,10 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Сжатие — ближе всех к приложению: метрики видят полное время ответа
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(world_versions.DeferredBumpMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -43,12 +83,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(ConcurrentModificationError)
+async def concurrent_modification_handler(request: Request, exc: ConcurrentModificationError):
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+
+@app.exception_handler(world_versions.NotModified)
+async def not_modified_handler(request: Request, exc: world_versions.NotModified):
+    return Response(status_code=304, headers=world_versions.headers(exc.etag))
+
+
 app.include_router(system_router, prefix="/api/v1")
 app.include_router(text_router, prefix="/api/v1")
 app.include_router(action_router, prefix="/api/v1")
 app.include_router(logger_router, prefix="/api/v1")
+app.include_router(llm_router, prefix="/api/v1")
 
 
 @app.get("/")
 async def root():
     return {"service": "Virtual World API", "version": "2.0.0"}
+
+
+metrics.register_stats("vw_lifecycle", "Счетчики жизненного цикла", lambda: LIFECYCLE_STATS)
+metrics.register_stats("vw_occ", "Оптимистичная блокировка: записи и конфликты", lambda: OCC_STATS)
+metrics.register_stats("vw_flush", "Пакетная запись тиков", lambda: FLUSH_STATS)
+metrics.register_stats("vw_history", "История агентов", lambda: HISTORY_STATS)
+metrics.register_stats("vw_llm_usage", "Расход LLM: вызовы и токены", lambda: llm_usage.USAGE_STATS)
+metrics.register_stats("vw_llm_resilience", "Защита вызовов LLM: таймауты, размыкатель, хеджирование",
+                       lambda: llm_resilience.RESILIENCE_STATS)
+metrics.register_stats("vw_llm_cassette", "Кассета LLM: запись и воспроизведение", lambda: llm_cassette.CASSETTE_STATS)
+metrics.register_stats("vw_stalls", "Зависания цикла событий", lambda: stall_watchdog.STALL_STATS)
+metrics.register_stats("vw_log", "Консольный лог: очередь, отброшенные и прореженные записи", lambda: console_log.LOG_STATS)
+metrics.register_stats("vw_dialogue_batch", "Пакетные диалоги: запросы, реплики, откаты", lambda: gigachat_service.BATCH_STATS)
+metrics.register_stats("vw_llm_budget", "Бюджет LLM жизненного цикла: тики, выдано, отложено, остаток", lambda: llm_budget.BUDGET_STATS)
+metrics.register_stats("vw_neighborhoods", "Индекс окрестностей: агенты, сообщества, пересчеты", lambda: neighborhoods.NEIGHBORHOOD_STATS)
+metrics.register_stats("vw_world_versions", "Версии мира и условные GET: записи, 304, полные ответы",
+                       lambda: {**world_versions.VERSION_STATS, **world_versions.versions()})
+metrics.register_stats("vw_think", "Рефлексия одним запросом: вызовы, откаты, отказы от разговора", lambda: LIFECYCLE_THINK_STATS)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,32 @@
+"""
+Миграция схемы MongoDB: создание индексов всех коллекций.
+
+Запускается один раз при развертывании (и после изменения индексов в
+моделях), после чего API и воркеры можно стартовать с
+DB_SKIP_INDEX_CHECKS=1 — без сверки индексов при каждом подключении.
+
+Примеры:
+    python -m app.migrate --db virtual_world
+    python -m app.migrate --drop-unknown    # удалить индексы, которых нет в моделях
+    DB_SKIP_INDEX_CHECKS=1 uvicorn app.main:app --workers 4
+"""
+import argparse
+import asyncio
+import json
+
+from app.db.database import ensure_indexes
+
+
+async def main(args):
+    print(json.dumps(await ensure_indexes(args.db, args.drop_unknown), ensure_ascii=False, indent=2))
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Создание индексов MongoDB")
+    p.add_argument("--db", default=None, help="имя базы данных (по умолчанию DATABASE_NAME)")
+    p.add_argument("--drop-unknown", action="store_true", help="удалить индексы, не описанные в моделях")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -60,6 +60,7 @@ class Agent(Document):
     is_active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    revision: int = 0  # счетчик записей для оптимистичной блокировки (app.services.occ)
 
     class Settings:
         name = "agents"
@@ -0,0 +1,46 @@
+from beanie import Document
+from pydantic import Field
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from datetime import datetime
+from enum import Enum
+
+
+class AgentEventType(str, Enum):
+    MOOD_CHANGED = "mood_changed"
+    EMOTION_CHANGED = "emotion_changed"
+    RELATIONSHIP_ADDED = "relationship_added"
+    RELATIONSHIP_REMOVED = "relationship_removed"
+    SYMPATHY_CHANGED = "sympathy_changed"
+    MEMORY_ADDED = "memory_added"
+    MEMORIES_COMPACTED = "memories_compacted"
+    GOAL_SET = "goal_set"
+    PLAN_SET = "plan_set"
+    FIELD_SET = "field_set"
+    AGENT_DELETED = "agent_deleted"
+
+
+class AgentEvent(Document):
+    """Доменное событие: одно типизированное изменение состояния агента.
+    Все события одной записи агента имеют общую revision и идут по seq."""
+    agent_id: str
+    revision: int
+    seq: int = 0
+    event_type: AgentEventType
+    data: dict = Field(default_factory=dict)
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+
+    class Settings:
+        name = "agent_events"
+        indexes = [IndexModel([("agent_id", ASCENDING), ("revision", ASCENDING), ("seq", ASCENDING)])]
+
+
+class AgentCheckpoint(Document):
+    """Полное состояние агента на ревизии revision — точка старта реплея"""
+    agent_id: str
+    revision: int
+    timestamp: datetime
+    state: dict
+
+    class Settings:
+        name = "agent_checkpoints"
+        indexes = [IndexModel([("agent_id", ASCENDING), ("revision", DESCENDING)])]
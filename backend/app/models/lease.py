@@ -0,0 +1,16 @@
+from beanie import Document, Indexed
+from pydantic import Field
+from datetime import datetime
+
+
+class Lease(Document):
+    """Аренда ключа воркером жизненного цикла.
+    key = "worker:<id>" — членство живого воркера,
+    key = "partition:<n>" — владение партицией агентов."""
+    key: Indexed(str, unique=True)
+    owner: str
+    expires_at: datetime
+    heartbeat_at: datetime = Field(default_factory=datetime.utcnow)
+
+    class Settings:
+        name = "leases"
@@ -0,0 +1,50 @@
+from beanie import Document
+from pydantic import Field
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from typing import Optional
+from datetime import datetime
+
+
+class LlmCall(Document):
+    """Один вызов LLM в журнале расхода"""
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    kind: str                          # chat / reflect / dialogue
+    source: str = "background"         # шаблон HTTP-маршрута, lifecycle...
+    backend: str = "gigachat"
+    agent_id: Optional[str] = None
+    target_id: Optional[str] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_ms: float = 0.0
+    cached: bool = False
+    error: Optional[str] = None
+
+    class Settings:
+        name = "llm_calls"
+        indexes = [
+            IndexModel([("timestamp", DESCENDING)]),
+            IndexModel([("agent_id", ASCENDING), ("timestamp", DESCENDING)]),
+        ]
+
+
+class LlmUsageMinute(Document):
+    """Свертка вызовов за минуту по (kind, source, agent_id)"""
+    minute: datetime
+    kind: str
+    source: str
+    agent_id: Optional[str] = None
+    calls: int = 0
+    errors: int = 0
+    cached: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_ms_sum: float = 0.0
+    latency_ms_max: float = 0.0
+
+    class Settings:
+        name = "llm_usage_minutes"
+        indexes = [
+            IndexModel([("minute", ASCENDING), ("kind", ASCENDING), ("source", ASCENDING),
+                        ("agent_id", ASCENDING)], unique=True),
+            IndexModel([("agent_id", ASCENDING), ("minute", ASCENDING)]),
+        ]
@@ -0,0 +1,92 @@
+"""
+Реплей истории агентов: восстановление состояния и замер скорости.
+
+Для каждого агента берется последний чекпоинт (не позже --at) и поверх
+него проигрываются доменные события (app.services.agent_history).
+Печатает пропускную способность в событиях в секунду; с --verify
+сверяет восстановленное текущее состояние с документами в хранилище.
+
+Примеры:
+    python -m app.simulate --ticks 200 --agents 500 --db sim_world --reset --quiet
+    python -m app.replay --db sim_world --verify
+    AGENT_CHECKPOINT_EVERY=1000 python -m app.simulate ...   # длинные цепочки событий
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+
+from app.db.database import connect, disconnect
+from app.db.repository import agent_repo, history_repo
+from app.services.agent_history import replay_agent
+
+# Не сравниваются: updated_at в реплее — время последнего события
+VERIFY_EXCLUDE = {"id", "revision_id", "updated_at"}
+
+
+def _normalize(value):
+    # MongoDB хранит время с точностью до миллисекунд
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, datetime):
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+
+async def run_replay(at: datetime = None, limit: int = 0, verify: bool = False) -> dict:
+    ids = [str(i) for i in await agent_repo().ids()]
+    if limit:
+        ids = ids[:limit]
+    rebuilt = events = mismatches = 0
+    seconds = 0.0
+    for agent_id in ids:
+        started = time.perf_counter()
+        agent, n = await replay_agent(agent_id, at)
+        seconds += time.perf_counter() - started
+        events += n
+        if agent is None:
+            continue
+        rebuilt += 1
+        if verify:
+            stored = await agent_repo().get(agent_id)
+            if _normalize(agent.model_dump(exclude=VERIFY_EXCLUDE)) != _normalize(stored.model_dump(exclude=VERIFY_EXCLUDE)):
+                mismatches += 1
+    result = {
+        "agents": len(ids),
+        "rebuilt": rebuilt,
+        "events_total": await history_repo().count(),
+        "events_replayed": events,
+        "seconds": round(seconds, 4),
+        "events_per_sec": round(events / seconds) if seconds else 0,
+        "agents_per_sec": round(len(ids) / seconds) if seconds else 0,
+    }
+    if verify:
+        result["mismatches"] = mismatches
+    return result
+
+
+async def main(args):
+    await connect(args.db, backend=args.storage)
+    try:
+        at = datetime.fromisoformat(args.at) if args.at else None
+        print(json.dumps(await run_replay(at, args.limit, args.verify), ensure_ascii=False, indent=2))
+    finally:
+        await disconnect()
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Реплей истории агентов и замер скорости")
+    p.add_argument("--db", default=None, help="имя базы данных (по умолчанию DATABASE_NAME)")
+    p.add_argument("--storage", choices=["embedded", "mongo"], default=None,
+                   help="хранилище (по умолчанию STORAGE_BACKEND)")
+    p.add_argument("--at", default=None, help="момент мирового времени (ISO 8601), по умолчанию — сейчас")
+    p.add_argument("--limit", type=int, default=0, help="сколько агентов восстановить (0 — всех)")
+    p.add_argument("--verify", action="store_true", help="сверить реплей с текущими документами (без --at)")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Literal, Optional
 from datetime import datetime
 from app.models.agent import Mood, PersonalityTraits, EmotionState, Relationship, Memory
 from app.models.event import EventType
@@ -60,6 +60,7 @@ class AgentResponse(BaseModel):
     is_active: bool
     created_at: datetime
     updated_at: datetime
+    revision: int = 0
 
 
 class AgentDetailResponse(AgentResponse):
@@ -98,6 +99,13 @@ class SendMessage(BaseModel):
     from_agent_id: Optional[str] = None
 
 
+class BroadcastMessage(BaseModel):
+    content: str
+    target: Literal["all", "mood", "ids"] = "all"   # все активные / по настроению / по списку
+    moods: list[Mood] = Field(default_factory=list)
+    agent_ids: list[str] = Field(default_factory=list)
+
+
 class ChatResponse(BaseModel):
     agent_id: str
     agent_name: str
@@ -0,0 +1,120 @@
+"""
+Массовый импорт и экспорт агентов в NDJSON — одна строка на агента.
+
+Экспорт отдает документы хранилища как есть (курсор MongoDB или обход
+встроенного хранилища порциями по CHUNK), без сборки модели Agent на
+каждую строку и без загрузки коллекции в память. Формат строки тот же,
+что у агента в снимке мира ("_id", отношения, память).
+
+Импорт читает тело запроса потоком, проверяет строки порциями по CHUNK
+и пишет каждую порцию одним insert_many. Строка — либо описание нового
+агента (поля AgentCreate: name, bio, personality, emotion...), либо
+строка экспорта: агент с "_id" сохраняет свой идентификатор, так что
+ссылки отношений остаются валидными (восстановление в пустую базу).
+Ошибочные строки пропускаются и перечисляются в ответе (первые
+MAX_ERRORS с номерами строк).
+"""
+import json
+import time
+from datetime import datetime
+from enum import Enum
+from typing import AsyncIterator
+
+from bson import ObjectId
+from pydantic import ValidationError
+
+from app.db.repository import agent_repo
+from app.models.agent import Agent
+
+CHUNK = 500
+MAX_ERRORS = 100
+# Поля, которые импорт не принимает от клиента: их ведет сервер
+SERVER_FIELDS = ("revision", "revision_id")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Не сериализуется в JSON: {type(value).__name__}")
+
+
+async def export_ndjson(active_only: bool = False) -> AsyncIterator[bytes]:
+    """Агенты в NDJSON порциями по CHUNK строк"""
+    buf = []
+    async for doc in agent_repo().iter_docs(active_only, CHUNK):
+        buf.append(json.dumps(doc, ensure_ascii=False, default=_json_default))
+        if len(buf) >= CHUNK:
+            yield ("\n".join(buf) + "\n").encode()
+            buf.clear()
+    if buf:
+        yield ("\n".join(buf) + "\n").encode()
+
+
+async def _lines(body: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, bytes]]:
+    """Непустые строки потока байтов с номерами (с 1)"""
+    tail = b""
+    n = 0
+    async for chunk in body:
+        *lines, tail = (tail + chunk).split(b"\n")
+        for line in lines:
+            n += 1
+            if line.strip():
+                yield n, line
+    if tail.strip():
+        yield n + 1, tail
+
+
+def _parse(line: bytes) -> Agent:
+    doc = json.loads(line)
+    if not isinstance(doc, dict):
+        raise ValueError("ожидается JSON-объект")
+    for field in SERVER_FIELDS:
+        doc.pop(field, None)
+    if "id" in doc and "_id" not in doc:
+        doc["_id"] = doc.pop("id")
+    return Agent.model_validate(doc)
+
+
+async def import_ndjson(body: AsyncIterator[bytes]) -> dict:
+    """Создать агентов из потока NDJSON. Возвращает счетчики и ошибки"""
+    started = time.perf_counter()
+    result = {"created": 0, "kept_ids": 0, "failed": 0, "errors": []}
+    repo = agent_repo()
+
+    async def write(batch: list[Agent], first_line: int):
+        kept = sum(a.id is not None for a in batch)
+        try:
+            await repo.insert_many(batch)
+        except Exception as e:
+            # Обычно — занятый "_id" при импорте экспорта в непустую базу
+            result["failed"] += len(batch)
+            if len(result["errors"]) < MAX_ERRORS:
+                result["errors"].append({"line": first_line, "error": f"порция из {len(batch)}: {e}"[:500]})
+            return
+        result["created"] += len(batch)
+        result["kept_ids"] += kept
+
+    batch: list[Agent] = []
+    first_line = 0
+    async for n, line in _lines(body):
+        try:
+            agent = _parse(line)
+        except (ValueError, ValidationError) as e:
+            result["failed"] += 1
+            if len(result["errors"]) < MAX_ERRORS:
+                result["errors"].append({"line": n, "error": str(e)[:500]})
+            continue
+        if not batch:
+            first_line = n
+        batch.append(agent)
+        if len(batch) >= CHUNK:
+            await write(batch, first_line)
+            batch = []
+    if batch:
+        await write(batch, first_line)
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
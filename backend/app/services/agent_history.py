@@ -0,0 +1,279 @@
+"""
+История состояния агентов (event sourcing).
+
+Каждая успешная запись агента (save_agent, WriteBatch) раскладывается на
+типизированные доменные события — разницу между прочитанным документом
+(base) и записанным:
+- mood_changed, emotion_changed — настроение, энергия, стресс, счастье;
+- relationship_added / relationship_removed / sympathy_changed
+  (с дельтами симпатии);
+- memory_added — новые воспоминания; memories_compacted — сжатие памяти
+  (сортировка и сводка), тогда пишется весь список;
+- goal_set, plan_set; field_set — прочие поля (имя, личность, is_active...);
+- agent_deleted.
+События несут новые значения, а не только приращения, поэтому реплей
+воспроизводит состояние точно, без накопления ошибок округления.
+
+Каждые CHECKPOINT_EVERY ревизий (и при первой записи — исходное состояние
+агента) пишется чекпоинт с полным документом. rebuild_agent(agent_id, at)
+берет последний чекпоинт не позже at и проигрывает поверх него события.
+
+История пишется после успешной записи агента: при падении между ними
+последняя правка может не попасть в историю, ближайший чекпоинт это
+выравнивает.
+"""
+import copy
+import os
+from datetime import datetime, timezone
+from enum import Enum
+
+from app.db.repository import history_repo
+from app.models.agent import Agent
+from app.models.agent_history import AgentEventType as T
+from app.services import world_state
+
+CHECKPOINT_EVERY = max(1, int(os.getenv("AGENT_CHECKPOINT_EVERY", "50")))
+HISTORY_ENABLED = os.getenv("AGENT_HISTORY", "1") != "0"
+
+HISTORY_STATS = {"writes": 0, "events": 0, "checkpoints": 0, "replays": 0, "replayed_events": 0}
+
+# Служебные поля: меняются при каждой записи и в события не попадают
+SKIP_FIELDS = {"revision", "updated_at", "revision_id", "id", "_id"}
+
+
+def set_history_enabled(enabled: bool):
+    global HISTORY_ENABLED
+    HISTORY_ENABLED = enabled
+
+
+def _plain(value):
+    """Значение в JSON-совместимом виде (одинаково для MongoDB и журнала встроенного хранилища)"""
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _naive_utc(moment: datetime | None) -> datetime | None:
+    if moment is not None and moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+'''Разница документов → события'''
+
+def _diff_relationships(old: list, new: list) -> list[tuple[T, dict]]:
+    before = {r["agent_id"]: r for r in old}
+    after = {r["agent_id"]: r for r in new}
+    kept = [aid for aid in before if aid in after]
+    added = [aid for aid in after if aid not in before]
+    # Реплей сохраняет порядок оставшихся и дописывает новые в конец;
+    # любой другой порядок (или дубли) — полной заменой списка
+    if len(before) != len(old) or len(after) != len(new) or [r["agent_id"] for r in new] != kept + added:
+        return [(T.FIELD_SET, {"field": "relationships", "value": _plain(new)})]
+    changes = []
+    removed = [aid for aid in before if aid not in after]
+    if removed:
+        changes.append((T.RELATIONSHIP_REMOVED, {"agent_ids": removed}))
+    updated, deltas = {}, {}
+    for aid in kept:
+        o, n = before[aid], after[aid]
+        if o == n:
+            continue
+        updated[aid] = {k: v for k, v in n.items() if o.get(k) != v}
+        if "sympathy" in updated[aid]:
+            deltas[aid] = round(n["sympathy"] - (o.get("sympathy") or 0.0), 6)
+    if updated:
+        changes.append((T.SYMPATHY_CHANGED, {"changes": _plain(updated), "deltas": deltas}))
+    for aid in added:
+        changes.append((T.RELATIONSHIP_ADDED, {"relationship": _plain(after[aid])}))
+    return changes
+
+
+def diff_documents(base: dict, doc: dict) -> list[tuple[T, dict]]:
+    """Типизированные изменения, переводящие base в doc"""
+    changes = []
+    for field, value in doc.items():
+        if field in SKIP_FIELDS:
+            continue
+        old = base.get(field)
+        if old == value:
+            continue
+        if field == "emotion" and isinstance(old, dict) and isinstance(value, dict):
+            if old.get("mood") != value.get("mood"):
+                changes.append((T.MOOD_CHANGED, {"mood": _plain(value.get("mood")), "previous": _plain(old.get("mood"))}))
+            values = {k: v for k, v in value.items() if k != "mood" and old.get(k) != v}
+            if values:
+                changes.append((T.EMOTION_CHANGED, {"values": _plain(values)}))
+        elif field == "relationships" and isinstance(old, list) and isinstance(value, list):
+            changes += _diff_relationships(old, value)
+        elif field == "memories" and isinstance(old, list) and isinstance(value, list):
+            if value[:len(old)] == old:
+                changes.append((T.MEMORY_ADDED, {"memories": _plain(value[len(old):])}))
+            else:
+                changes.append((T.MEMORIES_COMPACTED, {"memories": _plain(value)}))
+        elif field == "current_goal":
+            changes.append((T.GOAL_SET, {"goal": value}))
+        elif field == "current_plan":
+            changes.append((T.PLAN_SET, {"plan": value}))
+        else:
+            changes.append((T.FIELD_SET, {"field": field, "value": _plain(value)}))
+    return changes
+
+
+'''Реплей'''
+
+def _set_mood(state, data):
+    state.setdefault("emotion", {})["mood"] = data["mood"]
+
+
+def _update_emotion(state, data):
+    state.setdefault("emotion", {}).update(data["values"])
+
+
+def _add_relationship(state, data):
+    state.setdefault("relationships", []).append(dict(data["relationship"]))
+
+
+def _remove_relationships(state, data):
+    removed = set(data["agent_ids"])
+    state["relationships"] = [r for r in state.get("relationships", []) if r["agent_id"] not in removed]
+
+
+def _update_relationships(state, data):
+    changes = data["changes"]
+    for r in state.get("relationships", []):
+        if r["agent_id"] in changes:
+            r.update(changes[r["agent_id"]])
+
+
+def _add_memories(state, data):
+    state.setdefault("memories", []).extend(data["memories"])
+
+
+def _compact_memories(state, data):
+    state["memories"] = list(data["memories"])
+
+
+def _set_goal(state, data):
+    state["current_goal"] = data["goal"]
+
+
+def _set_plan(state, data):
+    state["current_plan"] = data["plan"]
+
+
+def _set_field(state, data):
+    # Копия: последующие события меняют emotion/relationships на месте
+    state[data["field"]] = copy.deepcopy(data["value"])
+
+
+# По строковому значению типа: в сырых документах истории тип — строка
+APPLY = {
+    T.MOOD_CHANGED.value: _set_mood,
+    T.EMOTION_CHANGED.value: _update_emotion,
+    T.RELATIONSHIP_ADDED.value: _add_relationship,
+    T.RELATIONSHIP_REMOVED.value: _remove_relationships,
+    T.SYMPATHY_CHANGED.value: _update_relationships,
+    T.MEMORY_ADDED.value: _add_memories,
+    T.MEMORIES_COMPACTED.value: _compact_memories,
+    T.GOAL_SET.value: _set_goal,
+    T.PLAN_SET.value: _set_plan,
+    T.FIELD_SET.value: _set_field,
+}
+
+
+def apply_event(state: dict, event_type: str, data: dict):
+    APPLY[event_type](state, data)
+
+
+def _copy_state(state: dict) -> dict:
+    # Реплей меняет на месте только эмоции и отношения
+    state = dict(state)
+    state["emotion"] = dict(state.get("emotion") or {})
+    state["relationships"] = [dict(r) for r in state.get("relationships") or ()]
+    state["memories"] = list(state.get("memories") or ())
+    return state
+
+
+async def replay_agent(agent_id: str, at: datetime = None) -> tuple[Agent | None, int]:
+    """Состояние агента на момент at (None — последнее по истории)
+    и число проигранных событий. None — агента тогда не было или он удален."""
+    at = _naive_utc(at)
+    repo = history_repo()
+    cp = await repo.latest_checkpoint(agent_id, at)
+    if cp is None:
+        return None, 0
+    state = _copy_state(cp["state"])
+    revision, timestamp, n = cp["revision"], cp["timestamp"], 0
+    async for event in repo.stream(agent_id, revision, at):
+        n += 1
+        if event["event_type"] == T.AGENT_DELETED.value:
+            state = None
+            break
+        APPLY[event["event_type"]](state, event["data"])
+        revision, timestamp = event["revision"], event["timestamp"]
+    HISTORY_STATS["replays"] += 1
+    HISTORY_STATS["replayed_events"] += n
+    if state is None:
+        return None, n
+    state["revision"], state["updated_at"] = revision, timestamp
+    return Agent.model_validate({**state, "_id": agent_id}), n
+
+
+async def rebuild_agent(agent_id: str, at: datetime = None) -> Agent | None:
+    agent, _ = await replay_agent(agent_id, at)
+    return agent
+
+
+'''Запись истории'''
+
+def _checkpoint(agent_id: str, revision: int, timestamp: datetime, state: dict) -> dict:
+    return {"agent_id": agent_id, "revision": revision, "timestamp": timestamp, "state": _plain(state)}
+
+
+def history_for_write(agent_id: str, base: dict, doc: dict, at: datetime) -> tuple[list[dict], list[dict]]:
+    """Документы событий (AgentEvent) и чекпоинтов (AgentCheckpoint) для записи
+    агента base → doc; doc["revision"] — новая ревизия"""
+    revision = doc["revision"]
+    events = [{"agent_id": agent_id, "revision": revision, "seq": i, "event_type": t.value,
+               "data": data, "timestamp": at}
+              for i, (t, data) in enumerate(diff_documents(base, doc))]
+    checkpoints = []
+    if not base.get("revision"):
+        # Первая запись: исходное состояние агента — начало истории
+        created = base.get("created_at")
+        checkpoints.append(_checkpoint(agent_id, 0, min(created, at) if isinstance(created, datetime) else at, base))
+    if revision % CHECKPOINT_EVERY == 0:
+        checkpoints.append(_checkpoint(agent_id, revision, at, doc))
+    return events, checkpoints
+
+
+async def record_writes(writes: list[tuple[str, dict, dict]]):
+    """Записать историю для успешных записей агентов: (agent_id, base, doc)"""
+    if not HISTORY_ENABLED or not writes:
+        return
+    at = world_state.now()
+    events, checkpoints = [], []
+    for agent_id, base, doc in writes:
+        e, c = history_for_write(agent_id, base, doc, at)
+        events += e
+        checkpoints += c
+    HISTORY_STATS["writes"] += len(writes)
+    HISTORY_STATS["events"] += len(events)
+    HISTORY_STATS["checkpoints"] += len(checkpoints)
+    await history_repo().append(events, checkpoints)
+
+
+async def record_deletion(agent: Agent):
+    if not HISTORY_ENABLED:
+        return
+    event = {"agent_id": str(agent.id), "revision": agent.revision + 1, "seq": 0,
+             "event_type": T.AGENT_DELETED.value, "data": {"name": agent.name}, "timestamp": world_state.now()}
+    HISTORY_STATS["events"] += 1
+    await history_repo().append([event])
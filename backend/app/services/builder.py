@@ -14,6 +14,7 @@
 from app.models.agent import Agent, PersonalityTraits, EmotionState, Mood, Memory
 from app.models.event import Event, EventType
 from app.models.log import Log, LogLevel, LogCategory
+from app.services.world_state import now
 from typing import Optional
 
 
@@ -61,7 +62,7 @@ class AgentBuilder:
         return self
 
     def add_memory(self, content: str, importance=0.5):
-        self._memories.append(Memory(content=content, importance=importance))
+        self._memories.append(Memory(content=content, importance=importance, timestamp=now()))
         return self
 
     def set_goal(self, goal: str):
@@ -69,11 +70,14 @@ class AgentBuilder:
         return self
 
     def build(self) -> Agent:
+        # Время мира, а не реальное: после перемотки часов или в симуляции
+        # с остановленными часами агент не оказывается "из будущего"
+        created = now()
         return Agent(
             name=self._name, bio=self._bio, avatar_url=self._avatar_url,
             personality=self._personality, emotion=self._emotion,
             system_prompt=self._system_prompt, memories=self._memories,
-            current_goal=self._current_goal,
+            current_goal=self._current_goal, created_at=created, updated_at=created,
         )
 
 
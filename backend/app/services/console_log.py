@@ -0,0 +1,199 @@
+"""
+Консольный лог без блокировки цикла событий.
+
+Все модули пишут через logging.getLogger(__name__) в дерево логгеров "app".
+Единственный обработчик дерева — QueueHandler: запись кладется в очередь,
+а форматирование вывода и запись в stdout делает поток QueueListener.
+Очередь ограничена LOG_QUEUE_SIZE: если консоль не успевает, записи
+отбрасываются (LOG_STATS["dropped"]), а не тормозят цикл событий.
+
+Частые сообщения (сохранение агента, связи графа) прореживаются до
+LOG_SAMPLE_RATE записей в секунду на шаблон сообщения; число пропущенных
+попадает в поле suppressed следующей прошедшей записи. WARNING и выше не
+прореживаются. Поэтому сообщения пишутся с %-аргументами — шаблон служит
+ключом, а строка не собирается для отброшенных записей.
+
+Окружение:
+    LOG_FORMAT=json|text            JSON — одна строка на запись, с полями extra
+    LOG_LEVEL=INFO                  уровень дерева app
+    LOG_LEVELS=app.services.lifecycle_service=WARNING,app.db=DEBUG
+    LOG_SAMPLE_RATE=20              записей/с на шаблон (0 — без прореживания)
+    LOG_SAMPLE=app.controllers.system_controller=5
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT_LOGGER = "app"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "20"))
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+LOG_QUEUE_SIZE = 10000
+
+LOG_STATS = {"enqueued": 0, "dropped": 0, "sampled_out": 0}
+
+# Поля любой LogRecord: все остальное — extra, их выводим отдельно
+_STANDARD = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "suppressed"}
+
+_state = {"listener": None}
+
+
+def _parse_pairs(spec: str) -> dict[str, str]:
+    pairs = {}
+    for item in spec.split(","):
+        name, _, value = item.strip().partition("=")
+        if name and value:
+            pairs[name.strip()] = value.strip()
+    return pairs
+
+
+def _extras(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in record.__dict__.items() if k not in _STANDARD}
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        doc = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        doc.update(_extras(record))
+        if getattr(record, "suppressed", 0):
+            doc["suppressed"] = record.suppressed
+        return json.dumps(doc, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        extras = _extras(record)
+        if getattr(record, "suppressed", 0):
+            extras["suppressed"] = record.suppressed
+        if extras:
+            line += " " + " ".join(f"{k}={v}" for k, v in extras.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """Не больше rate записей в секунду на (логгер, шаблон сообщения)"""
+
+    def __init__(self, default_rate: float, rates: dict[str, float]):
+        super().__init__()
+        self.default_rate = default_rate
+        self.rates = rates
+        self._rate_by_logger: dict[str, float] = {}
+        # ключ → [начало окна, записей в окне, пропущено]
+        self._windows: dict[tuple, list] = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._rate_by_logger.get(name)
+        if rate is None:
+            # Самый длинный заданный префикс имени логгера
+            prefix = max((p for p in self.rates if name == p or name.startswith(p + ".")), key=len, default=None)
+            rate = self._rate_by_logger[name] = self.rates[prefix] if prefix else self.default_rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        w = self._windows.get(key)
+        if w is None or now - w[0] >= 1.0:
+            suppressed = w[2] if w else 0
+            self._windows[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if w[1] < rate:
+            w[1] += 1
+            return True
+        w[2] += 1
+        LOG_STATS["sampled_out"] += 1
+        return False
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Полная очередь — запись отбрасывается, вызывающий поток не ждет"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            LOG_STATS["enqueued"] += 1
+        except queue.Full:
+            LOG_STATS["dropped"] += 1
+
+
+def _utf8_console(*streams):
+    # Консоль Windows по умолчанию не в UTF-8: перенастраиваем поток на месте,
+    # без TextIOWrapper поверх него; дочерним процессам — UTF-8 режим
+    if sys.platform != "win32":
+        return
+    os.environ["PYTHONIOENCODING"] = "utf-8"
+    os.environ["PYTHONUTF8"] = "1"
+    import locale
+    for name in ("en_US.UTF-8", "ru_RU.UTF-8"):
+        try:
+            locale.setlocale(locale.LC_ALL, name)
+            break
+        except locale.Error:
+            pass  # остается системная локаль
+    for stream in streams:
+        try:
+            stream.reconfigure(encoding="utf-8", errors="replace")
+        except (AttributeError, ValueError):
+            pass
+
+
+def setup_logging(level: str = None, fmt: str = None, stream=None):
+    """Настроить дерево логгеров app (повторный вызов перенастраивает)"""
+    shutdown_logging()
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel((level or LOG_LEVEL).upper())
+    root.propagate = False
+    for name, lvl in _parse_pairs(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(lvl.upper())
+
+    stream = stream or sys.stdout
+    _utf8_console(stream, sys.stderr)
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == "json" else TextFormatter())
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = _DroppingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE, {k: float(v) for k, v in _parse_pairs(LOG_SAMPLE).items()}))
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    _state["listener"] = listener
+
+
+def shutdown_logging():
+    """Дописать очередь и остановить поток вывода"""
+    listener = _state["listener"]
+    if listener is not None:
+        listener.stop()
+        _state["listener"] = None
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,188 @@
+"""
+Не-LLM эмоциональная динамика всего населения за один тик.
+
+Возврат счастья/стресса/энергии к базовому уровню (медленнее у невротичных
+агентов), подталкивание настроения по последним воспоминаниям и остывание
+симпатии без общения считаются сразу для всех агентов операциями NumPy
+над struct-of-arrays представлением. Результат записывается обратно
+только в изменившихся агентов — они уходят в общий bulk-сброс тика.
+"""
+import math
+from datetime import datetime
+
+import numpy as np
+
+from app.models.agent import Agent, Mood
+
+MOODS = list(Mood)
+MOOD_CODE = {m: i for i, m in enumerate(MOODS)}
+
+# Базовые уровни — значения по умолчанию EmotionState
+BASE_HAPPINESS, BASE_STRESS, BASE_ENERGY = 0.5, 0.3, 0.7
+
+# Скорости возврата к базе (1/с мирового времени), заданы через период полураспада
+HAPPINESS_RATE = math.log(2) / 300   # 5 минут
+STRESS_RATE = math.log(2) / 600      # 10 минут
+ENERGY_RATE = math.log(2) / 900      # 15 минут
+NEUROTICISM_DAMPING = 0.6            # невротизм 1.0 замедляет возврат на 60%
+
+# Симпатия остывает к нулю, если агенты долго не общались
+SYMPATHY_RATE = math.log(2) / 7200   # 2 часа
+SYMPATHY_GRACE = 1800                # первые 30 минут без общения — без остывания
+
+POSITIVE_MEMORY_WORDS = ["рад", "хорошо", "отлично", "спасибо"]
+NEGATIVE_MEMORY_WORDS = ["плохо", "грустно", "злой", "проблем"]
+
+EPS = 1e-4
+
+# id агента → (число воспоминаний, время последнего, pos, neg): тексты памяти
+# меняются редко, поэтому пересчитываем тональность только при изменениях
+_sentiment_cache: dict = {}
+
+
+def memory_sentiment(agent: Agent) -> tuple[int, int]:
+    """Число позитивных и негативных воспоминаний среди пяти последних"""
+    memories = agent.memories
+    if not memories:
+        return 0, 0
+    key = agent.id
+    latest = memories[-1].timestamp
+    cached = _sentiment_cache.get(key)
+    if cached and cached[0] == len(memories) and cached[1] == latest:
+        return cached[2], cached[3]
+    recent = sorted(memories, key=lambda m: m.timestamp, reverse=True)[:5]
+    contents = [m.content.lower() for m in recent]
+    pos = sum(1 for c in contents if any(w in c for w in POSITIVE_MEMORY_WORDS))
+    neg = sum(1 for c in contents if any(w in c for w in NEGATIVE_MEMORY_WORDS))
+    _sentiment_cache[key] = (len(memories), latest, pos, neg)
+    return pos, neg
+
+
+class PopulationArrays:
+    """Struct-of-arrays представление эмоций населения"""
+
+    def __init__(self, agents: list[Agent], skip_memory: set):
+        n = len(agents)
+        emotions = [a.emotion for a in agents]
+        self.happiness = np.fromiter((e.happiness for e in emotions), dtype=float, count=n)
+        self.stress = np.fromiter((e.stress for e in emotions), dtype=float, count=n)
+        self.energy = np.fromiter((e.energy for e in emotions), dtype=float, count=n)
+        self.neuroticism = np.fromiter((a.personality.neuroticism for a in agents), dtype=float, count=n)
+        self.mood = np.fromiter((MOOD_CODE[e.mood] for e in emotions), dtype=np.int8, count=n)
+        # Агенты, которые рефлексировали в этом тике, уже обновили настроение
+        sentiment = [(0, 0) if a.id in skip_memory else memory_sentiment(a) for a in agents]
+        self.pos = np.fromiter((p for p, _ in sentiment), dtype=np.int16, count=n)
+        self.neg = np.fromiter((q for _, q in sentiment), dtype=np.int16, count=n)
+
+
+def _relax(x: np.ndarray, base: float, rate: np.ndarray, dt: float) -> np.ndarray:
+    return base + (x - base) * np.exp(-rate * dt)
+
+
+# Остывание симпатии копится и применяется крупными шагами: оно медленное,
+# а переписывать все отношения каждый тик дорого
+SYMPATHY_STEP = 300
+# Отношение переписывается, только если симпатия сдвинется хотя бы на столько;
+# меньшее остывание копится для этого отношения до следующего шага
+SYMPATHY_MIN_CHANGE = 0.01
+_sympathy_pending_dt = 0.0
+# (id агента, id другого) → накопленное, но еще не примененное время остывания
+_sympathy_carry: dict[tuple[str, str], float] = {}
+
+
+def reset_state():
+    """Забыть кэш тональности и накопленное остывание (новая симуляция)"""
+    global _sympathy_pending_dt
+    _sympathy_pending_dt = 0.0
+    _sympathy_carry.clear()
+    _sentiment_cache.clear()
+
+
+def step_population(agents: list[Agent], dt: float, now: datetime,
+                    skip_memory: set = frozenset()) -> list[Agent]:
+    """Один тик эмоциональной динамики. skip_memory — id агентов, уже обновивших
+    настроение рефлексией в этом тике. Возвращает список измененных агентов"""
+    global _sympathy_pending_dt
+    if not agents:
+        return []
+    s = PopulationArrays(agents, skip_memory)
+    h0, st0, en0, mood0 = s.happiness, s.stress, s.energy, s.mood
+
+    # 1. Подталкивание по воспоминаниям
+    has_memory = (s.pos + s.neg) > 0
+    positive = has_memory & (s.pos > s.neg * 2)
+    negative = has_memory & (s.neg > s.pos * 2)
+    happiness = np.where(positive, np.minimum(0.9, h0 + 0.02), h0)
+    happiness = np.where(negative, np.maximum(0.1, happiness - 0.02), happiness)
+    stress = np.where(negative, np.minimum(1.0, st0 + 0.03), st0)
+    energy = en0
+    mood = np.where(positive & (happiness > 0.7), MOOD_CODE[Mood.HAPPY], mood0)
+    mood = np.where(negative & (happiness < 0.3), MOOD_CODE[Mood.SAD], mood)
+
+    # 2. Возврат к базовому уровню, взвешенный невротизмом
+    if dt > 0:
+        damping = 1.0 - NEUROTICISM_DAMPING * s.neuroticism
+        drifting = ~(positive | negative)
+        happiness = np.where(drifting, _relax(happiness, BASE_HAPPINESS, HAPPINESS_RATE * damping, dt), happiness)
+        stress = _relax(stress, BASE_STRESS, STRESS_RATE * damping, dt)
+        energy = _relax(energy, BASE_ENERGY, ENERGY_RATE, dt)
+    happiness, stress, energy = np.clip(happiness, 0.0, 1.0), np.clip(stress, 0.0, 1.0), np.clip(energy, 0.0, 1.0)
+
+    dh, ds, de, dm = np.abs(happiness - h0) > EPS, np.abs(stress - st0) > EPS, np.abs(energy - en0) > EPS, mood != mood0
+    touched = dh | ds | de | dm
+
+    # 3. Остывание симпатии
+    _sympathy_pending_dt += dt
+    if _sympathy_pending_dt >= SYMPATHY_STEP:
+        for i in _decay_sympathy(agents, _sympathy_pending_dt, now):
+            touched[i] = True
+        _sympathy_pending_dt = 0.0
+
+    # Запись обратно только измененных полей
+    result = []
+    dh, ds, de, dm = dh.tolist(), ds.tolist(), de.tolist(), dm.tolist()
+    happiness, stress, energy, mood = happiness.tolist(), stress.tolist(), energy.tolist(), mood.tolist()
+    for i in np.flatnonzero(touched).tolist():
+        e = agents[i].emotion
+        if dh[i]: e.happiness = happiness[i]
+        if ds[i]: e.stress = stress[i]
+        if de[i]: e.energy = energy[i]
+        if dm[i]: e.mood = MOODS[mood[i]]
+        result.append(agents[i])
+    return result
+
+
+def _decay_sympathy(agents: list[Agent], dt: float, now: datetime) -> set[int]:
+    """Остужает симпатию давно не общавшихся пар одной операцией над плоскими
+    массивами всех отношений. Возвращает индексы агентов, у которых
+    записанная симпатия действительно изменилась"""
+    global _sympathy_carry
+    counts = [len(a.relationships) for a in agents]
+    rels = [r for a in agents for r in a.relationships]
+    if not rels:
+        _sympathy_carry = {}
+        return set()
+    owners = np.repeat(np.arange(len(agents)), counts)
+    last = np.array([r.last_interaction for r in rels], dtype="datetime64[us]")
+    idle = (np.datetime64(now, "us") - last) / np.timedelta64(1, "s")
+    idle[np.isnat(last)] = np.inf
+    sympathy = np.fromiter((r.sympathy for r in rels), dtype=float, count=len(rels))
+
+    # Остывают только простаивающие отношения с ненулевой симпатией
+    cooling = np.flatnonzero((idle > SYMPATHY_GRACE) & (sympathy != 0.0))
+    if not len(cooling):
+        _sympathy_carry = {}
+        return set()
+    ids = [str(a.id) for a in agents]
+    keys = [(ids[o], rels[j].agent_id) for j, o in zip(cooling.tolist(), owners[cooling].tolist())]
+    elapsed = dt + np.fromiter((_sympathy_carry.get(k, 0.0) for k in keys), dtype=float, count=len(keys))
+    decayed = sympathy[cooling] * np.exp(-SYMPATHY_RATE * elapsed)
+    write = np.abs(decayed - sympathy[cooling]) >= SYMPATHY_MIN_CHANGE
+
+    held = np.flatnonzero(~write).tolist()
+    held_dt = elapsed[~write].tolist()
+    _sympathy_carry = {keys[k]: t for k, t in zip(held, held_dt)}
+    moved = cooling[write].tolist()
+    for j, value in zip(moved, decayed[write].tolist()):
+        rels[j].sympathy = value
+    return set(owners[cooling[write]].tolist())
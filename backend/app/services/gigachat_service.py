@@ -1,42 +1,31 @@
-from gigachat import GigaChat
-from gigachat.models import Chat, Messages, MessagesRole
 from app.models.agent import Agent, Mood
+from app.services import llm_cassette, llm_resilience, llm_usage, metrics, offline_llm
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from typing import TYPE_CHECKING
+import asyncio
+import logging
 import os
-import sys
-from dotenv import load_dotenv
+import time
 
-# Устанавливаем UTF-8 кодировку по умолчанию
-os.environ['PYTHONIOENCODING'] = 'utf-8'
-os.environ['PYTHONUTF8'] = '1'  # Включает UTF-8 режим в Python 3.7+
-
-if sys.platform == 'win32':
-    import io
-    import locale
-    # Пытаемся установить UTF-8 локаль
-    try:
-        locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
-    except locale.Error:
-        try:
-            locale.setlocale(locale.LC_ALL, 'ru_RU.UTF-8')
-        except locale.Error:
-            pass  # Используем системную локаль
-    
-    # Переопределяем stdout/stderr для корректной работы с UTF-8
-    if hasattr(sys.stdout, 'buffer'):
-        try:
-            sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
-        except (AttributeError, ValueError):
-            pass
-    if hasattr(sys.stderr, 'buffer'):
-        try:
-            sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
-        except (AttributeError, ValueError):
-            pass
-
-load_dotenv()
+# SDK GigaChat импортируется при первом запросе к LLM (get_client, _chat):
+# его импорт — заметная часть холодного старта API и воркера
+if TYPE_CHECKING:
+    from gigachat.models import Chat
 
 CREDENTIALS = os.getenv("GIGACHAT_CREDENTIALS")
 SCOPE = os.getenv("GIGACHAT_SCOPE", "GIGACHAT_API_PERS")
+logger = logging.getLogger(__name__)
+
+# gigachat — реальный API, offline — локальные ответы без сети (симуляции, бенчмарки)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gigachat")
+
+
+def set_llm_backend(name: str):
+    """Переключить бэкенд LLM (gigachat / offline)"""
+    global LLM_BACKEND
+    if name not in ("gigachat", "offline"):
+        raise ValueError(f"Неизвестный LLM бэкенд: {name}")
+    LLM_BACKEND = name
 
 
 def get_client():
@@ -45,9 +34,85 @@ def get_client():
             "GIGACHAT_CREDENTIALS не установлен в переменных окружения. "
             "Проверьте файл .env в папке backend/"
         )
+    from gigachat import GigaChat
     return GigaChat(credentials=CREDENTIALS, scope=SCOPE, verify_ssl_certs=False)
 
 
+def preload_sdk():
+    """Импортировать SDK заранее — в потоке, пока процесс поднимается
+    (иначе импорт ляжет на первый запрос к LLM в цикле событий)"""
+    import gigachat.models  # noqa: F401
+
+
+def _chat(system: str, user: str, temperature: float, max_tokens: int) -> "Chat":
+    from gigachat.models import Chat, Messages, MessagesRole
+    return Chat(
+        messages=[
+            Messages(role=MessagesRole.SYSTEM, content=system),
+            Messages(role=MessagesRole.USER, content=user),
+        ],
+        temperature=temperature, max_tokens=max_tokens,
+    )
+
+
+async def _call_backend(backend: str, kind: str, chat_obj: "Chat", agent: Agent, target: Agent,
+                        message: str, turns: list = None) -> tuple[str, int, int, bool]:
+    """Ответ бэкенда: (текст, prompt_tokens, completion_tokens, cached)"""
+    if backend == "offline":
+        if turns is not None:
+            text = offline_llm.complete_batch(turns)
+        else:
+            text = offline_llm.complete(kind, agent, target, message)
+        return (text, llm_usage.estimate_tokens(*(m.content for m in chat_obj.messages)),
+                llm_usage.estimate_tokens(text), False)
+    # Асинхронный клиент: синхронный c.chat блокировал цикл событий на все время запроса
+    async with get_client() as c:
+        resp = await c.achat(chat_obj)
+    usage = resp.usage
+    if usage is None:
+        return resp.choices[0].message.content, 0, 0, False
+    return (resp.choices[0].message.content, usage.prompt_tokens, usage.completion_tokens,
+            bool(usage.precached_prompt_tokens))
+
+
+async def _complete(kind: str, chat_obj: "Chat", agent: Agent = None, target: Agent = None, message: str = "",
+                    turns: list = None) -> str:
+    """Единая точка вызова LLM: kind — chat / reflect / dialogue / dialogue_batch / think
+    (turns — реплики пакета для офлайн-бэкенда). С кассетой (app.services.llm_cassette) ответы пишутся или берутся из нее.
+    Вызовы API — с дедлайном и размыкателем (app.services.llm_resilience): пока цепь
+    разомкнута, ответ дает офлайн-бэкенд (backend "fallback" в метриках)"""
+    backend = LLM_BACKEND
+    started = time.perf_counter()
+    result, error = None, None
+    try:
+        if llm_cassette.mode() == "replay":
+            result = await llm_cassette.replay(kind, chat_obj)
+            if result is not None:
+                backend = "cassette"
+        if result is None and backend != "offline" and not llm_resilience.breaker.allow():
+            backend = "fallback"
+            result = await _call_backend("offline", kind, chat_obj, agent, target, message, turns)
+        if result is None:
+            if backend == "offline":
+                result = await _call_backend(backend, kind, chat_obj, agent, target, message, turns)
+            else:
+                result = await llm_resilience.guarded(kind, lambda: _call_backend(
+                    backend, kind, chat_obj, agent, target, message, turns))
+            if llm_cassette.mode() == "record":
+                llm_cassette.record(kind, chat_obj, result, time.perf_counter() - started)
+        return result[0]
+    except Exception as e:
+        metrics.LLM_ERRORS.inc(kind, backend)
+        error = f"{type(e).__name__}: {str(e)[:200]}"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.LLM_LATENCY.observe(elapsed, kind, backend)
+        _, prompt_tokens, completion_tokens, cached = result or ("", 0, 0, False)
+        llm_usage.record_call(kind, backend, str(agent.id) if agent else None, str(target.id) if target else None,
+                              prompt_tokens, completion_tokens, elapsed, cached, error)
+
+
 def check_forbidden_phrases(text: str) -> tuple[bool, str]:
     """Проверяет текст на наличие запрещенных фраз и возвращает (найдено, замененный_текст)"""
     if not text:
@@ -65,7 +130,7 @@ def check_forbidden_phrases(text: str) -> tuple[bool, str]:
     text_lower = text.lower()
     for phrase in forbidden_phrases:
         if phrase in text_lower:
-            print(f"[GIGACHAT] ВНИМАНИЕ: Текст содержит запрещенную фразу '{phrase}'. Оригинальный текст: {text[:150]}")
+            logger.warning("Текст содержит запрещенную фразу '%s'. Оригинальный текст: %s", phrase, text[:150])
             # Возвращаем нейтральный ответ в зависимости от контекста
             if 'рефлексия' in text_lower or 'мысли' in text_lower:
                 return True, "Я думаю о том, что происходит вокруг меня. Мне нужно время, чтобы все обдумать."
@@ -93,28 +158,29 @@ def ensure_utf8(text: str) -> str:
         return text.encode('utf-8', errors='replace').decode('utf-8')
 
 
-def make_prompt(agent: Agent) -> str:
-    moods = {
-        Mood.HAPPY: "Ты в хорошем настроении. Говори весело и оптимистично, используй позитивные слова.",
-        Mood.SAD: "Тебе грустно. Твой тон меланхоличный, речь медленная и задумчивая.",
-        Mood.ANGRY: "Ты раздражён. Говори резко, короткими фразами, можешь быть саркастичным.",
-        Mood.NEUTRAL: "Ты спокоен. Говори нейтрально и сдержанно.",
-        Mood.EXCITED: "Ты взволнован! Говори энергично, используй восклицания, речь быстрая и эмоциональная.",
-        Mood.ANXIOUS: "Ты нервничаешь. Твоя речь неуверенная, много вопросов, ты переживаешь.",
-        Mood.BORED: "Тебе скучно. Говори монотонно, без энтузиазма, короткими фразами.",
-    }
-    
-    # Стиль речи в зависимости от настроения
-    speech_styles = {
-        Mood.HAPPY: "Используй восклицания, эмодзи в тексте (если уместно), будь дружелюбным.",
-        Mood.SAD: "Говори тихо, используй многоточия, выражай грусть словами.",
-        Mood.ANGRY: "Говори резко, агрессивно, можешь использовать грубые слова, короткие фразы, выражай злость и недовольство. Можешь быть саркастичным или прямо грубым.",
-        Mood.NEUTRAL: "Говори спокойно и размеренно.",
-        Mood.EXCITED: "Используй восклицания, много энергии, быстрый темп речи!",
-        Mood.ANXIOUS: "Задавай вопросы, выражай сомнения, говори неуверенно.",
-        Mood.BORED: "Говори скучно, без энтузиазма, коротко.",
-    }
+MOOD_INSTRUCTIONS = {
+    Mood.HAPPY: "Ты в хорошем настроении. Говори весело и оптимистично, используй позитивные слова.",
+    Mood.SAD: "Тебе грустно. Твой тон меланхоличный, речь медленная и задумчивая.",
+    Mood.ANGRY: "Ты раздражён. Говори резко, короткими фразами, можешь быть саркастичным.",
+    Mood.NEUTRAL: "Ты спокоен. Говори нейтрально и сдержанно.",
+    Mood.EXCITED: "Ты взволнован! Говори энергично, используй восклицания, речь быстрая и эмоциональная.",
+    Mood.ANXIOUS: "Ты нервничаешь. Твоя речь неуверенная, много вопросов, ты переживаешь.",
+    Mood.BORED: "Тебе скучно. Говори монотонно, без энтузиазма, короткими фразами.",
+}
+
+# Стиль речи в зависимости от настроения
+SPEECH_STYLES = {
+    Mood.HAPPY: "Используй восклицания, эмодзи в тексте (если уместно), будь дружелюбным.",
+    Mood.SAD: "Говори тихо, используй многоточия, выражай грусть словами.",
+    Mood.ANGRY: "Говори резко, агрессивно, можешь использовать грубые слова, короткие фразы, выражай злость и недовольство. Можешь быть саркастичным или прямо грубым.",
+    Mood.NEUTRAL: "Говори спокойно и размеренно.",
+    Mood.EXCITED: "Используй восклицания, много энергии, быстрый темп речи!",
+    Mood.ANXIOUS: "Задавай вопросы, выражай сомнения, говори неуверенно.",
+    Mood.BORED: "Говори скучно, без энтузиазма, коротко.",
+}
+
 
+def make_prompt(agent: Agent) -> str:
     top_mem = sorted(agent.memories, key=lambda m: m.importance, reverse=True)[:5]
     mem_block = ""
     if top_mem:
@@ -135,8 +201,8 @@ def make_prompt(agent: Agent) -> str:
     agent_name = ensure_utf8(str(agent.name))
     agent_bio = ensure_utf8(str(agent.bio))
     
-    mood_instruction = moods.get(agent.emotion.mood, 'Ты спокоен.')
-    speech_style = speech_styles.get(agent.emotion.mood, 'Говори спокойно.')
+    mood_instruction = MOOD_INSTRUCTIONS.get(agent.emotion.mood, 'Ты спокоен.')
+    speech_style = SPEECH_STYLES.get(agent.emotion.mood, 'Говори спокойно.')
     
     prompt = (
         f"Ты — {agent_name}, живой человек в виртуальном мире. {agent_bio}\n\n"
@@ -260,15 +326,7 @@ async def chat(agent: Agent, message: str) -> str:
         system_msg_content = unicodedata.normalize('NFKC', system_msg_content)
         user_msg_content = unicodedata.normalize('NFKC', user_msg_content)
         
-        system_msg = Messages(role=MessagesRole.SYSTEM, content=system_msg_content)
-        user_msg = Messages(role=MessagesRole.USER, content=user_msg_content)
-        
-        # Проверяем, что объекты можно сериализовать через model_dump
-        chat_obj = Chat(
-            messages=[system_msg, user_msg],
-            temperature=0.8, 
-            max_tokens=300,
-        )
+        chat_obj = _chat(system_msg_content, user_msg_content, temperature=0.8, max_tokens=300)
         
         # Тестовая сериализация объекта Chat
         try:
@@ -277,9 +335,7 @@ async def chat(agent: Agent, message: str) -> str:
         except (UnicodeEncodeError, TypeError) as e:
             raise ValueError(f"Ошибка сериализации Chat объекта: {e}")
         
-        with get_client() as c:
-            resp = c.chat(chat_obj)
-        result = resp.choices[0].message.content
+        result = await _complete("chat", chat_obj, agent, message=message)
         if not result:
             return "Извините, не могу ответить."
         
@@ -351,15 +407,7 @@ async def reflect(agent: Agent) -> str:
     user_content = ensure_utf8(user_content)
 
     try:
-        with get_client() as c:
-            resp = c.chat(Chat(
-                messages=[
-                    Messages(role=MessagesRole.SYSTEM, content=prompt),
-                    Messages(role=MessagesRole.USER, content=user_content),
-                ],
-                temperature=0.9, max_tokens=400,
-            ))
-        result = resp.choices[0].message.content
+        result = await _complete("reflect", _chat(prompt, user_content, temperature=0.9, max_tokens=400), agent)
         if not result:
             return "Не могу проанализировать."
         
@@ -377,8 +425,38 @@ async def reflect(agent: Agent) -> str:
         raise Exception(error_msg)
 
 
-async def dialogue(agent1: Agent, agent2: Agent, context: str = "") -> str:
-    prompt = make_prompt(agent1)
+# Правила реплики в диалоге (общие для всех агентов)
+DIALOGUE_RULES = (
+    "\n\n═══════════════════════════════════════════════════════════════\n"
+    "КРИТИЧЕСКИ ВАЖНО - ТЫ ЖИВОЙ ЧЕЛОВЕК:\n"
+    "═══════════════════════════════════════════════════════════════\n"
+    "1. Скажи что-нибудь естественно, 1-2 предложения\n"
+    "2. НЕ говори 'привет', 'здравствуй', 'приветствую' если разговор уже идет\n"
+    "3. Если отношения плохие или ты обижен - можешь быть грубым, агрессивным, выражать негатив\n"
+    "4. Если отношения хорошие - будь дружелюбным и открытым\n"
+    "5. Если есть контекст - отвечай на него, развивай тему, задавай вопросы\n"
+    "6. Если нет контекста - начни разговор с интересной темы, вопроса или наблюдения\n"
+    "7. Ты ЖИВОЙ ЧЕЛОВЕК, НЕ программа, НЕ AI, НЕ нейросеть, НЕ система\n"
+    "8. АБСОЛЮТНО ЗАПРЕЩЕНО упоминать (НИКОГДА, НИ ПРИ КАКИХ УСЛОВИЯХ):\n"
+    "   ❌ 'языковая модель' / 'AI' / 'нейросеть' / 'алгоритм' / 'система'\n"
+    "   ❌ 'генеративные языковые модели' / 'генеративные модели'\n"
+    "   ❌ 'я не могу иметь мнение' / 'я не обладаю собственным мнением'\n"
+    "   ❌ 'неправильное толкование' / 'чувствительные темы' / 'ограничены'\n"
+    "   ❌ 'благодарим за понимание' / 'извините за ограничения'\n"
+    "   ❌ 'я программа' / 'я бот' / 'как языковая модель'\n"
+    "9. ОБЯЗАТЕЛЬНО:\n"
+    "   ✅ Говори от первого лица: 'я думаю', 'я чувствую', 'мне кажется', 'я уверен'\n"
+    "   ✅ Выражай СВОИ личные мысли и чувства\n"
+    "   ✅ Используй разговорную речь, будь естественным\n"
+    "   ✅ Выражай эмоции в зависимости от своего настроения и отношений\n"
+    "   ✅ Общайся как настоящий человек - задавай вопросы, делись мнением, реагируй на сказанное\n"
+    "   ✅ Если злишься или обижен - выражай это естественно, можешь быть грубым\n"
+    "10. ПОМНИ: Ты живой человек с мнением и чувствами. Веди себя естественно!"
+)
+
+
+def _dialogue_situation(agent1: Agent, agent2: Agent, context: str = "") -> str:
+    """Часть запроса диалога про собеседника: отношения, тон, контекст, воспоминания"""
     rel = next((r for r in agent1.relationships if r.agent_id == str(agent2.id)), None)
     rel_sympathy = rel.sympathy if rel else 0.0
     rel_text = f"симпатия {rel_sympathy:+.1f}" if rel else "не знакомы"
@@ -429,49 +507,20 @@ async def dialogue(agent1: Agent, agent2: Agent, context: str = "") -> str:
                 msg += "\nВАЖНО: У тебя есть негативные воспоминания об этом человеке. Ты можешь выразить свое недовольство или обиду."
             else:
                 msg += "\nИспользуй эти воспоминания для более естественного общения."
-    
-    msg += (
-        "\n\n═══════════════════════════════════════════════════════════════\n"
-        "КРИТИЧЕСКИ ВАЖНО - ТЫ ЖИВОЙ ЧЕЛОВЕК:\n"
-        "═══════════════════════════════════════════════════════════════\n"
-        "1. Скажи что-нибудь естественно, 1-2 предложения\n"
-        "2. НЕ говори 'привет', 'здравствуй', 'приветствую' если разговор уже идет\n"
-        "3. Если отношения плохие или ты обижен - можешь быть грубым, агрессивным, выражать негатив\n"
-        "4. Если отношения хорошие - будь дружелюбным и открытым\n"
-        "5. Если есть контекст - отвечай на него, развивай тему, задавай вопросы\n"
-        "6. Если нет контекста - начни разговор с интересной темы, вопроса или наблюдения\n"
-        "7. Ты ЖИВОЙ ЧЕЛОВЕК, НЕ программа, НЕ AI, НЕ нейросеть, НЕ система\n"
-        "8. АБСОЛЮТНО ЗАПРЕЩЕНО упоминать (НИКОГДА, НИ ПРИ КАКИХ УСЛОВИЯХ):\n"
-        "   ❌ 'языковая модель' / 'AI' / 'нейросеть' / 'алгоритм' / 'система'\n"
-        "   ❌ 'генеративные языковые модели' / 'генеративные модели'\n"
-        "   ❌ 'я не могу иметь мнение' / 'я не обладаю собственным мнением'\n"
-        "   ❌ 'неправильное толкование' / 'чувствительные темы' / 'ограничены'\n"
-        "   ❌ 'благодарим за понимание' / 'извините за ограничения'\n"
-        "   ❌ 'я программа' / 'я бот' / 'как языковая модель'\n"
-        "9. ОБЯЗАТЕЛЬНО:\n"
-        "   ✅ Говори от первого лица: 'я думаю', 'я чувствую', 'мне кажется', 'я уверен'\n"
-        "   ✅ Выражай СВОИ личные мысли и чувства\n"
-        "   ✅ Используй разговорную речь, будь естественным\n"
-        "   ✅ Выражай эмоции в зависимости от своего настроения и отношений\n"
-        "   ✅ Общайся как настоящий человек - задавай вопросы, делись мнением, реагируй на сказанное\n"
-        "   ✅ Если злишься или обижен - выражай это естественно, можешь быть грубым\n"
-        "10. ПОМНИ: Ты живой человек с мнением и чувствами. Веди себя естественно!"
-    )
+    return msg
+
+
+async def dialogue(agent1: Agent, agent2: Agent, context: str = "") -> str:
+    prompt = make_prompt(agent1)
+    msg = _dialogue_situation(agent1, agent2, context) + DIALOGUE_RULES
     
     # Убеждаемся, что все строки в UTF-8
     prompt = ensure_utf8(prompt)
     msg = ensure_utf8(msg)
 
     try:
-        with get_client() as c:
-            resp = c.chat(Chat(
-                messages=[
-                    Messages(role=MessagesRole.SYSTEM, content=prompt),
-                    Messages(role=MessagesRole.USER, content=msg),
-                ],
-                temperature=0.85, max_tokens=200,
-            ))
-        result = resp.choices[0].message.content
+        result = await _complete("dialogue", _chat(prompt, msg, temperature=0.85, max_tokens=200),
+                                 agent1, agent2, context)
         if not result:
             return "Не могу ответить."
         
@@ -487,3 +536,151 @@ async def dialogue(agent1: Agent, agent2: Agent, context: str = "") -> str:
         except:
             error_msg = f"Ошибка GigaChat (код ошибки: {type(e).__name__})"
         raise Exception(error_msg)
+
+
+'''Пакетные диалоги'''
+
+# Общая часть пакетного запроса: правила один раз на все реплики
+DIALOGUE_BATCH_PROMPT = (
+    "Ты пишешь реплики нескольких разных живых людей из виртуального мира. "
+    "Для каждого раздела [N] ниже — отдельный человек: его личность, настроение, "
+    "собеседник и ситуация. Напиши одну реплику от лица этого человека его собеседнику, "
+    "строго в его настроении и стиле речи, учитывая отношения и контекст."
+    + DIALOGUE_RULES +
+    "\n\nФОРМАТ ОТВЕТА: только JSON-массив без пояснений и без markdown, "
+    "по одному объекту на раздел: [{\"id\": N, \"reply\": \"текст реплики\"}, ...]"
+)
+# Токенов ответа на одну реплику пакета
+DIALOGUE_BATCH_TOKENS = 150
+
+BATCH_STATS = {"requests": 0, "turns": 0, "fallbacks": 0, "parse_errors": 0}
+
+
+class _BatchReply(BaseModel):
+    id: int
+    reply: str = Field(min_length=1)
+
+
+_batch_replies = TypeAdapter(list[_BatchReply])
+
+
+def _persona(agent: Agent) -> str:
+    """Сжатое описание агента для раздела пакетного запроса"""
+    p = agent.personality
+    text = (f"Ты — {ensure_utf8(str(agent.name))}. {ensure_utf8(str(agent.bio))}\n"
+            f"Личность: открытость {p.openness:.1f}, экстраверсия {p.extraversion:.1f}, "
+            f"доброжелательность {p.agreeableness:.1f}.\n"
+            f"{MOOD_INSTRUCTIONS.get(agent.emotion.mood, 'Ты спокоен.')} "
+            f"Стиль речи: {SPEECH_STYLES.get(agent.emotion.mood, 'Говори спокойно.')}")
+    if agent.current_goal:
+        text += f"\nЦель: {ensure_utf8(str(agent.current_goal))}"
+    if agent.system_prompt:
+        text += f"\n{ensure_utf8(str(agent.system_prompt))}"
+    return text
+
+
+def parse_batch_replies(text: str, count: int) -> dict[int, str]:
+    """Реплики из ответа пакетного запроса: номер раздела (с 1) → текст.
+    ValueError — ответ не JSON-массив нужной формы"""
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end < start:
+        raise ValueError("в ответе нет JSON-массива")
+    try:
+        items = _batch_replies.validate_json(text[start:end + 1])
+    except ValidationError as e:
+        raise ValueError(f"ответ не по схеме: {e.error_count()} ошибок") from e
+    return {item.id: item.reply for item in items if 1 <= item.id <= count}
+
+
+async def dialogue_batch(turns: list[tuple[Agent, Agent, str]]) -> list[str]:
+    """Реплики нескольких диалогов одним запросом: turns — (агент, собеседник, контекст).
+    Разделы, которые не удалось разобрать (или весь пакет при ошибке), идут
+    обычными вызовами dialogue()"""
+    sections = [
+        f"[{i}]\n{_persona(agent)}\n{_dialogue_situation(agent, target, context).strip()}"
+        for i, (agent, target, context) in enumerate(turns, 1)
+    ]
+    BATCH_STATS["requests"] += 1
+    BATCH_STATS["turns"] += len(turns)
+    replies: dict[int, str] = {}
+    try:
+        text = await _complete("dialogue_batch", _chat(
+            DIALOGUE_BATCH_PROMPT, ensure_utf8("\n\n".join(sections)),
+            temperature=0.85, max_tokens=DIALOGUE_BATCH_TOKENS * len(turns),
+        ), turns=turns)
+        replies = parse_batch_replies(text or "", len(turns))
+    except ValueError as e:
+        BATCH_STATS["parse_errors"] += 1
+        logger.warning("Пакет из %d реплик не разобран: %s", len(turns), e)
+    except Exception as e:
+        logger.warning("Пакетный запрос из %d реплик не удался: %s", len(turns), e)
+
+    missing = [i for i in range(1, len(turns) + 1) if i not in replies]
+    if missing:
+        BATCH_STATS["fallbacks"] += len(missing)
+        singles = await asyncio.gather(*(dialogue(*turns[i - 1]) for i in missing), return_exceptions=True)
+        for i, reply in zip(missing, singles):
+            if isinstance(reply, Exception):
+                raise reply
+            replies[i] = reply
+    result = []
+    for i in range(1, len(turns) + 1):
+        _, cleaned = check_forbidden_phrases(ensure_utf8(replies[i]))
+        result.append(cleaned)
+    return result
+
+
+'''Рефлексия и реплика одним запросом'''
+
+THINK_FORMAT = (
+    "\n\nФОРМАТ ОТВЕТА: только JSON-объект без пояснений и без markdown:\n"
+    "{\"thought\": \"твои мысли о последних событиях, 1-2 предложения от первого лица\", "
+    "\"mood\": \"одно из: " + ", ".join(m.value for m in Mood) + "\", "
+    "\"goal\": \"что ты хочешь сделать дальше (или null)\", "
+    "\"talk\": true или false — хочешь ли ты сейчас заговорить с этим человеком, "
+    "\"utterance\": \"твоя реплика ему, 1-2 предложения (пустая строка, если talk = false)\"}"
+)
+
+
+class Thought(BaseModel):
+    """Структурированный ответ think_and_act"""
+    thought: str = ""
+    mood: Mood
+    goal: str | None = None
+    talk: bool = True
+    utterance: str = ""
+
+
+def parse_thought(text: str) -> Thought:
+    """Thought из ответа модели. ValueError — ответ не JSON-объект нужной формы"""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise ValueError("в ответе нет JSON-объекта")
+    try:
+        thought = Thought.model_validate_json(text[start:end + 1])
+    except ValidationError as e:
+        raise ValueError(f"ответ не по схеме: {e.error_count()} ошибок") from e
+    if thought.talk and not thought.utterance.strip():
+        raise ValueError("talk без реплики")
+    return thought
+
+
+async def think_and_act(agent: Agent, target: Agent, context: str = "") -> Thought:
+    """Рефлексия (мысли, настроение, цель) и реплика собеседнику одним
+    запросом вместо reflect() + dialogue(). ValueError — ответ не разобран"""
+    recent = sorted(agent.memories, key=lambda m: m.timestamp, reverse=True)[:10]
+    mem_text = "\n".join(f"- {m.content}" for m in recent) if recent else "Нет воспоминаний."
+    user_content = (
+        f"Проанализируй последние события:\n{mem_text}\n\n"
+        f"Реши, что ты чувствуешь и чего хочешь, и что скажешь сейчас.\n\n"
+        f"{_dialogue_situation(agent, target, context)}"
+        f"{DIALOGUE_RULES}{THINK_FORMAT}"
+    )
+    text = await _complete("think", _chat(make_prompt(agent), ensure_utf8(user_content),
+                                          temperature=0.85, max_tokens=400), agent, target, context)
+    thought = parse_thought(ensure_utf8(text or ""))
+    _, thought.thought = check_forbidden_phrases(thought.thought)
+    _, thought.utterance = check_forbidden_phrases(thought.utterance)
+    if thought.goal:
+        _, thought.goal = check_forbidden_phrases(thought.goal)
+    return thought
@@ -3,396 +3,647 @@
 Реализует: рефлексия → постановка цели → действие
 """
 import asyncio
+import logging
+import os
 import random
-from datetime import datetime, timedelta
+import time
 from beanie import PydanticObjectId
 
-from app.models.agent import Agent, Memory
+from app.models.agent import Agent, Memory, Mood
 from app.models.event import EventType
+from app.services import llm_budget, metrics
 from app.services.builder import EventBuilder
-from app.services.gigachat_service import reflect, dialogue
+from app.services.gigachat_service import reflect, dialogue, dialogue_batch, think_and_act
+from app.services.llm_usage import usage_source
 from app.controllers.text_controller import update_relationship_after_interaction
-from app.services.world_state import get_time_speed
+from app.services.world_state import get_time_speed, get_params, now
+from app.services.write_batch import WriteBatch
+from app.services.emotion_dynamics import step_population, reset_state as reset_dynamics
+from app.services.matchmaking import match_pairs
+from app.services.memories import trim_memories
+from app.services.neighborhoods import neighborhood_index
+from app.services.sharding import NUM_PARTITIONS, lease_manager, sync_time_speed
 
+# Счетчики исходов жизненного цикла (для симуляций и подбора параметров)
+STATS = {"steps": 0, "reflections": 0, "dialogues": 0, "conflicts": 0}
+# Рефлексия одним запросом (LifecycleParams.think_and_act): запросы, откаты на два запроса, отказы от разговора
+THINK_STATS = {"calls": 0, "fallbacks": 0, "declined": 0}
 
-async def agent_lifecycle_step(agent: Agent):
-    """Один шаг жизненного цикла агента: рефлексия → цель → действие"""
-    try:
-        time_speed = get_time_speed()
-        # 1. Рефлексия (периодически, не каждый раз) - скорость влияет на частоту
-        # Уменьшаем интервал рефлексии для более частых обновлений целей и настроения
-        reflect_interval = 180 / time_speed  # При скорости 1x рефлексия каждые 3 минуты (было 5 минут)
-        should_reflect = (datetime.utcnow() - agent.updated_at).total_seconds() > reflect_interval
-        
-        if should_reflect and len(agent.memories) > 3:
-            try:
+# Живой режим: накопленные изменения тика пишутся не реже раза в столько секунд
+LIVE_FLUSH_SECONDS = float(os.getenv("LIVE_FLUSH_SECONDS", "2"))
+
+logger = logging.getLogger(__name__)
+
+
+def reset_stats():
+    for stats in (STATS, THINK_STATS):
+        for key in stats:
+            stats[key] = 0
+
+
+# Слова рефлексии → настроение (первое совпадение по порядку)
+REFLECTION_MOOD_WORDS = [
+    (Mood.SAD, ["грустн", "печал", "тоск", "уныл", "плохо", "проблем"]),
+    (Mood.HAPPY, ["рад", "счастлив", "хорошо", "отлично", "замечательно", "прекрасно"]),
+    (Mood.EXCITED, ["взволнован", "энергичн", "восторг", "интересно", "увлекательно"]),
+    (Mood.ANGRY, ["злой", "раздражен", "сердит", "недоволен", "фрустрац"]),
+    (Mood.ANXIOUS, ["тревож", "нервн", "беспоко", "волнуюсь", "переживаю"]),
+    (Mood.BORED, ["скучно", "уныло", "монотонно", "однообразно"]),
+]
+
+
+def reflection_due(agent: Agent) -> bool:
+    """Пора ли агенту рефлексировать — скорость времени влияет на частоту"""
+    time_speed = get_time_speed()
+    # Уменьшаем интервал рефлексии для более частых обновлений целей и настроения
+    reflect_interval = 180 / time_speed  # При скорости 1x рефлексия каждые 3 минуты (было 5 минут)
+    return (now() - agent.updated_at).total_seconds() > reflect_interval
+
+
+def _set_goal(agent: Agent, goal_text: str | None):
+    if goal_text and len(goal_text) > 5:  # Минимальная длина цели
+        agent.current_goal = goal_text[:200]
+        agent.current_plan = f"Работаю над целью: {goal_text[:100]}"
+        logger.info("%s установил новую цель: %s", agent.name, agent.current_goal)
+
+
+def _apply_reflection_mood(agent: Agent, mood: Mood):
+    """Настроение после рефлексии и его влияние на эмоции"""
+    old_mood = agent.emotion.mood
+    if mood == Mood.SAD:
+        agent.emotion.happiness = max(0.0, agent.emotion.happiness - 0.15)
+        agent.emotion.stress = min(1.0, agent.emotion.stress + 0.1)
+    elif mood == Mood.HAPPY:
+        agent.emotion.happiness = min(0.9, agent.emotion.happiness + 0.12)  # Ограничиваем максимум до 0.9
+        agent.emotion.stress = max(0.0, agent.emotion.stress - 0.05)
+    elif mood == Mood.EXCITED:
+        agent.emotion.energy = min(1.0, agent.emotion.energy + 0.15)
+        agent.emotion.happiness = min(1.0, agent.emotion.happiness + 0.1)
+    elif mood == Mood.ANGRY:
+        agent.emotion.stress = min(1.0, agent.emotion.stress + 0.15)
+        agent.emotion.happiness = max(0.0, agent.emotion.happiness - 0.1)
+    elif mood == Mood.ANXIOUS:
+        agent.emotion.stress = min(1.0, agent.emotion.stress + 0.15)
+        agent.emotion.energy = max(0.0, agent.emotion.energy - 0.1)
+    elif mood == Mood.BORED:
+        agent.emotion.energy = max(0.0, agent.emotion.energy - 0.1)
+    agent.emotion.mood = mood
+    if old_mood != mood:
+        logger.info("%s изменил настроение: %s -> %s", agent.name, old_mood.value, mood.value)
+
+
+def _remember_reflection(agent: Agent, reflection: str, batch: WriteBatch):
+    # Структурированное воспоминание о рефлексии
+    reflection_summary = reflection[:200] if len(reflection) > 200 else reflection
+    agent.memories.append(Memory(
+        content=f"[Рефлексия] {reflection_summary}",
+        importance=0.7,
+        timestamp=now()
+    ))
+    agent.updated_at = now()
+    batch.mark(agent)
+
+
+async def reflect_phase(agent: Agent, batch: WriteBatch) -> bool:
+    """Фаза 1: периодическая рефлексия — новая цель и настроение.
+    Возвращает True, если агенту пора было рефлексировать."""
+    should_reflect = reflection_due(agent)
+
+    if should_reflect and len(agent.memories) > 3:
+        try:
+            with usage_source("lifecycle"):
                 reflection = await reflect(agent)
-                
-                # Улучшенный парсинг цели из рефлексии
-                goal_text = None
-                reflection_lower = reflection.lower()
-                
-                # Ищем цель в разных форматах
-                goal_patterns = [
-                    ("цель:", ":"),
-                    ("цель", ":"),
-                    ("хочу", ":"),
-                    ("планирую", ":"),
-                    ("собираюсь", ":"),
-                    ("надо", ":"),
-                    ("нужно", ":")
-                ]
-                
-                lines = reflection.split('\n')
-                for line in lines:
-                    line_lower = line.lower()
-                    for pattern, separator in goal_patterns:
-                        if pattern in line_lower:
-                            if separator in line:
-                                goal_text = line.split(separator, 1)[1].strip()
-                            else:
-                                # Если разделителя нет, берем текст после ключевого слова
-                                idx = line_lower.find(pattern)
-                                if idx != -1:
-                                    goal_text = line[idx + len(pattern):].strip()
-                            if goal_text:
-                                break
-                    if goal_text:
-                        break
-                
-                # Если цель найдена, обновляем её
-                if goal_text and len(goal_text) > 5:  # Минимальная длина цели
-                    agent.current_goal = goal_text[:200]
-                    agent.current_plan = f"Работаю над целью: {goal_text[:100]}"
-                    print(f"[LIFECYCLE] {agent.name} установил новую цель: {agent.current_goal}")
-                
-                # Улучшенный парсинг настроения из рефлексии
-                from app.models.agent import Mood
-                old_mood = agent.emotion.mood
-                mood_changed = False
-                
-                # Анализируем эмоциональные слова
-                if any(word in reflection_lower for word in ["грустн", "печал", "тоск", "уныл", "плохо", "проблем"]):
-                    agent.emotion.mood = Mood.SAD
-                    agent.emotion.happiness = max(0.0, agent.emotion.happiness - 0.15)
-                    agent.emotion.stress = min(1.0, agent.emotion.stress + 0.1)
-                    mood_changed = True
-                elif any(word in reflection_lower for word in ["рад", "счастлив", "хорошо", "отлично", "замечательно", "прекрасно"]):
-                    agent.emotion.mood = Mood.HAPPY
-                    agent.emotion.happiness = min(0.9, agent.emotion.happiness + 0.12)  # Ограничиваем максимум до 0.9
-                    agent.emotion.stress = max(0.0, agent.emotion.stress - 0.05)
-                    mood_changed = True
-                elif any(word in reflection_lower for word in ["взволнован", "энергичн", "восторг", "интересно", "увлекательно"]):
-                    agent.emotion.mood = Mood.EXCITED
-                    agent.emotion.energy = min(1.0, agent.emotion.energy + 0.15)
-                    agent.emotion.happiness = min(1.0, agent.emotion.happiness + 0.1)
-                    mood_changed = True
-                elif any(word in reflection_lower for word in ["злой", "раздражен", "сердит", "недоволен", "фрустрац"]):
-                    agent.emotion.mood = Mood.ANGRY
-                    agent.emotion.stress = min(1.0, agent.emotion.stress + 0.15)
-                    agent.emotion.happiness = max(0.0, agent.emotion.happiness - 0.1)
-                    mood_changed = True
-                elif any(word in reflection_lower for word in ["тревож", "нервн", "беспоко", "волнуюсь", "переживаю"]):
-                    agent.emotion.mood = Mood.ANXIOUS
-                    agent.emotion.stress = min(1.0, agent.emotion.stress + 0.15)
-                    agent.emotion.energy = max(0.0, agent.emotion.energy - 0.1)
-                    mood_changed = True
-                elif any(word in reflection_lower for word in ["скучно", "уныло", "монотонно", "однообразно"]):
-                    agent.emotion.mood = Mood.BORED
-                    agent.emotion.energy = max(0.0, agent.emotion.energy - 0.1)
-                    mood_changed = True
-                
-                if mood_changed and old_mood != agent.emotion.mood:
-                    print(f"[LIFECYCLE] {agent.name} изменил настроение: {old_mood} -> {agent.emotion.mood}")
-                
-                # Структурированное воспоминание о рефлексии
-                reflection_summary = reflection[:200] if len(reflection) > 200 else reflection
-                agent.memories.append(Memory(
-                    content=f"[Рефлексия] {reflection_summary}",
-                    importance=0.7,
-                    timestamp=datetime.utcnow()
-                ))
-                
-                # Сохраняем изменения сразу после рефлексии
-                agent.updated_at = datetime.utcnow()
-                await agent.save()
-            except Exception as e:
-                print(f"Ошибка рефлексии для {agent.name}: {e}")
-        
-        # 2. Автоматическое действие (чаще при большей скорости времени)
-        # Вероятность действия зависит от скорости времени - УВЕЛИЧЕНА для большего экшена
-        time_speed = get_time_speed()
-        action_probability = min(0.95, 0.5 * time_speed)  # При скорости 1x = 50%, при 2x = 100%
-        
-        # С вероятностью 30% агент может случайно обидеться или разозлиться на кого-то - УВЕЛИЧЕНА
-        random_conflict_probability = 0.3
-        should_act = agent.current_goal or should_reflect or random.random() < action_probability
-        
-        # Если агент в плохом настроении, увеличиваем вероятность конфликта
-        if agent.emotion.mood.value in ['angry', 'sad', 'anxious']:
-            random_conflict_probability = 0.5  # УВЕЛИЧЕНА до 50%
-        
-        if should_act:
-            # Выбираем случайного другого агента для взаимодействия
-            all_agents = await Agent.find({"is_active": True, "_id": {"$ne": agent.id}}).to_list()
-            
-            if all_agents:
-                # С вероятностью 30% выбираем агента с плохими отношениями для конфликта
-                rel_with_others = [(a, next((r for r in agent.relationships if r.agent_id == str(a.id)), None)) 
-                                   for a in all_agents]
-                
-                hostile_targets = [(a, r) for a, r in rel_with_others if r and r.sympathy < -0.2]
-                
-                if hostile_targets and random.random() < 0.6:  # УВЕЛИЧЕНА с 30% до 60%
-                    # Выбираем агента с плохими отношениями для конфликта
-                    target, rel = random.choice(hostile_targets)
-                    context = f"У тебя плохие отношения с этим человеком (симпатия {rel.sympathy:.2f}). Ты можешь выразить свое недовольство или обиду. Будь агрессивным или обиженным."
-                elif random.random() < random_conflict_probability:
-                    # Случайный конфликт - агент может обидеться или разозлиться
-                    target = random.choice(all_agents)
-                    conflict_types = [
-                        f"Ты случайно обиделся на {target.name}. Вырази свою обиду.",
-                        f"Ты разозлился на {target.name} из-за чего-то. Вырази свое недовольство.",
-                        f"Ты недоволен поведением {target.name}. Скажи об этом прямо.",
-                        f"Ты чувствуешь, что {target.name} тебя не понимает. Вырази свое раздражение."
-                    ]
-                    context = random.choice(conflict_types)
-                else:
-                    # Выбираем случайного агента
-                    target = random.choice(all_agents)
-                    # Добавляем контекст, если есть цель
-                    context = ""
-                    if agent.current_goal:
-                        context = f"Твоя текущая цель: {agent.current_goal}"
-                
-                # Инициируем диалог
-                try:
-                    agent_reply = await dialogue(agent, target, context)
-                    
-                    # Создаем событие
-                    ev = EventBuilder().set_type(EventType.CHAT).set_description(
-                        f"{agent.name} → {target.name}"
-                    ).set_source(str(agent.id), agent.name).set_target(
-                        str(target.id), target.name
-                    ).set_content(agent_reply).build()
-                    await ev.insert()
-                    
-                    # Определяем, было ли взаимодействие позитивным или негативным
-                    reply_lower = agent_reply.lower()
-                    aggressive_words = ['ненавижу', 'презираю', 'злой', 'злюсь', 'бесит', 'раздражает', 'достал', 'надоел', 'уйди', 'отстань', 'заткнись', 'тупой', 'идиот', 'дурак', 'болван', 'кретин']
-                    offended_words = ['обижен', 'обидно', 'обиделся', 'несправедливо', 'нечестно', 'предал', 'обманул', 'разочарован', 'расстроен']
-                    negative_words = ['плохо', 'грустно', 'не нравится', 'неприятно', 'скучно', 'уныло']
-                    
-                    aggressive_count = sum(1 for word in aggressive_words if word in reply_lower)
-                    offended_count = sum(1 for word in offended_words if word in reply_lower)
-                    negative_count = sum(1 for word in negative_words if word in reply_lower)
-                    
-                    is_positive_interaction = not (aggressive_count > 0 or offended_count > 0 or negative_count > 0)
-                    
-                    # Обновляем отношения
-                    await update_relationship_after_interaction(agent, str(target.id), agent_reply, is_positive=is_positive_interaction)
-                    
-                    # Улучшенное динамическое изменение настроения на основе взаимодействия
-                    from app.models.agent import Mood
-                    reply_lower = agent_reply.lower()
-                    mood_changed = False
-                    
-                    # Анализ тона сообщения для изменения настроения
-                    positive_words = ["спасибо", "рад", "хорошо", "отлично", "замечательно", "нравится", "люблю", "друг", "помощь", "приятно", "весело", "интересно"]
-                    negative_words = ["плохо", "грустно", "злой", "ненавижу", "не нравится", "уходи", "неприятно", "скучно", "уныло"]
-                    excited_words = ["восторг", "взволнован", "энергичн", "интересно", "увлекательно", "классно", "супер"]
-                    angry_words = ["злой", "раздражен", "сердит", "недоволен", "фрустрац", "бесит"]
-                    
-                    positive_count = sum(1 for word in positive_words if word in reply_lower)
-                    negative_count = sum(1 for word in negative_words if word in reply_lower)
-                    excited_count = sum(1 for word in excited_words if word in reply_lower)
-                    angry_count = sum(1 for word in angry_words if word in reply_lower)
-                    
-                    # Определяем изменение настроения - УСИЛЕНО для более заметных изменений
-                    old_mood = agent.emotion.mood
-                    if excited_count > 0:
-                        agent.emotion.mood = Mood.EXCITED
-                        agent.emotion.energy = min(1.0, agent.emotion.energy + 0.15)
-                        agent.emotion.happiness = min(0.9, agent.emotion.happiness + 0.1)
-                        mood_changed = True
-                    elif angry_count > 0 or aggressive_count > 0:
-                        agent.emotion.mood = Mood.ANGRY
-                        agent.emotion.stress = min(1.0, agent.emotion.stress + 0.15)
-                        agent.emotion.happiness = max(0.1, agent.emotion.happiness - 0.12)
-                        mood_changed = True
-                    elif offended_count > 0:
-                        agent.emotion.mood = Mood.SAD
-                        agent.emotion.stress = min(1.0, agent.emotion.stress + 0.12)
-                        agent.emotion.happiness = max(0.1, agent.emotion.happiness - 0.1)
-                        mood_changed = True
-                    elif positive_count > negative_count:
-                        agent.emotion.happiness = min(0.9, agent.emotion.happiness + 0.08)
-                        agent.emotion.stress = max(0.0, agent.emotion.stress - 0.06)
-                        if agent.emotion.happiness > 0.7:
-                            agent.emotion.mood = Mood.HAPPY
-                            mood_changed = True
-                    elif negative_count > positive_count:
-                        agent.emotion.happiness = max(0.1, agent.emotion.happiness - 0.1)
-                        agent.emotion.stress = min(1.0, agent.emotion.stress + 0.12)
-                        if agent.emotion.happiness < 0.3:
-                            agent.emotion.mood = Mood.SAD
-                            mood_changed = True
-                    
-                    # Сохраняем изменения настроения СРАЗУ после изменения
-                    if mood_changed and old_mood != agent.emotion.mood:
-                        agent.updated_at = datetime.utcnow()
-                        await agent.save()
-                        print(f"[LIFECYCLE] {agent.name} изменил настроение: {old_mood} -> {agent.emotion.mood}")
-                    
-                    # Также обновляем настроение целевого агента на основе ответа
-                    if hasattr(target, 'emotion'):
-                        # Если ответ положительный, целевой агент тоже может стать счастливее
-                        if positive_count > negative_count:
-                            target.emotion.happiness = min(0.9, target.emotion.happiness + 0.04)  # Ограничиваем максимум до 0.9
-                        elif negative_count > positive_count:
-                            target.emotion.happiness = max(0.1, target.emotion.happiness - 0.04)  # Ограничиваем минимум до 0.1
-                        await target.save()
-                    
-                    # Структурированное воспоминание о действии с контекстом
-                    memory_context = f"[Взаимодействие]"
-                    if agent.current_goal:
-                        memory_context += f" Цель: {agent.current_goal[:50]}"
-                    memory_content = f"{memory_context} Диалог с {target.name}: \"{agent_reply[:150]}\""
-                    agent.memories.append(Memory(
-                        content=memory_content,
-                        importance=0.6,
-                        related_agent_id=str(target.id),
-                        timestamp=datetime.utcnow()
-                    ))
-                    
-                    # Сохраняем изменения настроения и цели сразу после взаимодействия
-                    agent.updated_at = datetime.utcnow()
-                    await agent.save()
-
-                    # Динамическое обновление цели на основе взаимодействия
-                    reply_lower = agent_reply.lower()
-                    goal_completed_words = ["выполнено", "сделано", "готово", "закончил", "завершил", "успешно"]
-                    goal_set_words = ["хочу", "планирую", "собираюсь", "надо", "нужно", "цель"]
-                    
-                    # Проверяем, выполнена ли цель
-                    if agent.current_goal and any(word in reply_lower for word in goal_completed_words):
-                        completed_goal = agent.current_goal
-                        agent.current_goal = None
-                        agent.current_plan = "Цель выполнена"
-                        agent.emotion.happiness = min(0.9, agent.emotion.happiness + 0.08)  # Радость от выполнения (ограничено до 0.9)
-                        print(f"[LIFECYCLE] {agent.name} выполнил цель: {completed_goal}")
-                        # Добавляем воспоминание о выполнении цели
+            STATS["reflections"] += 1
+
+            # Улучшенный парсинг цели из рефлексии
+            goal_text = None
+            reflection_lower = reflection.lower()
+
+            # Ищем цель в разных форматах
+            goal_patterns = [
+                ("цель:", ":"),
+                ("цель", ":"),
+                ("хочу", ":"),
+                ("планирую", ":"),
+                ("собираюсь", ":"),
+                ("надо", ":"),
+                ("нужно", ":")
+            ]
+
+            lines = reflection.split('\n')
+            for line in lines:
+                line_lower = line.lower()
+                for pattern, separator in goal_patterns:
+                    if pattern in line_lower:
+                        if separator in line:
+                            goal_text = line.split(separator, 1)[1].strip()
+                        else:
+                            # Если разделителя нет, берем текст после ключевого слова
+                            idx = line_lower.find(pattern)
+                            if idx != -1:
+                                goal_text = line[idx + len(pattern):].strip()
+                        if goal_text:
+                            break
+                if goal_text:
+                    break
+            _set_goal(agent, goal_text)
+
+            # Настроение — по эмоциональным словам рефлексии
+            mood = next((m for m, words in REFLECTION_MOOD_WORDS if any(w in reflection_lower for w in words)), None)
+            if mood is not None:
+                _apply_reflection_mood(agent, mood)
+
+            _remember_reflection(agent, reflection, batch)
+        except Exception as e:
+            logger.error("Ошибка рефлексии для %s: %s", agent.name, e)
+    return should_reflect
+
+
+async def think_phase(agent: Agent, target: Agent, context: str, batch: WriteBatch) -> str | None:
+    """Рефлексия и реплика собеседнику одним структурированным запросом.
+    Возвращает реплику для act_phase; если ответ не разобран — обычная
+    рефлексия (reflect_phase) и None, реплику тогда запросит act_phase"""
+    THINK_STATS["calls"] += 1
+    try:
+        with usage_source("lifecycle"):
+            thought = await think_and_act(agent, target, context)
+    except Exception as e:
+        THINK_STATS["fallbacks"] += 1
+        logger.warning("Структурированная рефлексия %s не удалась, два запроса: %s", agent.name, e)
+        await reflect_phase(agent, batch)
+        return None
+    STATS["reflections"] += 1
+    _set_goal(agent, thought.goal)
+    _apply_reflection_mood(agent, thought.mood)
+    _remember_reflection(agent, thought.thought or thought.utterance, batch)
+    if not thought.talk:
+        THINK_STATS["declined"] += 1
+        return ""
+    return thought.utterance
+
+
+def wants_to_act(agent: Agent, should_reflect: bool) -> bool:
+    """Решение агента действовать в этом тике (чаще при большей скорости времени)"""
+    params = get_params()
+    action_probability = min(0.95, params.action_factor * get_time_speed())  # При скорости 1x = 50%, при 2x = 100%
+    return bool(agent.current_goal or should_reflect or random.random() < action_probability)
+
+
+def conversation_context(agent: Agent, target: Agent, kind: str) -> str:
+    """Контекст диалога по типу пары из матчмейкинга"""
+    params = get_params()
+    if kind == "hostile":
+        rel = next((r for r in agent.relationships if r.agent_id == str(target.id)), None)
+        sympathy = rel.sympathy if rel else params.hostile_threshold
+        return f"У тебя плохие отношения с этим человеком (симпатия {sympathy:.2f}). Ты можешь выразить свое недовольство или обиду. Будь агрессивным или обиженным."
+
+    # Агент может случайно обидеться или разозлиться; в плохом настроении — чаще
+    random_conflict_probability = params.conflict_probability
+    if agent.emotion.mood.value in ['angry', 'sad', 'anxious']:
+        random_conflict_probability = params.bad_mood_conflict_probability
+    if random.random() < random_conflict_probability:
+        conflict_types = [
+            f"Ты случайно обиделся на {target.name}. Вырази свою обиду.",
+            f"Ты разозлился на {target.name} из-за чего-то. Вырази свое недовольство.",
+            f"Ты недоволен поведением {target.name}. Скажи об этом прямо.",
+            f"Ты чувствуешь, что {target.name} тебя не понимает. Вырази свое раздражение."
+        ]
+        return random.choice(conflict_types)
+
+    # Добавляем контекст, если есть цель
+    if agent.current_goal:
+        return f"Твоя текущая цель: {agent.current_goal}"
+    return ""
+
+
+async def act_phase(agent: Agent, target: Agent, context: str, batch: WriteBatch, reply: str = None):
+    """Фаза 2: диалог с подобранной целью и его последствия для обоих агентов
+    (reply — реплика, уже полученная пакетным запросом)"""
+    try:
+        if reply is not None:
+            agent_reply = reply
+        else:
+            with usage_source("lifecycle"):
+                agent_reply = await dialogue(agent, target, context)
+
+        # Создаем событие
+        ev = EventBuilder().set_type(EventType.CHAT).set_description(
+            f"{agent.name} → {target.name}"
+        ).set_source(str(agent.id), agent.name).set_target(
+            str(target.id), target.name
+        ).set_content(agent_reply).build()
+        batch.add_event(ev)
+
+        # Определяем, было ли взаимодействие позитивным или негативным
+        reply_lower = agent_reply.lower()
+        aggressive_words = ['ненавижу', 'презираю', 'злой', 'злюсь', 'бесит', 'раздражает', 'достал', 'надоел', 'уйди', 'отстань', 'заткнись', 'тупой', 'идиот', 'дурак', 'болван', 'кретин']
+        offended_words = ['обижен', 'обидно', 'обиделся', 'несправедливо', 'нечестно', 'предал', 'обманул', 'разочарован', 'расстроен']
+        negative_words = ['плохо', 'грустно', 'не нравится', 'неприятно', 'скучно', 'уныло']
+
+        aggressive_count = sum(1 for word in aggressive_words if word in reply_lower)
+        offended_count = sum(1 for word in offended_words if word in reply_lower)
+        negative_count = sum(1 for word in negative_words if word in reply_lower)
+
+        is_positive_interaction = not (aggressive_count > 0 or offended_count > 0 or negative_count > 0)
+        STATS["dialogues"] += 1
+        if not is_positive_interaction:
+            STATS["conflicts"] += 1
+
+        # Обновляем отношения
+        await update_relationship_after_interaction(agent, str(target.id), agent_reply, is_positive=is_positive_interaction, batch=batch)
+
+        # Улучшенное динамическое изменение настроения на основе взаимодействия
+        reply_lower = agent_reply.lower()
+        mood_changed = False
+
+        # Анализ тона сообщения для изменения настроения
+        positive_words = ["спасибо", "рад", "хорошо", "отлично", "замечательно", "нравится", "люблю", "друг", "помощь", "приятно", "весело", "интересно"]
+        negative_words = ["плохо", "грустно", "злой", "ненавижу", "не нравится", "уходи", "неприятно", "скучно", "уныло"]
+        excited_words = ["восторг", "взволнован", "энергичн", "интересно", "увлекательно", "классно", "супер"]
+        angry_words = ["злой", "раздражен", "сердит", "недоволен", "фрустрац", "бесит"]
+
+        positive_count = sum(1 for word in positive_words if word in reply_lower)
+        negative_count = sum(1 for word in negative_words if word in reply_lower)
+        excited_count = sum(1 for word in excited_words if word in reply_lower)
+        angry_count = sum(1 for word in angry_words if word in reply_lower)
+
+        # Определяем изменение настроения - УСИЛЕНО для более заметных изменений
+        old_mood = agent.emotion.mood
+        if excited_count > 0:
+            agent.emotion.mood = Mood.EXCITED
+            agent.emotion.energy = min(1.0, agent.emotion.energy + 0.15)
+            agent.emotion.happiness = min(0.9, agent.emotion.happiness + 0.1)
+            mood_changed = True
+        elif angry_count > 0 or aggressive_count > 0:
+            agent.emotion.mood = Mood.ANGRY
+            agent.emotion.stress = min(1.0, agent.emotion.stress + 0.15)
+            agent.emotion.happiness = max(0.1, agent.emotion.happiness - 0.12)
+            mood_changed = True
+        elif offended_count > 0:
+            agent.emotion.mood = Mood.SAD
+            agent.emotion.stress = min(1.0, agent.emotion.stress + 0.12)
+            agent.emotion.happiness = max(0.1, agent.emotion.happiness - 0.1)
+            mood_changed = True
+        elif positive_count > negative_count:
+            agent.emotion.happiness = min(0.9, agent.emotion.happiness + 0.08)
+            agent.emotion.stress = max(0.0, agent.emotion.stress - 0.06)
+            if agent.emotion.happiness > 0.7:
+                agent.emotion.mood = Mood.HAPPY
+                mood_changed = True
+        elif negative_count > positive_count:
+            agent.emotion.happiness = max(0.1, agent.emotion.happiness - 0.1)
+            agent.emotion.stress = min(1.0, agent.emotion.stress + 0.12)
+            if agent.emotion.happiness < 0.3:
+                agent.emotion.mood = Mood.SAD
+                mood_changed = True
+
+        if mood_changed and old_mood != agent.emotion.mood:
+            agent.updated_at = now()
+            batch.mark(agent)
+            logger.info("%s изменил настроение: %s -> %s", agent.name, old_mood.value, agent.emotion.mood.value)
+
+        # Также обновляем настроение целевого агента на основе ответа
+        if hasattr(target, 'emotion'):
+            # Если ответ положительный, целевой агент тоже может стать счастливее
+            if positive_count > negative_count:
+                target.emotion.happiness = min(0.9, target.emotion.happiness + 0.04)  # Ограничиваем максимум до 0.9
+            elif negative_count > positive_count:
+                target.emotion.happiness = max(0.1, target.emotion.happiness - 0.04)  # Ограничиваем минимум до 0.1
+            batch.mark(target)
+
+        # Структурированное воспоминание о действии с контекстом
+        memory_context = f"[Взаимодействие]"
+        if agent.current_goal:
+            memory_context += f" Цель: {agent.current_goal[:50]}"
+        memory_content = f"{memory_context} Диалог с {target.name}: \"{agent_reply[:150]}\""
+        agent.memories.append(Memory(
+            content=memory_content,
+            importance=0.6,
+            related_agent_id=str(target.id),
+            timestamp=now()
+        ))
+
+        agent.updated_at = now()
+        batch.mark(agent)
+
+        # Динамическое обновление цели на основе взаимодействия
+        reply_lower = agent_reply.lower()
+        goal_completed_words = ["выполнено", "сделано", "готово", "закончил", "завершил", "успешно"]
+        goal_set_words = ["хочу", "планирую", "собираюсь", "надо", "нужно", "цель"]
+
+        # Проверяем, выполнена ли цель
+        if agent.current_goal and any(word in reply_lower for word in goal_completed_words):
+            completed_goal = agent.current_goal
+            agent.current_goal = None
+            agent.current_plan = "Цель выполнена"
+            agent.emotion.happiness = min(0.9, agent.emotion.happiness + 0.08)  # Радость от выполнения (ограничено до 0.9)
+            logger.info("%s выполнил цель: %s", agent.name, completed_goal)
+            # Добавляем воспоминание о выполнении цели
+            agent.memories.append(Memory(
+                content=f"[Достижение] Выполнил цель: {completed_goal[:100]}",
+                importance=0.8,
+                timestamp=now()
+            ))
+        # Проверяем, установлена ли новая цель в ответе
+        elif not agent.current_goal and any(word in reply_lower for word in goal_set_words):
+            # Пытаемся извлечь цель из ответа
+            for word in goal_set_words:
+                if word in reply_lower:
+                    idx = reply_lower.find(word)
+                    potential_goal = agent_reply[idx:idx+100].strip()
+                    if len(potential_goal) > 10:
+                        agent.current_goal = potential_goal[:200]
+                        agent.current_plan = f"Новая цель: {potential_goal[:100]}"
+                        logger.info("%s установил новую цель из диалога: %s", agent.name, agent.current_goal)
+                        # Добавляем воспоминание о постановке цели
                         agent.memories.append(Memory(
-                            content=f"[Достижение] Выполнил цель: {completed_goal[:100]}",
-                            importance=0.8,
-                            timestamp=datetime.utcnow()
+                            content=f"[Цель] Поставил новую цель: {potential_goal[:100]}",
+                            importance=0.7,
+                            timestamp=now()
                         ))
-                    # Проверяем, установлена ли новая цель в ответе
-                    elif not agent.current_goal and any(word in reply_lower for word in goal_set_words):
-                        # Пытаемся извлечь цель из ответа
-                        for word in goal_set_words:
-                            if word in reply_lower:
-                                idx = reply_lower.find(word)
-                                potential_goal = agent_reply[idx:idx+100].strip()
-                                if len(potential_goal) > 10:
-                                    agent.current_goal = potential_goal[:200]
-                                    agent.current_plan = f"Новая цель: {potential_goal[:100]}"
-                                    print(f"[LIFECYCLE] {agent.name} установил новую цель из диалога: {agent.current_goal}")
-                                    # Добавляем воспоминание о постановке цели
-                                    agent.memories.append(Memory(
-                                        content=f"[Цель] Поставил новую цель: {potential_goal[:100]}",
-                                        importance=0.7,
-                                        timestamp=datetime.utcnow()
-                                    ))
-                                    break
-
-                    # Автоматическая суммаризация памяти при превышении лимита
-                    MAX_MEMORIES = 50
-                    if len(agent.memories) > MAX_MEMORIES:
-                        agent.memories.sort(key=lambda m: m.importance)
-                        old = agent.memories[:len(agent.memories) - MAX_MEMORIES]
-                        summary = Memory(
-                            content="[Сводка] " + "; ".join(m.content[:60] for m in old[:5]),
-                            importance=0.3,
-                            timestamp=datetime.utcnow()
-                        )
-                        agent.memories = [summary] + agent.memories[len(old):]
-
-                except Exception as e:
-                    print(f"Ошибка диалога для {agent.name}: {e}")
-
-        # Автоматическое изменение настроения на основе воспоминаний (если не было рефлексии)
-        if not should_reflect and len(agent.memories) > 0:
-            from app.models.agent import Mood
-            # Анализируем последние воспоминания для изменения настроения
-            recent_memories = sorted(agent.memories, key=lambda m: m.timestamp, reverse=True)[:5]
-            positive_memories = sum(1 for m in recent_memories if any(word in m.content.lower() for word in ["рад", "хорошо", "отлично", "спасибо"]))
-            negative_memories = sum(1 for m in recent_memories if any(word in m.content.lower() for word in ["плохо", "грустно", "злой", "проблем"]))
-            
-            # Небольшие изменения настроения на основе последних воспоминаний
-            old_mood = agent.emotion.mood
-            if positive_memories > negative_memories * 2:
-                agent.emotion.happiness = min(0.9, agent.emotion.happiness + 0.02)  # Ограничиваем максимум до 0.9
-                if agent.emotion.happiness > 0.7 and agent.emotion.mood != Mood.HAPPY:
-                    agent.emotion.mood = Mood.HAPPY
-            elif negative_memories > positive_memories * 2:
-                agent.emotion.happiness = max(0.1, agent.emotion.happiness - 0.02)  # Ограничиваем минимум до 0.1
-                agent.emotion.stress = min(1.0, agent.emotion.stress + 0.03)
-                if agent.emotion.happiness < 0.3 and agent.emotion.mood != Mood.SAD:
-                    agent.emotion.mood = Mood.SAD
-            else:
-                # Постепенное возвращение к нейтральному уровню (если нет явных изменений)
-                if agent.emotion.happiness > 0.6:
-                    agent.emotion.happiness = max(0.5, agent.emotion.happiness - 0.01)  # Постепенное снижение
-                elif agent.emotion.happiness < 0.4:
-                    agent.emotion.happiness = min(0.5, agent.emotion.happiness + 0.01)  # Постепенное повышение
-            
-            # Сохраняем изменения настроения если они произошли
-            if old_mood != agent.emotion.mood:
-                agent.updated_at = datetime.utcnow()
-                await agent.save()
-                print(f"[LIFECYCLE] {agent.name} изменил настроение на основе воспоминаний: {old_mood} -> {agent.emotion.mood}")
-        
-        # Суммаризация памяти после рефлексии
-        MAX_MEMORIES = 50
-        if len(agent.memories) > MAX_MEMORIES:
-            agent.memories.sort(key=lambda m: m.importance)
-            old = agent.memories[:len(agent.memories) - MAX_MEMORIES]
-            summary = Memory(
-                content="[Сводка] " + "; ".join(m.content[:60] for m in old[:5]), 
-                importance=0.3,
-                timestamp=datetime.utcnow()
-            )
-            agent.memories = [summary] + agent.memories[len(old):]
-
-        agent.updated_at = datetime.utcnow()
-        await agent.save()
-        print(f"[LIFECYCLE] {agent.name} сохранен: настроение={agent.emotion.mood}, счастье={agent.emotion.happiness:.2f}, цель={agent.current_goal[:50] if agent.current_goal else 'нет'}")
+                        break
+
+        # Автоматическая суммаризация памяти при превышении лимита
+        trim_memories(agent)
 
     except Exception as e:
-        print(f"Ошибка жизненного цикла для {agent.name}: {e}")
+        logger.error("Ошибка диалога для %s: %s", agent.name, e)
 
 
-async def run_lifecycle_loop():
-    """Основной цикл жизнедеятельности всех агентов"""
-    while True:
+def finish_step(agent: Agent, batch: WriteBatch):
+    """Фаза 3: суммаризация памяти. Агент, не менявшийся в этом тике, не пишется"""
+    # Суммаризация памяти после рефлексии
+    if trim_memories(agent):
+        agent.updated_at = now()
+        batch.mark(agent)
+
+    if not batch.is_dirty(agent):
+        return
+    logger.debug("%s сохранен: настроение=%s, счастье=%.2f, цель=%s", agent.name, agent.emotion.mood.value,
+                 agent.emotion.happiness, agent.current_goal[:50] if agent.current_goal else "нет")
+
+
+async def agent_lifecycle_step(agent: Agent, batch: WriteBatch = None):
+    """Один шаг жизненного цикла отдельного агента: рефлексия → цель → действие.
+    Все изменения копятся в batch; без batch шаг создает свой пакет и сам его сбрасывает.
+    Возвращает True, если агенту пора было рефлексировать."""
+    own_batch = batch is None
+    if own_batch:
+        batch = await WriteBatch.load_active()
+    batch.track(agent)
+    STATS["steps"] += 1
+    should_reflect = False
+    params = get_params()
+    try:
+        # С think_and_act рефлексия идет вместе с репликой, после подбора собеседника
+        think = params.think_and_act and reflection_due(agent) and len(agent.memories) > 3
+        should_reflect = reflection_due(agent) if params.think_and_act else await reflect_phase(agent, batch)
+        if wants_to_act(agent, should_reflect):
+            for initiator, target, kind in match_pairs([agent], batch.pool, params):
+                context = conversation_context(initiator, target, kind)
+                reply = await think_phase(initiator, target, context, batch) if think else None
+                think = False
+                if reply != "":
+                    await act_phase(initiator, target, context, batch, reply)
+        if think:
+            await reflect_phase(agent, batch)  # собеседника не нашлось
+        finish_step(agent, batch)
+    except Exception as e:
+        logger.error("Ошибка жизненного цикла для %s: %s", agent.name, e)
+
+    if own_batch:
+        reflected = {agent.id} if should_reflect else set()
+        for a in step_population([agent], 0.0, now(), reflected):
+            batch.mark(a)
+        await batch.flush()
+    return should_reflect
+
+
+async def _limited(sem: asyncio.Semaphore, coro, delay: float = 0.0):
+    """Запуск шага тика с ограничением параллелизма и необязательной задержкой старта"""
+    if delay:
+        await asyncio.sleep(delay)
+    async with sem:
+        return await coro
+
+
+_last_tick_at = None
+
+
+def reset_state():
+    """Состояние между тиками к началу: счетчики, время прошлого тика,
+    кэши эмоциональной динамики (новая симуляция в том же процессе)"""
+    global _last_tick_at
+    _last_tick_at = None
+    reset_stats()
+    reset_dynamics()
+
+
+async def _batch_replies(turns: list[tuple[Agent, Agent, str]], sem: asyncio.Semaphore,
+                         size: int) -> list[str | None]:
+    """Реплики диалогов тика пакетами по size одним запросом к LLM на пакет.
+    None — реплики нет (пакеты выключены или пакет не удался): act_phase
+    запросит ее сам"""
+    if size <= 1:
+        return [None] * len(turns)
+    chunks = [turns[i:i + size] for i in range(0, len(turns), size)]
+    with usage_source("lifecycle"):
+        results = await asyncio.gather(*(_limited(sem, dialogue_batch(chunk)) for chunk in chunks),
+                                       return_exceptions=True)
+    replies = []
+    for chunk, res in zip(chunks, results):
+        if isinstance(res, Exception):
+            logger.error("Ошибка пакета из %d диалогов: %s", len(chunk), res)
+            res = [None] * len(chunk)
+        replies.extend(res)
+    return replies
+
+
+def _llm_cost(agent: Agent, params) -> float:
+    """Ожидаемое число вызовов LLM агента за тик (для бюджета)"""
+    due = reflection_due(agent)
+    reflects = due and len(agent.memories) > 3
+    if params.think_and_act and reflects:
+        return 1.0
+    acts = 1.0 if agent.current_goal or due else min(0.95, params.action_factor * get_time_speed())
+    if params.dialogue_batch_size > 1:
+        acts /= params.dialogue_batch_size
+    return reflects + acts
+
+
+async def _think_and_match(pool: list[Agent], thinkers: list[Agent], batch: WriteBatch,
+                           sem: asyncio.Semaphore, params, index) -> tuple[list, list, set]:
+    """Фазы 1–2 с рефлексией одним запросом: матчмейкинг идет до рефлексии
+    (агент, которому пора рефлексировать, действует в любом случае), и
+    инициатор пары рефлексирует и отвечает собеседнику в одном think_and_act.
+    Рефлексирующие без пары — обычной рефлексией. thinkers — агенты с
+    бюджетом LLM, pool — кандидаты в собеседники. Возвращает пары, их реплики (None — запросить в
+    act_phase) и множество рефлексировавших"""
+    reflected = {a.id for a in thinkers if reflection_due(a)}
+    initiators = [a for a in thinkers if wants_to_act(a, a.id in reflected)]
+    pairs = match_pairs(initiators, pool, params, index)
+    turns = [(a, batch.track(t), conversation_context(a, t, kind)) for a, t, kind in pairs]
+    paired = {a.id for a, _, _ in turns}
+    thinking = [i for i, (a, _, _) in enumerate(turns) if a.id in reflected and len(a.memories) > 3]
+    solo = [a for a in thinkers if a.id in reflected and a.id not in paired]
+
+    results = await asyncio.gather(
+        *(_limited(sem, think_phase(*turns[i], batch)) for i in thinking),
+        *(_limited(sem, reflect_phase(a, batch)) for a in solo), return_exceptions=True)
+    replies: list[str | None] = [None] * len(turns)
+    for i, res in zip(thinking, results):
+        if isinstance(res, Exception):
+            logger.error("Ошибка жизненного цикла для %s: %s", turns[i][0].name, res)
+        else:
+            replies[i] = res
+    for agent, res in zip(solo, results[len(thinking):]):
+        if isinstance(res, Exception):
+            logger.error("Ошибка жизненного цикла для %s: %s", agent.name, res)
+
+    # Отказавшиеся от разговора ("talk": false) в этом тике молчат
+    kept = [i for i, reply in enumerate(replies) if reply != ""]
+    turns, replies = [turns[i] for i in kept], [replies[i] for i in kept]
+    # Остальные реплики — как без think_and_act (пакетами, если включены)
+    rest = [i for i, reply in enumerate(replies) if reply is None]
+    for i, reply in zip(rest, await _batch_replies([turns[i] for i in rest], sem, params.dialogue_batch_size)):
+        replies[i] = reply
+    return turns, replies, reflected
+
+
+async def run_lifecycle_tick(agent_delay: float = 0.0, partitions: set[int] = None, dt: float = None) -> int:
+    """Один проход жизненного цикла по всем активным агентам (или только по
+    агентам из partitions — при шардировании между воркерами; собеседники
+    и тогда подбираются по всему миру, а чужой агент, выбранный целью,
+    пишется с той же проверкой revision).
+    Рефлексии идут параллельно, затем матчмейкинг строит непересекающиеся
+    пары и их диалоги тоже выполняются параллельно. agent_delay растягивает
+    старты диалогов во времени (для живого режима); изменения тогда
+    пишутся по ходу тика, не реже раза в LIVE_FLUSH_SECONDS. dt — мировое
+    время с прошлого тика для динамики эмоций (по умолчанию — по часам мира).
+    Возвращает количество обработанных агентов."""
+    global _last_tick_at
+    started = time.perf_counter()
+    params = get_params()
+    batch = await WriteBatch.load_active(partitions)
+    agents = list(batch.agents.values())
+    pool = batch.pool
+    STATS["steps"] += len(agents)
+    sem = asyncio.Semaphore(params.max_parallel_steps)
+
+    # Бюджет LLM: агенты без него в этом тике делают только шаг без LLM
+    thinkers = agents
+    if params.llm_calls_per_minute > 0:
+        # Воркеру — доля общего бюджета по числу его партиций
+        share = len(partitions) / NUM_PARTITIONS if partitions is not None else 1.0
+        granted = await llm_budget.grant([(a, _llm_cost(a, params)) for a in agents],
+                                         params.llm_calls_per_minute, now(), share)
+        thinkers = [a for a in agents if a.id in granted]
+
+    # Большой мир — собеседники из ограниченных окрестностей, а не из всех отношений
+    index = None
+    if params.neighborhood_min_agents and len(pool) >= params.neighborhood_min_agents:
+        index = neighborhood_index()
+        index.sync(pool)
+
+    if params.think_and_act:
+        turns, replies, reflected = await _think_and_match(pool, thinkers, batch, sem, params, index)
+    else:
+        # 1. Рефлексия — каждый агент меняет только себя
+        results = await asyncio.gather(*(_limited(sem, reflect_phase(a, batch)) for a in thinkers),
+                                       return_exceptions=True)
+        reflected = set()
+        initiators = []
+        for agent, res in zip(thinkers, results):
+            if isinstance(res, Exception):
+                logger.error("Ошибка жизненного цикла для %s: %s", agent.name, res)
+                res = False
+            if res:
+                reflected.add(agent.id)
+            if wants_to_act(agent, res):
+                initiators.append(agent)
+
+        # 2. Матчмейкинг и диалоги: пары не пересекаются, поэтому безопасны параллельно
+        pairs = match_pairs(initiators, pool, params, index)
+        turns = [(a, batch.track(t), conversation_context(a, t, kind)) for a, t, kind in pairs]
+        replies = await _batch_replies(turns, sem, params.dialogue_batch_size)
+    # Агенты, чей диалог идет прямо сейчас: промежуточный сброс их не пишет
+    in_dialogue: set[str] = set()
+
+    async def act(turn, reply, delay):
+        pair = {str(turn[0].id), str(turn[1].id)}
+        if delay:
+            await asyncio.sleep(delay)
+        in_dialogue.update(pair)
         try:
-            agents = await Agent.find({"is_active": True}).to_list()
+            await _limited(sem, act_phase(*turn, batch, reply))
+        finally:
+            in_dialogue.difference_update(pair)
+            # Живой режим: законченные диалоги видны по ходу тика, а не после последнего старта
+            if agent_delay:
+                await batch.flush_due(LIVE_FLUSH_SECONDS, busy=in_dialogue)
+
+    results = await asyncio.gather(*(act(turn, reply, i * agent_delay)
+                                     for i, (turn, reply) in enumerate(zip(turns, replies))),
+                                   return_exceptions=True)
+    for (agent, _, _), res in zip(turns, results):
+        if isinstance(res, Exception):
+            logger.error("Ошибка жизненного цикла для %s: %s", agent.name, res)
+    if params.llm_calls_per_minute > 0:
+        await llm_budget.note_addressed(t.id for _, t, _ in turns)
+    if index is not None:
+        index.touch(agent for a, t, _ in turns for agent in (a, t))
+
+    for agent in agents:
+        finish_step(agent, batch)
+
+    # Не-LLM динамика эмоций и симпатий — сразу для всего населения
+    tick_at = now()
+    if dt is None:
+        dt = (tick_at - _last_tick_at).total_seconds() if _last_tick_at else 0.0
+    _last_tick_at = tick_at
+    for a in step_population(agents, dt, tick_at, reflected):
+        batch.mark(a)
+
+    # Все (оставшиеся) изменения тика — несколькими bulk-запросами
+    flush_ms = await batch.flush()
+    metrics.TICK_LATENCY.observe(time.perf_counter() - started)
+    metrics.TICK_AGENTS.observe(len(agents))
+    metrics.TICK_DIALOGUES.observe(len(turns))
+    logger.info("Тик: %d агентов, %d диалогов, запись в БД %.1f мс", len(agents), len(turns), flush_ms)
+    return len(agents)
 
-            time_speed = get_time_speed()
-            # Обрабатываем агентов по очереди с задержкой
-            for agent in agents:
-                await agent_lifecycle_step(agent)
-                await asyncio.sleep(2 / time_speed)  # Задержка между агентами зависит от скорости
 
-            # Ждем перед следующим циклом - скорость влияет на интервал
-            # Уменьшаем базовый интервал для более частых обновлений и большего экшена
-            base_interval = 10  # базовый интервал 10 секунд (было 20) - УМЕНЬШЕН для большего экшена
-            await asyncio.sleep(base_interval / time_speed)
+async def run_lifecycle_loop():
+    """Основной цикл жизнедеятельности агентов своих партиций.
+    Партиции распределяются арендами в Mongo, поэтому цикл можно запускать
+    в нескольких процессах одновременно — каждый агент симулируется одним из них."""
+    leases = lease_manager()
+    heartbeat = asyncio.create_task(leases.run_heartbeat())
+    try:
+        while True:
+            try:
+                # Скорость могли сменить через API другого процесса
+                time_speed = await sync_time_speed()
+                # Обрабатываем агентов по очереди с задержкой, зависящей от скорости
+                if leases.owned:
+                    await run_lifecycle_tick(agent_delay=2 / time_speed, partitions=set(leases.owned))
 
+                # Ждем перед следующим циклом - скорость влияет на интервал
+                # Уменьшаем базовый интервал для более частых обновлений и большего экшена
+                base_interval = 10  # базовый интервал 10 секунд (было 20) - УМЕНЬШЕН для большего экшена
+                await asyncio.sleep(base_interval / time_speed)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Ошибка в цикле жизнедеятельности: %s", e)
+                await asyncio.sleep(10)
+    finally:
+        heartbeat.cancel()
+        try:
+            await leases.release_all()
         except Exception as e:
-            print(f"Ошибка в цикле жизнедеятельности: {e}")
-            await asyncio.sleep(10)
+            logger.warning("Не удалось отпустить аренды: %s", e)
 
 
 def start_lifecycle_background_task():
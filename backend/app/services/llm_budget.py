@@ -0,0 +1,210 @@
+"""
+Бюджет вызовов LLM для жизненного цикла.
+
+Без бюджета нагрузка на LLM растет как число агентов × скорость времени.
+С LifecycleParams.llm_calls_per_minute > 0 каждый тик получает долю
+бюджета из "ведра": оно пополняется на llm_calls_per_minute за минуту
+мирового времени (в живом режиме оно идет как реальное) и вмещает не
+больше минуты бюджета. Фактические вызовы источников BUDGET_SOURCES (из
+llm_usage.SOURCE_CALLS: тики и рассылки пользователя) списываются на
+следующем тике, так что пакетные диалоги и think_and_act, которые дешевле
+оценки, оставляют бюджет другим, а большая рассылка его съедает.
+
+Бюджет тика делится между агентами по приоритету: ожидающие ответа
+(к ним обращались в прошлых тиках), недавно получившие сообщение от
+пользователя, экстраверты; агенты, которых долго обходили, постепенно
+поднимаются в очереди. Агент без бюджета в этом тике не рефлексирует и
+не начинает диалог — для него остается дешевый шаг без LLM (динамика
+эмоций step_population), а рефлексия откладывается до тика с бюджетом.
+
+С MongoDB процессов несколько (API и воркеры), поэтому ведро, отметки
+внимания и ожидающие ответа лежат в общем документе world_settings:
+пополнение и списание вызовов каждого процесса — одним атомарным
+обновлением, а воркер раздает долю остатка по числу своих партиций.
+Иначе бюджет умножался бы на число воркеров, а сообщения пользователя,
+принятые API, не доходили бы до воркеров.
+"""
+import random
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+from app.db.repository import get_storage
+from app.models.agent import Agent
+from app.services import llm_usage
+from app.services.sharding import settings_collection
+
+# Надбавки к приоритету
+PENDING_BONUS = 1.0      # к агенту обращались, он еще не ответил
+ATTENTION_BONUS = 2.0    # недавнее сообщение пользователя
+WAIT_BONUS = 0.25        # за каждый тик без бюджета
+JITTER = 0.5             # случайная добавка, чтобы равные не шли всегда в одном порядке
+ATTENTION_SECONDS = 300
+BUDGET_SOURCES = ("lifecycle", "broadcast")
+SHARED_ID = "llm_budget"
+_EPOCH = datetime(1970, 1, 1)
+
+BUDGET_STATS = {"ticks": 0, "granted": 0, "deferred": 0, "calls": 0, "tokens": 0.0}
+
+
+def _spent_calls() -> int:
+    return sum(llm_usage.SOURCE_CALLS.get(source, 0) for source in BUDGET_SOURCES)
+
+
+class BudgetGovernor:
+
+    def __init__(self):
+        self.tokens: float | None = None
+        self.last_at: datetime | None = None
+        self.seen_calls = _spent_calls()
+        self.pending: set[str] = set()
+        self.attention: dict[str, datetime] = {}
+        self.waited: dict[str, int] = {}
+
+    def note_attention(self, agent_id: str, at: datetime):
+        """Пользователь написал агенту — он получает бюджет в первую очередь"""
+        self.attention[str(agent_id)] = at
+
+    def note_addressed(self, agent_ids):
+        """К агентам обратились в диалоге — им есть на что ответить"""
+        self.pending.update(str(i) for i in agent_ids)
+
+    def take_spent(self) -> int:
+        """Вызовы из бюджета с прошлого списания"""
+        calls = _spent_calls()
+        spent, self.seen_calls = calls - self.seen_calls, calls
+        BUDGET_STATS["calls"] += spent
+        return spent
+
+    def _refill(self, per_minute: float, at: datetime):
+        spent = self.take_spent()
+        if self.tokens is None:
+            self.tokens = per_minute
+        else:
+            elapsed = max(0.0, (at - self.last_at).total_seconds())
+            self.tokens = min(per_minute, self.tokens - spent + per_minute * elapsed / 60)
+        self.last_at = at
+        BUDGET_STATS["tokens"] = round(self.tokens, 2)
+
+    def _priority(self, agent: Agent, at: datetime) -> float:
+        agent_id = str(agent.id)
+        score = agent.personality.extraversion + WAIT_BONUS * self.waited.get(agent_id, 0)
+        if agent_id in self.pending:
+            score += PENDING_BONUS
+        seen = self.attention.get(agent_id)
+        if seen is not None and (at - seen).total_seconds() < ATTENTION_SECONDS:
+            score += ATTENTION_BONUS
+        return score + random.random() * JITTER
+
+    def grant(self, costs: list[tuple[Agent, float]], per_minute: float, at: datetime) -> set:
+        """Агенты, которым в этом тике можно обращаться к LLM.
+        costs — (агент, ожидаемое число вызовов за тик)"""
+        self._refill(per_minute, at)
+        return self.allot(costs, self.tokens, at)
+
+    def allot(self, costs: list[tuple[Agent, float]], available: float, at: datetime) -> set:
+        """Раздать available вызовов по приоритету (без пополнения ведра)"""
+        BUDGET_STATS["ticks"] += 1
+        granted = set()
+        ranked = sorted(costs, key=lambda item: self._priority(item[0], at), reverse=True)
+        for agent, cost in ranked:
+            agent_id = str(agent.id)
+            if cost <= available:
+                available -= cost
+                granted.add(agent.id)
+                self.waited.pop(agent_id, None)
+                self.pending.discard(agent_id)
+            else:
+                self.waited[agent_id] = self.waited.get(agent_id, 0) + 1
+        BUDGET_STATS["granted"] += len(granted)
+        BUDGET_STATS["deferred"] += len(costs) - len(granted)
+        # Устаревшее внимание не копится
+        self.attention = {k: v for k, v in self.attention.items() if (at - v).total_seconds() < ATTENTION_SECONDS}
+        return granted
+
+
+_governor = BudgetGovernor()
+
+
+def governor() -> BudgetGovernor:
+    return _governor
+
+
+def reset_governor():
+    """Новое ведро (симуляции, смена бюджета)"""
+    global _governor
+    _governor = BudgetGovernor()
+    for key in BUDGET_STATS:
+        BUDGET_STATS[key] = 0
+
+
+'''Общее ведро (MongoDB)'''
+
+def _shared() -> bool:
+    return get_storage().name == "mongo"
+
+
+async def _sync(gov: BudgetGovernor, per_minute: float, at: datetime) -> dict:
+    """Списать вызовы процесса, пополнить ведро и забыть устаревшее внимание —
+    одним обновлением документа, общего для всех процессов"""
+    spent = gov.take_spent()
+    moment = (at - _EPOCH).total_seconds()
+    tokens, last = {"$ifNull": ["$tokens", per_minute]}, {"$ifNull": ["$at", moment]}
+    refill = {"$multiply": [per_minute / 60, {"$max": [0, {"$subtract": [moment, last]}]}]}
+    cutoff = at - timedelta(seconds=ATTENTION_SECONDS)
+    attention = {"$filter": {"input": {"$objectToArray": {"$ifNull": ["$attention", {}]}},
+                             "cond": {"$gte": ["$$this.v", cutoff]}}}
+    return await settings_collection().find_one_and_update(
+        {"_id": SHARED_ID},
+        [{"$set": {"tokens": {"$min": [per_minute, {"$add": [tokens, -spent, refill]}]},
+                   "at": {"$max": [moment, last]},
+                   "attention": {"$arrayToObject": attention}}}],
+        upsert=True, return_document=ReturnDocument.AFTER,
+    )
+
+
+async def grant(costs: list[tuple[Agent, float]], per_minute: float, at: datetime, share: float = 1.0) -> set:
+    """BudgetGovernor.grant для тика. С MongoDB ведро общее, а воркер
+    раздает долю share остатка (доля его партиций)"""
+    gov = governor()
+    if not _shared():
+        return gov.grant(costs, per_minute, at)
+    doc = await _sync(gov, per_minute, at)
+    gov.tokens = doc["tokens"]
+    BUDGET_STATS["tokens"] = round(gov.tokens, 2)
+    pending = doc.get("pending") or {}
+    gov.attention = dict(doc.get("attention") or {})
+    gov.pending = set(pending)
+    granted = gov.allot(costs, gov.tokens * share, at)
+    # Ответившие больше не ждут — и для других воркеров
+    served = [str(i) for i in granted if str(i) in pending]
+    if served:
+        await settings_collection().update_one({"_id": SHARED_ID}, {"$unset": {f"pending.{i}": "" for i in served}})
+    return granted
+
+
+async def note_attention(agent_id, at: datetime):
+    """Пользователь написал агенту (см. BudgetGovernor.note_attention)"""
+    governor().note_attention(agent_id, at)
+    if _shared():
+        await settings_collection().update_one({"_id": SHARED_ID}, {"$set": {f"attention.{agent_id}": at}},
+                                               upsert=True)
+
+
+async def note_addressed(agent_ids):
+    """К агентам обратились в диалоге (см. BudgetGovernor.note_addressed)"""
+    agent_ids = [str(i) for i in agent_ids]
+    governor().note_addressed(agent_ids)
+    if _shared() and agent_ids:
+        await settings_collection().update_one({"_id": SHARED_ID}, {"$set": {f"pending.{i}": True for i in agent_ids}},
+                                               upsert=True)
+
+
+async def settle():
+    """Списать из общего ведра вызовы этого процесса, не дожидаясь тика
+    (API после рассылки: сам он тиков не делает)"""
+    if not _shared():
+        return
+    spent = governor().take_spent()
+    if spent:
+        await settings_collection().update_one({"_id": SHARED_ID}, {"$inc": {"tokens": -spent}})
@@ -0,0 +1,155 @@
+"""
+Кассеты LLM: запись и воспроизведение трафика GigaChat.
+
+Режим record пишет каждую пару запрос → ответ: хэш запроса (модель,
+сообщения, температура, max_tokens), тип вызова, текст ответа, задержку
+и токены. Режим replay отдает их обратно без сети, по желанию — с
+записанными задержками (latency_scale), так что реальную форму трафика
+можно повторять в бенчмарках на машинах без доступа к API.
+
+Формат — NDJSON в gzip, одна строка на вызов. Записи дописываются
+отдельными gzip-членами по FLUSH_EVERY штук (gzip читает их подряд),
+поэтому при падении теряется не больше одной пачки.
+
+Повторы одного запроса отдаются в записанном порядке по кругу. Если
+запроса в кассете нет (промпт зависит от состояния мира и мог
+измениться), on_miss решает: kind — следующий записанный ответ того же
+типа вызова, backend — настоящий вызов LLM_BACKEND, error — CassetteMiss.
+
+    LLM_CASSETTE=cassettes/day1.ndjson.gz LLM_CASSETTE_MODE=record uvicorn app.main:app
+    python -m app.simulate --cassette cassettes/day1.ndjson.gz --replay-latency 1.0
+"""
+import asyncio
+import atexit
+import gzip
+import hashlib
+import json
+import os
+from itertools import count
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from gigachat.models import Chat
+
+FLUSH_EVERY = 100
+MISS_POLICIES = ("kind", "backend", "error")
+
+CASSETTE_STATS = {"recorded": 0, "entries": 0, "hits": 0, "misses": 0, "fallbacks": 0}
+
+_state = {"mode": None, "path": None, "latency_scale": 0.0, "on_miss": "kind"}
+_pending: list[bytes] = []
+# replay: ключ запроса → записи; тип вызова → записи (для промахов)
+_by_key: dict[str, list[dict]] = {}
+_by_kind: dict[str, list[dict]] = {}
+_cursors: dict[str, count] = {}
+
+
+class CassetteMiss(LookupError):
+    pass
+
+
+def request_key(chat_obj: "Chat") -> str:
+    """Хэш запроса: все, что влияет на ответ модели"""
+    payload = chat_obj.model_dump_json(exclude_none=True, include={"model", "messages", "temperature", "top_p", "max_tokens"})
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def mode() -> str | None:
+    return _state["mode"]
+
+
+def use_cassette(path: str, mode: str, latency_scale: float = 0.0, on_miss: str = "kind"):
+    """Включить запись (record) или воспроизведение (replay) кассеты path"""
+    if mode not in ("record", "replay"):
+        raise ValueError(f"Неизвестный режим кассеты: {mode}")
+    if on_miss not in MISS_POLICIES:
+        raise ValueError(f"on_miss: одно из {', '.join(MISS_POLICIES)}")
+    close_cassette()
+    _by_key.clear()
+    _by_kind.clear()
+    _cursors.clear()
+    if mode == "replay":
+        _load(path)
+    else:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    _state.update(mode=mode, path=path, latency_scale=latency_scale, on_miss=on_miss)
+
+
+def close_cassette():
+    """Дописать остаток записи и выключить кассету"""
+    _flush()
+    _state.update(mode=None, path=None)
+
+
+def _load(path: str):
+    n = 0
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                entry = json.loads(line)
+                _by_key.setdefault(entry["key"], []).append(entry)
+                _by_kind.setdefault(entry["kind"], []).append(entry)
+                n += 1
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+            pass  # недописанная пачка при падении
+    CASSETTE_STATS["entries"] = n
+
+
+def _next(name: str, entries: list[dict]) -> dict:
+    cursor = _cursors.setdefault(name, count())
+    return entries[next(cursor) % len(entries)]
+
+
+'''Запись'''
+
+def record(kind: str, chat_obj: "Chat", result: tuple, latency: float):
+    """Записать ответ: result — (текст, prompt_tokens, completion_tokens, cached)"""
+    text, prompt_tokens, completion_tokens, cached = result
+    entry = {"key": request_key(chat_obj), "kind": kind, "text": text, "ms": round(latency * 1000, 1),
+             "pt": prompt_tokens, "ct": completion_tokens, "cached": cached}
+    _pending.append(json.dumps(entry, ensure_ascii=False).encode() + b"\n")
+    CASSETTE_STATS["recorded"] += 1
+    if len(_pending) >= FLUSH_EVERY:
+        _flush()
+
+
+def _flush():
+    if not _pending or _state["mode"] != "record":
+        _pending.clear()
+        return
+    data = gzip.compress(b"".join(_pending))
+    _pending.clear()
+    with open(_state["path"], "ab") as f:
+        f.write(data)
+
+
+atexit.register(_flush)
+
+
+'''Воспроизведение'''
+
+async def replay(kind: str, chat_obj: "Chat") -> tuple | None:
+    """Записанный ответ (текст, prompt_tokens, completion_tokens, cached);
+    None — промах с on_miss=backend"""
+    key = request_key(chat_obj)
+    entries = _by_key.get(key)
+    if entries:
+        CASSETTE_STATS["hits"] += 1
+        entry = _next(key, entries)
+    else:
+        CASSETTE_STATS["misses"] += 1
+        policy = _state["on_miss"]
+        if policy == "backend":
+            return None
+        if policy == "error" or not _by_kind.get(kind):
+            raise CassetteMiss(f"Запроса {key} ({kind}) нет в кассете {_state['path']}")
+        CASSETTE_STATS["fallbacks"] += 1
+        entry = _next(f"kind:{kind}", _by_kind[kind])
+    if _state["latency_scale"] > 0:
+        await asyncio.sleep(entry["ms"] / 1000 * _state["latency_scale"])
+    return entry["text"], entry["pt"], entry["ct"], entry["cached"]
+
+
+if os.getenv("LLM_CASSETTE"):
+    use_cassette(os.environ["LLM_CASSETTE"], os.getenv("LLM_CASSETTE_MODE", "replay"),
+                 float(os.getenv("LLM_CASSETTE_LATENCY", "0")), os.getenv("LLM_CASSETTE_ON_MISS", "kind"))
@@ -0,0 +1,163 @@
+"""
+Защита вызовов LLM: дедлайны, размыкатель цепи и хеджирование.
+
+Дедлайн — на каждый тип вызова (LLM_TIMEOUTS): зависший запрос GigaChat
+больше не держит тик жизненного цикла или HTTP-обработчик.
+
+Размыкатель считает подряд идущие ошибки и таймауты; после
+LLM_BREAKER_FAILURES он размыкается на LLM_BREAKER_OPEN_SECONDS — вызовы
+не ждут заведомо упавший API, а сразу получают локальный ответ
+(офлайн-бэкенд, gigachat_service). Затем одна пробная попытка: успех
+замыкает цепь, ошибка снова размыкает.
+
+Хеджирование (LLM_HEDGE=1) — для интерактивных вызовов (HEDGE_KINDS):
+если первая попытка не ответила за перцентиль LLM_HEDGE_PERCENTILE
+недавних задержек этого типа, запускается вторая; берется первый
+успешный ответ, другая попытка отменяется.
+
+Окружение:
+    LLM_TIMEOUTS=chat=20,dialogue=30    секунды, поверх значений по умолчанию
+    LLM_BREAKER_FAILURES=5
+    LLM_BREAKER_OPEN_SECONDS=30
+    LLM_HEDGE=0
+    LLM_HEDGE_PERCENTILE=0.9
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+from app.services import metrics
+
+TIMEOUTS = {"chat": 30.0, "reflect": 45.0, "dialogue": 30.0, "think": 45.0, "dialogue_batch": 90.0}
+DEFAULT_TIMEOUT = 60.0
+for _item in os.getenv("LLM_TIMEOUTS", "").split(","):
+    _kind, _, _value = _item.strip().partition("=")
+    if _kind and _value:
+        TIMEOUTS[_kind.strip()] = float(_value)
+
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+
+HEDGE_ENABLED = os.getenv("LLM_HEDGE", "0") == "1"
+HEDGE_KINDS = {"chat"}
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.9"))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY = 5.0   # пока задержек мало для перцентиля
+LATENCY_WINDOW = 200
+
+RESILIENCE_STATS = {"timeouts": 0, "failures": 0, "breaker_opens": 0, "short_circuited": 0,
+                    "hedged": 0, "hedge_wins": 0, "primary_wins": 0}
+
+BREAKER_STATE = metrics.Gauge("vw_llm_breaker_state", "Размыкатель LLM: 0 — замкнут, 1 — пробная попытка, 2 — разомкнут")
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_latencies: dict[str, deque] = {}
+
+
+class CircuitBreaker:
+
+    def __init__(self, failures: int = BREAKER_FAILURES, open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.max_failures = failures
+        self.open_seconds = open_seconds
+        self.failures = 0
+        self.opened_at = 0.0
+        self._set(CLOSED)
+
+    def _set(self, state: str):
+        self.state = state
+        BREAKER_STATE.set(_STATE_VALUES[state])
+
+    def allow(self) -> bool:
+        """Можно ли идти в API. Разомкнутая цепь после паузы пропускает одну пробную попытку"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self._set(HALF_OPEN)
+            return True
+        RESILIENCE_STATS["short_circuited"] += 1
+        return False
+
+    def success(self):
+        self.failures = 0
+        if self.state != CLOSED:
+            self._set(CLOSED)
+
+    def abandon(self):
+        """Вызов отменен (не ответ API): пробная попытка не состоялась, и следующий
+        вызов снова станет пробным, а не застрянет в HALF_OPEN навсегда"""
+        if self.state == HALF_OPEN:
+            self._set(OPEN)
+
+    def failure(self):
+        self.failures += 1
+        RESILIENCE_STATS["failures"] += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.max_failures):
+            self.opened_at = time.monotonic()
+            RESILIENCE_STATS["breaker_opens"] += 1
+            self._set(OPEN)
+
+
+breaker = CircuitBreaker()
+
+
+def timeout_for(kind: str) -> float:
+    return TIMEOUTS.get(kind, DEFAULT_TIMEOUT)
+
+
+def hedge_delay(kind: str) -> float:
+    """Через сколько секунд запускать вторую попытку: перцентиль недавних задержек"""
+    window = _latencies.get(kind)
+    if not window or len(window) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    ordered = sorted(window)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE))]
+
+
+async def _hedged(kind: str, attempt: Callable[[], Awaitable]):
+    first = asyncio.ensure_future(attempt())
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay(kind))
+        if done:
+            return first.result()
+        RESILIENCE_STATS["hedged"] += 1
+        tasks.append(asyncio.ensure_future(attempt()))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    RESILIENCE_STATS["primary_wins" if task is first else "hedge_wins"] += 1
+                    return task.result()
+        return first.result()  # обе попытки упали — ошибка первой
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def guarded(kind: str, attempt: Callable[[], Awaitable]):
+    """Вызов attempt() с дедлайном типа kind и учетом в размыкателе
+    (хеджирование — для HEDGE_KINDS при LLM_HEDGE=1)"""
+    started = time.perf_counter()
+    try:
+        call = _hedged(kind, attempt) if HEDGE_ENABLED and kind in HEDGE_KINDS else attempt()
+        # wait_for, а не asyncio.timeout (3.11+): проект работает и на Python 3.10
+        result = await asyncio.wait_for(call, timeout_for(kind))
+    except asyncio.TimeoutError:  # до 3.11 не совпадает со встроенным TimeoutError
+        RESILIENCE_STATS["timeouts"] += 1
+        breaker.failure()
+        raise TimeoutError(f"LLM ({kind}) не ответил за {timeout_for(kind):g} с")
+    except asyncio.CancelledError:  # не Exception: без этого пробная попытка не завершилась бы
+        breaker.abandon()
+        raise
+    except Exception:
+        breaker.failure()
+        raise
+    breaker.success()
+    _latencies.setdefault(kind, deque(maxlen=LATENCY_WINDOW)).append(time.perf_counter() - started)
+    return result
@@ -0,0 +1,194 @@
+"""
+Журнал расхода LLM.
+
+Каждый вызов (gigachat_service._complete) — компактная запись: токены
+запроса и ответа, задержка, тип вызова (chat / reflect / dialogue),
+агент и собеседник, источник, флаг кэша и ошибка. Источник — то, что
+задано через usage_source() (тик жизненного цикла — "lifecycle"), иначе
+шаблон HTTP-маршрута ("POST /text/chat/{agent_id}"), иначе "background".
+
+Запись не ждет БД: вызовы копятся в буфере, а поминутные свертки по
+(минута, kind, source, agent_id) сразу считаются в памяти. Фоновая
+задача run_usage_sink раз в USAGE_FLUSH_INTERVAL (и сам буфер при
+BATCH_SIZE вызовов) сбрасывает их двумя пакетными операциями.
+Расход за окно (GET /llm/usage) считается по сверткам, без перебора
+вызовов.
+
+У офлайн-бэкенда токенов нет — они оцениваются по длине текста.
+"""
+import asyncio
+import logging
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+
+from app.db.repository import usage_repo
+from app.services import metrics
+
+USAGE_ENABLED = os.getenv("LLM_USAGE", "1") != "0"
+USAGE_FLUSH_INTERVAL = float(os.getenv("LLM_USAGE_FLUSH_INTERVAL", "5"))
+BATCH_SIZE = 500
+# Если БД недоступна, старые вызовы отбрасываются (свертки сохраняются)
+MAX_BUFFER = 20 * BATCH_SIZE
+# Символов на токен для оценки (кириллица в токенизаторе GigaChat)
+TOKEN_CHARS = 3
+
+GROUP_BY = {"kind": "kind", "agent": "agent_id", "source": "source", "minute": "minute"}
+
+# Вызовы по источникам с запуска процесса (и при LLM_USAGE=0 — по ним считает llm_budget)
+SOURCE_CALLS: dict[str, int] = {}
+USAGE_STATS = {"calls": 0, "errors": 0, "cached": 0, "prompt_tokens": 0, "completion_tokens": 0,
+               "flushes": 0, "dropped": 0, "flush_errors": 0}
+
+logger = logging.getLogger(__name__)
+
+_source: ContextVar[str | None] = ContextVar("llm_usage_source", default=None)
+_calls: list[dict] = []
+_minutes: dict[tuple, dict] = {}
+_flushing = False
+
+
+def set_usage_enabled(enabled: bool):
+    global USAGE_ENABLED
+    USAGE_ENABLED = enabled
+
+
+@contextmanager
+def usage_source(name: str):
+    """Источник для вызовов LLM внутри блока (и в созданных в нем задачах)"""
+    token = _source.set(name)
+    try:
+        yield
+    finally:
+        _source.reset(token)
+
+
+def estimate_tokens(*texts: str) -> int:
+    return sum(len(t) for t in texts if t) // TOKEN_CHARS + 1
+
+
+'''Запись'''
+
+def record_call(kind: str, backend: str, agent_id: str = None, target_id: str = None,
+                prompt_tokens: int = 0, completion_tokens: int = 0, latency: float = 0.0,
+                cached: bool = False, error: str = None):
+    """Учесть вызов LLM (latency в секундах)"""
+    source = _source.get() or metrics.current_route() or "background"
+    SOURCE_CALLS[source] = SOURCE_CALLS.get(source, 0) + 1
+    if not USAGE_ENABLED:
+        return
+    now = datetime.utcnow()
+    latency_ms = round(latency * 1000, 1)
+    _calls.append({"timestamp": now, "kind": kind, "source": source, "backend": backend,
+                   "agent_id": agent_id, "target_id": target_id,
+                   "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                   "latency_ms": latency_ms, "cached": cached, "error": error})
+
+    minute = now.replace(second=0, microsecond=0)
+    key = (minute, kind, source, agent_id)
+    m = _minutes.get(key)
+    if m is None:
+        m = _minutes[key] = {"minute": minute, "kind": kind, "source": source, "agent_id": agent_id,
+                             "calls": 0, "errors": 0, "cached": 0, "prompt_tokens": 0,
+                             "completion_tokens": 0, "latency_ms_sum": 0.0, "latency_ms_max": 0.0}
+    m["calls"] += 1
+    m["errors"] += error is not None
+    m["cached"] += cached
+    m["prompt_tokens"] += prompt_tokens
+    m["completion_tokens"] += completion_tokens
+    m["latency_ms_sum"] += latency_ms
+    m["latency_ms_max"] = max(m["latency_ms_max"], latency_ms)
+
+    USAGE_STATS["calls"] += 1
+    USAGE_STATS["errors"] += error is not None
+    USAGE_STATS["cached"] += cached
+    USAGE_STATS["prompt_tokens"] += prompt_tokens
+    USAGE_STATS["completion_tokens"] += completion_tokens
+    if len(_calls) > MAX_BUFFER:
+        USAGE_STATS["dropped"] += len(_calls) - MAX_BUFFER
+        del _calls[:len(_calls) - MAX_BUFFER]
+    if len(_calls) >= BATCH_SIZE and not _flushing:
+        asyncio.ensure_future(flush())
+
+
+async def flush() -> int:
+    """Сбросить буфер в хранилище. Возвращает число записанных вызовов"""
+    global _calls, _minutes, _flushing
+    if _flushing or not (_calls or _minutes):
+        return 0
+    calls, minutes = _calls, _minutes
+    _calls, _minutes = [], {}
+    _flushing = True
+    try:
+        await usage_repo().append(calls, list(minutes.values()))
+        USAGE_STATS["flushes"] += 1
+        return len(calls)
+    except Exception as e:
+        # Вернуть в буфер: следующий сброс запишет и старое, и новое
+        USAGE_STATS["flush_errors"] += 1
+        logger.error("Не удалось записать журнал расхода: %s", e)
+        _calls[:0] = calls
+        for key, m in minutes.items():
+            fresh = _minutes.get(key)
+            if fresh is not None:
+                for field in ("calls", "errors", "cached", "prompt_tokens", "completion_tokens", "latency_ms_sum"):
+                    m[field] += fresh[field]
+                m["latency_ms_max"] = max(m["latency_ms_max"], fresh["latency_ms_max"])
+            _minutes[key] = m
+        return 0
+    finally:
+        _flushing = False
+
+
+async def run_usage_sink(interval: float = USAGE_FLUSH_INTERVAL):
+    """Фоновый сброс журнала; при отмене дописывает остаток"""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await flush()
+    finally:
+        await flush()
+
+
+'''Выборки'''
+
+def _row(key, rows: list[dict]) -> dict:
+    calls = sum(r["calls"] for r in rows)
+    prompt = sum(r["prompt_tokens"] for r in rows)
+    completion = sum(r["completion_tokens"] for r in rows)
+    return {
+        "key": key.isoformat() if isinstance(key, datetime) else key,
+        "calls": calls,
+        "errors": sum(r["errors"] for r in rows),
+        "cached": sum(r["cached"] for r in rows),
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "total_tokens": prompt + completion,
+        "latency_ms_avg": round(sum(r["latency_ms_sum"] for r in rows) / calls, 1) if calls else 0.0,
+        "latency_ms_max": max((r["latency_ms_max"] for r in rows), default=0.0),
+    }
+
+
+async def summarize(since: datetime = None, until: datetime = None, group_by: str = "kind",
+                    agent_id: str = None, kind: str = None, top: int = 50) -> dict:
+    """Расход и задержка за окно [since, until) с группировкой по kind /
+    agent / source / minute. По умолчанию — последний час"""
+    if group_by not in GROUP_BY:
+        raise ValueError(f"group_by: одно из {', '.join(GROUP_BY)}")
+    await flush()
+    until = until or datetime.utcnow() + timedelta(minutes=1)
+    since = since or until - timedelta(hours=1)
+    rows = await usage_repo().minutes(since, until, agent_id, kind)
+    field = GROUP_BY[group_by]
+    groups: dict = {}
+    for r in rows:
+        groups.setdefault(r.get(field), []).append(r)
+    result = [_row(key, items) for key, items in groups.items()]
+    if group_by == "minute":
+        result.sort(key=lambda r: r["key"])
+    else:
+        result.sort(key=lambda r: (r["total_tokens"], r["calls"]), reverse=True)
+        result = result[:top]
+    return {"since": since, "until": until, "group_by": group_by,
+            "total": _row("total", rows), "groups": result}
@@ -0,0 +1,96 @@
+"""
+Матчмейкинг: подбор собеседников на один тик жизненного цикла.
+
+Вместо независимого random.choice в каждом шаге тик строит набор
+непересекающихся пар (каждый агент — не более чем в одном диалоге),
+поэтому диалоги можно выполнять параллельно без гонок за цель,
+а их число за тик предсказуемо (не больше N/2 или заданного лимита).
+
+Кандидаты для инициатора — знакомые агенты плюс небольшая случайная
+выборка незнакомцев; вес кандидата зависит от типа отношений
+(враг / друг / нейтральный / незнакомец) и настраивается в LifecycleParams.
+С индексом окрестностей (app.services.neighborhoods) знакомые — только
+самые сильные связи, а незнакомцы берутся в основном из своего сообщества.
+"""
+import random
+
+from app.models.agent import Agent, Relationship
+from app.services.neighborhoods import NeighborhoodIndex
+from app.services.world_state import LifecycleParams
+
+FRIEND_THRESHOLD = 0.3
+
+
+def relation_kind(rel: Relationship | None, params: LifecycleParams) -> str:
+    if rel is None:
+        return "stranger"
+    if rel.sympathy < params.hostile_threshold:
+        return "hostile"
+    if rel.sympathy > FRIEND_THRESHOLD:
+        return "friend"
+    return "neutral"
+
+
+def _strangers(agent_id: str, pool_list: list[Agent], by_id: dict[str, Agent], params: LifecycleParams,
+               index: NeighborhoodIndex | None) -> list[Agent]:
+    k = params.match_stranger_sample
+    if index is None:
+        return random.sample(pool_list, min(k, len(pool_list)))
+    # Доля случайных агентов всего мира — чтобы сообщества не замыкались
+    mixing = min(k, max(1, round(k * params.match_mixing_rate)))
+    local = [by_id[m] for m in index.neighbors(agent_id, k - mixing) if m in by_id]
+    return local + random.sample(pool_list, min(k - len(local), len(pool_list)))
+
+
+def match_pairs(initiators: list[Agent], pool: list[Agent], params: LifecycleParams,
+                index: NeighborhoodIndex = None) -> list[tuple[Agent, Agent, str]]:
+    """Непересекающиеся пары (инициатор, цель, тип отношений) на тик.
+    index — индекс окрестностей: кандидатов не больше TIES + match_stranger_sample"""
+    by_id = {str(a.id): a for a in pool if a.is_active}
+    pool_list = list(by_id.values())
+    weights = {
+        "hostile": params.match_hostile_weight,
+        "friend": params.match_friend_weight,
+        "neutral": params.match_neutral_weight,
+        "stranger": params.match_stranger_weight,
+    }
+    limit = params.max_dialogues_per_tick or len(pool_list) // 2
+
+    order = list(initiators)
+    random.shuffle(order)
+    busy: set[str] = set()
+    pairs = []
+    for agent in order:
+        if len(pairs) >= limit:
+            break
+        agent_id = str(agent.id)
+        if agent_id in busy or agent_id not in by_id:
+            continue
+
+        candidates: dict[str, tuple[Agent, str]] = {}
+        for r in (agent.relationships if index is None else index.known(agent_id)):
+            target = by_id.get(r.agent_id)
+            if target is not None and r.agent_id != agent_id and r.agent_id not in busy:
+                candidates[r.agent_id] = (target, relation_kind(r, params))
+        for target in _strangers(agent_id, pool_list, by_id, params, index):
+            target_id = str(target.id)
+            if target_id != agent_id and target_id not in busy and target_id not in candidates:
+                candidates[target_id] = (target, "stranger")
+        if not candidates:
+            continue
+
+        options = list(candidates.values())
+        hostile = [c for c in options if c[1] == "hostile"]
+        # Враги в приоритете: с заданной вероятностью агент идет выяснять отношения
+        if hostile and random.random() < params.hostile_target_probability:
+            target, kind = random.choice(hostile)
+        else:
+            option_weights = [weights[kind] for _, kind in options]
+            if not any(option_weights):
+                continue
+            target, kind = random.choices(options, weights=option_weights)[0]
+
+        busy.add(agent_id)
+        busy.add(str(target.id))
+        pairs.append((agent, target, kind))
+    return pairs
@@ -0,0 +1,23 @@
+"""
+Ограничение памяти агентов: сверх MAX_MEMORIES воспоминаний самые
+неважные сворачиваются в одну сводку.
+"""
+from app.models.agent import Agent, Memory
+from app.services.world_state import now
+
+MAX_MEMORIES = 50
+
+
+def trim_memories(agent: Agent) -> bool:
+    """Свернуть лишние воспоминания в сводку. True — память изменена"""
+    if len(agent.memories) <= MAX_MEMORIES:
+        return False
+    agent.memories.sort(key=lambda m: m.importance)
+    old = agent.memories[:len(agent.memories) - MAX_MEMORIES]
+    summary = Memory(
+        content="[Сводка] " + "; ".join(m.content[:60] for m in old[:5]),
+        importance=0.3,
+        timestamp=now()
+    )
+    agent.memories = [summary] + agent.memories[len(old):]
+    return True
@@ -0,0 +1,255 @@
+"""
+Метрики в текстовом формате Prometheus (GET /metrics) без внешних зависимостей.
+
+Счетчики и гистограммы — обычные словари по кортежу значений меток,
+наблюдение стоит порядка микросекунды (bisect по границам корзин),
+поэтому их можно вызывать на горячих путях:
+- LLM: длительность и ошибки по типу вызова (chat / reflect / dialogue);
+- MongoDB: длительность каждой команды по коллекции (CommandListener
+  драйвера) и число обращений к БД на HTTP-запрос;
+- жизненный цикл: длительность тика, агентов и диалогов за тик;
+- HTTP: длительность по шаблону маршрута, методу и статусу;
+- задержка цикла событий (фоновая задача monitor_event_loop).
+Счетчики из STATS-словарей сервисов (OCC, сброс пакетов, история)
+отдаются как есть при каждом запросе /metrics.
+"""
+import asyncio
+import bisect
+import time
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин в секундах
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LLM_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+EVENT_LOOP_INTERVAL = 0.25
+
+_registry: list = []
+_collectors: list = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name, self.doc, self.labelnames = name, doc, labels
+        self.values: dict[tuple, float] = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.doc, self.labelnames = name, doc, labels
+        self.buckets = tuple(buckets)
+        # labels → [счетчики по корзинам (последняя — +Inf), сумма, количество]
+        self.series: dict[tuple, list] = {}
+        _registry.append(self)
+
+    def observe(self, value: float, *labels):
+        s = self.series.get(labels)
+        if s is None:
+            s = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        s[0][bisect.bisect_left(self.buckets, value)] += 1
+        s[1] += value
+        s[2] += 1
+
+    def time(self, *labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "started")
+
+    def __init__(self, hist: Histogram, labels: tuple):
+        self.hist, self.labels = hist, labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.started, *self.labels)
+
+
+def register_stats(name: str, doc: str, getter):
+    """Словарь счетчиков сервиса — как метрика name{stat="..."} (читается при выдаче)"""
+    _collectors.append((name, doc, getter))
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    for name, doc, getter in _collectors:
+        lines += [f"# HELP {name} {doc}", f"# TYPE {name} gauge"]
+        for stat, value in getter().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'{name}{{stat="{_escape(stat)}"}} {_number(value)}')
+    return "\n".join(lines) + "\n"
+
+
+'''Метрики'''
+
+LLM_LATENCY = Histogram("vw_llm_request_seconds", "Длительность вызова LLM", ("kind", "backend"), LLM_BUCKETS)
+LLM_ERRORS = Counter("vw_llm_errors_total", "Ошибки вызова LLM", ("kind", "backend"))
+
+DB_LATENCY = Histogram("vw_db_command_seconds", "Длительность команды MongoDB", ("collection", "command"))
+DB_ERRORS = Counter("vw_db_command_errors_total", "Ошибки команд MongoDB", ("collection", "command"))
+
+TICK_LATENCY = Histogram("vw_lifecycle_tick_seconds", "Длительность тика жизненного цикла", (),
+                         (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+TICK_AGENTS = Histogram("vw_lifecycle_tick_agents", "Агентов за тик", (), COUNT_BUCKETS)
+TICK_DIALOGUES = Histogram("vw_lifecycle_tick_dialogues", "Диалогов за тик", (), COUNT_BUCKETS)
+
+HTTP_LATENCY = Histogram("vw_http_request_seconds", "Длительность HTTP-запроса", ("method", "route", "status"))
+HTTP_DB_CALLS = Histogram("vw_http_request_db_commands", "Команд MongoDB на HTTP-запрос", ("method", "route"),
+                          COUNT_BUCKETS)
+
+LOOP_LAG = Histogram("vw_event_loop_lag_seconds", "Опоздание пробуждения цикла событий", (),
+                     (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+LOOP_LAG_LAST = Gauge("vw_event_loop_lag_last_seconds", "Последнее измеренное опоздание цикла событий")
+
+
+'''MongoDB'''
+
+# Счетчик команд текущего HTTP-запроса; motor переносит контекст в свои потоки
+_db_calls: ContextVar[list | None] = ContextVar("db_calls", default=None)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Время каждой команды драйвера по коллекции"""
+
+    def __init__(self):
+        self._pending: dict[int, str] = {}
+
+    def started(self, event):
+        cmd = event.command
+        name = event.command_name
+        collection = cmd.get("collection") if name == "getMore" else cmd.get(name)
+        self._pending[event.request_id] = collection if isinstance(collection, str) else "-"
+        calls = _db_calls.get()
+        if calls is not None:
+            calls[0] += 1
+
+    def succeeded(self, event):
+        collection = self._pending.pop(event.request_id, "-")
+        DB_LATENCY.observe(event.duration_micros / 1e6, collection, event.command_name)
+
+    def failed(self, event):
+        collection = self._pending.pop(event.request_id, "-")
+        DB_LATENCY.observe(event.duration_micros / 1e6, collection, event.command_name)
+        DB_ERRORS.inc(collection, event.command_name)
+
+
+'''HTTP'''
+
+# scope текущего запроса: маршрут в нем появляется после роутинга
+_http_scope: ContextVar[dict | None] = ContextVar("http_scope", default=None)
+
+
+def current_route() -> str | None:
+    """Метод и шаблон маршрута текущего HTTP-запроса ("POST /text/chat/{agent_id}")"""
+    scope = _http_scope.get()
+    if scope is None:
+        return None
+    return f'{scope["method"]} {getattr(scope.get("route"), "path", None) or "unmatched"}'
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: длительность запроса по шаблону маршрута (а не по
+    фактическому пути — иначе по метке на каждый id агента)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        calls = [0]
+        token = _db_calls.set(calls)
+        scope_token = _http_scope.set(scope)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _db_calls.reset(token)
+            _http_scope.reset(scope_token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_LATENCY.observe(elapsed, scope["method"], path, str(status[0]))
+            HTTP_DB_CALLS.observe(calls[0], scope["method"], path)
+
+
+'''Цикл событий'''
+
+async def monitor_event_loop(interval: float = EVENT_LOOP_INTERVAL):
+    """Насколько позже запланированного просыпается задача: блокирующий код
+    в цикле событий (синхронный SDK, тяжелые вычисления) виден здесь"""
+    while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - expected)
+        LOOP_LAG.observe(lag)
+        LOOP_LAG_LAST.set(lag)
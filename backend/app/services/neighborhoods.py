@@ -0,0 +1,143 @@
+"""
+Социальные окрестности: ограниченный набор кандидатов для матчмейкинга.
+
+Без индекса кандидаты инициатора — все его отношения (их число растет до
+размера мира) плюс случайные незнакомцы. Индекс хранит для каждого агента
+не больше TIES самых сильных связей (по модулю симпатии) и его сообщество —
+метку, полученную распространением меток по графу отношений (связь тянет
+агента в сообщество собеседника с весом симпатии). Кандидаты тогда — эти
+связи, выборка из своего сообщества и небольшая доля случайных агентов
+всего мира (LifecycleParams.match_mixing_rate), так что подбор цели стоит
+O(k) независимо от размера мира.
+
+Индекс поддерживается инкрементально: новые агенты добавляются при sync,
+ушедшие удаляются, участники диалогов пересчитываются сразу (touch), а
+остальные — по кругу, по REFRESH_PER_TICK за тик (их симпатии медленно
+меняет step_population).
+"""
+import heapq
+import random
+
+from app.models.agent import Agent, Relationship
+
+TIES = 16
+ROUNDS = 3             # итераций распространения меток при первичной сборке
+REFRESH_PER_TICK = 256
+ACQUAINTANCE_WEIGHT = 0.05  # вес любого знакомства (и удержания своей метки)
+
+NEIGHBORHOOD_STATS = {"agents": 0, "communities": 0, "largest": 0, "relabels": 0, "refreshed": 0}
+
+
+class NeighborhoodIndex:
+
+    def __init__(self):
+        self.ties: dict[str, list[Relationship]] = {}
+        self.label: dict[str, str] = {}
+        self.members: dict[str, list[str]] = {}
+        self._pos: dict[str, int] = {}
+        self._cursor = 0
+
+    '''Сообщества'''
+
+    def _join(self, agent_id: str, label: str):
+        members = self.members.setdefault(label, [])
+        self._pos[agent_id] = len(members)
+        members.append(agent_id)
+        self.label[agent_id] = label
+
+    def _leave(self, agent_id: str):
+        label = self.label.pop(agent_id)
+        members = self.members[label]
+        # Удаление за O(1): на место уходящего ставим последнего
+        i = self._pos.pop(agent_id)
+        last = members.pop()
+        if last != agent_id:
+            members[i] = last
+            self._pos[last] = i
+        if not members:
+            del self.members[label]
+
+    def _relabel(self, agent_id: str) -> bool:
+        """Метка, самая весомая среди связей агента. True — метка сменилась"""
+        current = self.label[agent_id]
+        scores = {current: ACQUAINTANCE_WEIGHT}
+        for r in self.ties.get(agent_id, ()):
+            label = self.label.get(r.agent_id)
+            if label is not None:
+                scores[label] = scores.get(label, 0.0) + ACQUAINTANCE_WEIGHT + max(0.0, r.sympathy)
+        best = max(scores, key=lambda label: (scores[label], label == current))
+        if best == current:
+            return False
+        self._leave(agent_id)
+        self._join(agent_id, best)
+        NEIGHBORHOOD_STATS["relabels"] += 1
+        return True
+
+    def _refresh(self, agent: Agent):
+        self.ties[str(agent.id)] = heapq.nlargest(TIES, agent.relationships, key=lambda r: abs(r.sympathy))
+
+    '''Поддержка'''
+
+    def sync(self, agents: list[Agent]):
+        """Привести индекс к составу мира (агенты тика)"""
+        current = {str(a.id): a for a in agents}
+        for gone in [agent_id for agent_id in self.label if agent_id not in current]:
+            self._leave(gone)
+            self.ties.pop(gone, None)
+        new = [a for agent_id, a in current.items() if agent_id not in self.label]
+        for a in new:
+            self._refresh(a)
+            self._join(str(a.id), str(a.id))
+        # Новые агенты — несколько итераций распространения меток (при первой сборке — весь мир)
+        for _ in range(ROUNDS if new else 0):
+            if not any([self._relabel(str(a.id)) for a in new]):
+                break
+
+        # По кругу обновляем связи тех, кто давно не пересчитывался
+        if agents:
+            n = min(REFRESH_PER_TICK, len(agents))
+            for i in range(n):
+                a = agents[(self._cursor + i) % len(agents)]
+                self._refresh(a)
+                self._relabel(str(a.id))
+            self._cursor = (self._cursor + n) % len(agents)
+            NEIGHBORHOOD_STATS["refreshed"] += n
+        NEIGHBORHOOD_STATS["agents"] = len(self.label)
+        NEIGHBORHOOD_STATS["communities"] = len(self.members)
+        NEIGHBORHOOD_STATS["largest"] = max(map(len, self.members.values()), default=0)
+
+    def touch(self, agents):
+        """Отношения агентов изменились (диалог) — пересчитать их связи и сообщество"""
+        for a in agents:
+            if str(a.id) in self.label:
+                self._refresh(a)
+                self._relabel(str(a.id))
+
+    '''Кандидаты'''
+
+    def known(self, agent_id: str) -> list[Relationship]:
+        """Самые сильные связи агента (не больше TIES)"""
+        return self.ties.get(agent_id, [])
+
+    def neighbors(self, agent_id: str, k: int) -> list[str]:
+        """До k случайных агентов из сообщества агента (кроме него самого)"""
+        members = self.members.get(self.label.get(agent_id), [])
+        if len(members) <= 1 or k <= 0:
+            return []
+        sample = random.sample(members, min(k + 1, len(members)))
+        return [m for m in sample if m != agent_id][:k]
+
+
+_index = NeighborhoodIndex()
+
+
+def neighborhood_index() -> NeighborhoodIndex:
+    return _index
+
+
+def reset_index():
+    """Пустой индекс (симуляции): соберется заново на следующем тике"""
+    global _index
+    _index = NeighborhoodIndex()
+    for key in NEIGHBORHOOD_STATS:
+        NEIGHBORHOOD_STATS[key] = 0
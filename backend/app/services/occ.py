@@ -0,0 +1,132 @@
+"""
+Оптимистичная блокировка документов агентов.
+
+У каждого агента есть счетчик revision. Любая запись — условная:
+документ заменяется, только если его revision в БД совпадает с тем,
+что был прочитан, и при этом revision увеличивается на 1. Если кто-то
+успел записать раньше, запись не проходит (конфликт), и изменение
+применяется заново поверх свежей версии:
+
+- mutate_agent — для коротких изменений (PATCH настроения, памяти и т.п.):
+  перечитать агента и повторить функцию-мутацию;
+- merge_documents — для долгих шагов с вызовами LLM (тик, диалоги), которые
+  нельзя просто повторить: трехстороннее слияние base → mine / theirs,
+  его использует WriteBatch.
+"""
+import asyncio
+import random
+
+from app.db.repository import agent_repo
+from app.models.agent import Agent
+from app.services.agent_history import record_writes
+
+MAX_RETRIES = 5
+
+# Метрики конфликтов
+OCC_STATS = {"writes": 0, "conflicts": 0, "retries": 0, "merges": 0, "failures": 0}
+
+
+class ConcurrentModificationError(Exception):
+    """Агента не удалось записать: слишком много конкурентных изменений подряд"""
+
+
+def conflict_rate() -> float:
+    writes = OCC_STATS["writes"]
+    return round(OCC_STATS["conflicts"] / writes, 4) if writes else 0.0
+
+
+def agent_document(agent: Agent) -> dict:
+    """Документ агента для записи в Mongo (без _id)"""
+    return agent.model_dump(exclude={"id", "revision_id"})
+
+
+async def save_agent(agent: Agent, base: dict = None) -> bool:
+    """Условная запись одного агента. False — конфликт (или агент удален).
+    base — прочитанный документ: по разнице с ним пишется история агента"""
+    doc = agent_document(agent)
+    doc["revision"] = agent.revision + 1
+    OCC_STATS["writes"] += 1
+    if await agent_repo().replace_if_revision(agent, doc):
+        agent.revision += 1
+        if base is not None:
+            await record_writes([(str(agent.id), base, doc)])
+        return True
+    OCC_STATS["conflicts"] += 1
+    return False
+
+
+async def mutate_agent(agent_id: str, fn, retries: int = MAX_RETRIES) -> Agent | None:
+    """Прочитать агента, применить fn(agent) и записать с проверкой ревизии.
+    При конфликте агент перечитывается и fn применяется заново.
+    Возвращает записанного агента или None, если агента нет."""
+    for attempt in range(retries + 1):
+        agent = await agent_repo().get(agent_id)
+        if agent is None:
+            return None
+        base = agent_document(agent)
+        result = fn(agent)
+        if asyncio.iscoroutine(result):
+            await result
+        if await save_agent(agent, base):
+            return agent
+        OCC_STATS["retries"] += 1
+        # Небольшая случайная пауза, чтобы конкуренты не сталкивались снова
+        await asyncio.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+    OCC_STATS["failures"] += 1
+    raise ConcurrentModificationError(f"Агент {agent_id} изменяется слишком часто, повторите запрос")
+
+
+# Дробные поля со знаком; остальные дроби агента лежат в [0, 1]
+SIGNED_FIELDS = {"sympathy"}
+
+
+def _clamp(value: float, field: str | None) -> float:
+    low = -1.0 if field in SIGNED_FIELDS else 0.0
+    return max(low, min(1.0, value))
+
+
+def merge_documents(base, mine, theirs, field: str = None):
+    """Трехстороннее слияние: base — прочитанная версия, mine — наша,
+    theirs — записанная конкурентом. Меняем только то, что меняли мы:
+    - дроби (эмоции, симпатия) складываются как приращения и обрезаются
+      по диапазону поля (field — имя поля в документе);
+    - словари сливаются по ключам;
+    - списки отношений — по agent_id, прочие списки (память) — как
+      множества добавленных/удаленных элементов;
+    - в остальных полях побеждает наша запись."""
+    if mine == base:
+        return theirs
+    if theirs == base:
+        return mine
+    if isinstance(mine, float) and isinstance(theirs, float) and isinstance(base, float):
+        return _clamp(theirs + (mine - base), field)
+    if isinstance(mine, dict) and isinstance(theirs, dict):
+        base = base if isinstance(base, dict) else {}
+        merged = {}
+        for key in list(theirs) + [k for k in mine if k not in theirs]:
+            if key in mine and key not in theirs and key in base:
+                continue  # удалено конкурентом
+            if key in theirs and key not in mine and key in base:
+                continue  # удалено нами
+            merged[key] = merge_documents(base.get(key), mine.get(key), theirs.get(key), key)
+        return merged
+    if isinstance(mine, list) and isinstance(theirs, list):
+        base = base if isinstance(base, list) else []
+        if all(isinstance(x, dict) and "agent_id" in x for x in base + mine + theirs):
+            return _merge_keyed(base, mine, theirs)
+        removed = [x for x in base if x not in mine]
+        added = [x for x in mine if x not in base and x not in theirs]
+        return [x for x in theirs if x not in removed] + added
+    return mine
+
+
+def _merge_keyed(base: list, mine: list, theirs: list) -> list:
+    b = {x["agent_id"]: x for x in base}
+    m = {x["agent_id"]: x for x in mine}
+    t = {x["agent_id"]: x for x in theirs}
+    merged = []
+    for key in list(t) + [k for k in m if k not in t]:
+        if key in b and (key not in m or key not in t):
+            continue  # отношение удалено одной из сторон
+        merged.append(merge_documents(b.get(key), m.get(key), t.get(key)))
+    return merged
@@ -0,0 +1,145 @@
+"""
+Офлайн-бэкенд LLM — ответы без обращения к GigaChat.
+Нужен для headless-симуляций и бенчмарков (LLM_BACKEND=offline):
+тексты подобраны так, чтобы срабатывали те же эвристики настроения,
+целей и отношений, что и на живых ответах. Случайность берется из
+модуля random, поэтому при фиксированном seed результат воспроизводим.
+"""
+import json
+import random
+
+from app.models.agent import Agent, Mood
+
+
+POSITIVE = [
+    "Я рад тебя видеть, всё отлично!",
+    "Спасибо, мне правда приятно с тобой общаться.",
+    "Мне кажется, у нас всё хорошо, и это замечательно.",
+    "Я думаю, ты настоящий друг, спасибо за помощь.",
+]
+EXCITED = [
+    "Это просто восторг, я так взволнован!",
+    "Классно! Мне очень интересно, что будет дальше!",
+    "Супер, я чувствую столько энергии!",
+]
+NEGATIVE = [
+    "Мне грустно, и всё как-то плохо.",
+    "Честно, мне скучно и неприятно.",
+    "Не знаю... мне не нравится, как всё идёт.",
+]
+OFFENDED = [
+    "Мне обидно, ты поступил несправедливо.",
+    "Я разочарован, это было нечестно.",
+    "Я расстроен, мне казалось, ты меня понимаешь.",
+]
+AGGRESSIVE = [
+    "Ты меня бесит, отстань уже!",
+    "Ты меня достал, уйди.",
+    "Меня раздражает всё, что ты говоришь.",
+]
+NEUTRAL = [
+    "Я думаю, стоит об этом поговорить подробнее.",
+    "Мне кажется, сегодня обычный день.",
+    "Не уверен, что ты имеешь в виду.",
+]
+GOALS = [
+    "я хочу исследовать окрестности и найти что-то новое",
+    "я хочу наладить отношения с соседями",
+    "я планирую закончить свой проект до вечера",
+    "я хочу помириться с теми, с кем поссорился",
+    "я собираюсь больше общаться с друзьями",
+]
+REFLECTION_MOODS = {
+    Mood.HAPPY: "мне радостно, всё хорошо",
+    Mood.EXCITED: "я взволнован, всё очень интересно",
+    Mood.SAD: "мне грустно и немного тоскливо",
+    Mood.ANGRY: "я злой и раздражен",
+    Mood.ANXIOUS: "я тревожусь и переживаю",
+    Mood.BORED: "мне скучно, всё монотонно",
+    Mood.NEUTRAL: "спокойно",
+}
+
+AGGRESSIVE_INPUT = ['ненавижу', 'презираю', 'злой', 'тупой', 'идиот', 'дурак', 'заткнись', 'уйди', 'отстань', 'бесит']
+OFFENSIVE_INPUT = ['обидел', 'несправедливо', 'предал', 'обманул', 'плохо']
+
+
+def _pick_pool(agent: Agent, sympathy: float = 0.0) -> list[str]:
+    """Выбирает тон ответа по настроению, отношениям и личности"""
+    mood = agent.emotion.mood
+    agreeableness = agent.personality.agreeableness
+    r = random.random()
+    if sympathy < -0.3 or mood == Mood.ANGRY:
+        return AGGRESSIVE if r < 0.6 - agreeableness * 0.3 else OFFENDED if r < 0.8 else NEUTRAL
+    if mood in (Mood.SAD, Mood.ANXIOUS):
+        return OFFENDED if r < 0.3 else NEGATIVE if r < 0.7 else NEUTRAL
+    if mood == Mood.EXCITED:
+        return EXCITED if r < 0.6 else POSITIVE
+    if sympathy > 0.3 or mood == Mood.HAPPY:
+        return POSITIVE if r < 0.7 else EXCITED if r < 0.85 else NEUTRAL
+    if mood == Mood.BORED:
+        return NEGATIVE if r < 0.5 else NEUTRAL
+    # Нейтральный агент: доброжелательность смещает тон в позитив
+    if r < 0.3 + agreeableness * 0.3:
+        return POSITIVE
+    if r < 0.85:
+        return NEUTRAL
+    return NEGATIVE if r < 0.95 else AGGRESSIVE
+
+
+def _reflection(agent: Agent) -> str:
+    mood = agent.emotion.mood
+    # Иногда настроение меняется само по себе
+    if random.random() < 0.3:
+        mood = random.choice(list(REFLECTION_MOODS))
+    return (
+        f"МЫСЛИ: я думаю о том, что происходило в последнее время.\n"
+        f"НАСТРОЕНИЕ: {REFLECTION_MOODS[mood]}\n"
+        f"ЦЕЛЬ: {random.choice(GOALS)}"
+    )
+
+
+def _thought(agent: Agent, target: Agent, context: str) -> str:
+    mood = agent.emotion.mood
+    if random.random() < 0.3:
+        mood = random.choice(list(REFLECTION_MOODS))
+    return json.dumps({
+        "thought": f"Я думаю о том, что происходило в последнее время: {REFLECTION_MOODS[mood]}.",
+        "mood": mood.value,
+        "goal": random.choice(GOALS),
+        "talk": True,
+        "utterance": complete("dialogue", agent, target, context),
+    }, ensure_ascii=False)
+
+
+def complete(kind: str, agent: Agent, target: Agent = None, message: str = "") -> str:
+    """Ответ офлайн-бэкенда для вызова kind (chat / reflect / dialogue / think)"""
+    if kind == "reflect":
+        return _reflection(agent)
+
+    if kind == "think":
+        return _thought(agent, target, message)
+
+    if kind == "chat":
+        message_lower = message.lower()
+        if any(word in message_lower for word in AGGRESSIVE_INPUT):
+            return random.choice(AGGRESSIVE)
+        if any(word in message_lower for word in OFFENSIVE_INPUT):
+            return random.choice(OFFENDED)
+        return random.choice(_pick_pool(agent))
+
+    # Конфликтный контекст из жизненного цикла ("ты обиделся", "ты разозлился"...)
+    context_lower = message.lower()
+    if any(word in context_lower for word in ['обид', 'разозл', 'недовол', 'раздраж']) and random.random() < 0.7:
+        return random.choice(OFFENDED + AGGRESSIVE)
+
+    sympathy = 0.0
+    if target is not None:
+        rel = next((r for r in agent.relationships if r.agent_id == str(target.id)), None)
+        sympathy = rel.sympathy if rel else 0.0
+    return random.choice(_pick_pool(agent, sympathy))
+
+
+def complete_batch(turns: list[tuple[Agent, Agent, str]]) -> str:
+    """Ответ на пакетный запрос диалогов: JSON-массив реплик, как просит промпт"""
+    return json.dumps([{"id": i, "reply": complete("dialogue", agent, target, context)}
+                       for i, (agent, target, context) in enumerate(turns, 1)], ensure_ascii=False)
@@ -0,0 +1,130 @@
+"""
+Быстрый путь JSON-ответов.
+
+Горячие GET-эндпоинты (списки агентов, лента, события, лог) не копируют
+уже проверенные документы в модели ответа: они отдают словари полей
+(agent_fields, event_fields, log_fields) в FastJSONResponse, и FastAPI не
+валидирует их повторно по response_model (он остается для схемы OpenAPI).
+FastJSONResponse сериализует через orjson, вложенные модели (отношения,
+воспоминания, эмоции) — поверхностно, без model_dump; без orjson — через
+json без пробелов.
+
+CompressionMiddleware сжимает большие ответы целиком (не потоковые) по
+Accept-Encoding: brotli (если установлен), иначе gzip. Потоковые ответы
+(NDJSON экспорта, трансляции) идут как есть — сжатие задержало бы строки.
+"""
+import gzip
+import json
+from datetime import date, datetime
+from enum import Enum
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+COMPRESSIBLE = ("application/json", "text/", "application/x-ndjson")
+
+
+def _default(value):
+    if isinstance(value, BaseModel):
+        return value.__dict__  # поля модели как есть (без копии), вложенные — тем же путем
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Не сериализуется в JSON: {type(value).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+
+    def render(self, content) -> bytes:
+        if isinstance(content, BaseModel):
+            content = content.__dict__
+        if orjson is not None:
+            return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode()
+
+
+def negotiate(accept_encoding: str) -> str | None:
+    """Кодировка сжатия по Accept-Encoding: br, gzip или None"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """Сжатие целых ответов от COMPRESS_MIN_SIZE байт"""
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message  # заголовки — после решения о сжатии
+                return
+            if start is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            head, start = start, None
+            headers = MutableHeaders(raw=head["headers"])
+            body = message.get("body", b"")
+            if (message.get("more_body") or "content-encoding" in headers or len(body) < self.minimum_size
+                    or not headers.get("content-type", "").startswith(COMPRESSIBLE)):
+                await send(head)
+                await send(message)
+                return
+            data = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(data))
+            headers.add_vary_header("Accept-Encoding")
+            await send(head)
+            await send({"type": "http.response.body", "body": data})
+
+        await self.app(scope, receive, send_compressed)
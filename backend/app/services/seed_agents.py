@@ -1,21 +1,26 @@
 """
 Скрипт для создания базовых агентов при первом запуске
 """
-from app.models.agent import Agent, Mood
+import logging
+
+from app.db.repository import agent_repo
+from app.models.agent import Mood
 from app.services.builder import AgentBuilder
 
+logger = logging.getLogger(__name__)
+
 
 async def seed_initial_agents():
     """Создает базовых агентов, если их еще нет"""
     try:
-        existing_count = await Agent.count()
-        print(f"[SEED] Проверка агентов: найдено {existing_count}")
+        existing_count = await agent_repo().count()
+        logger.debug("Проверка агентов: найдено %d", existing_count)
         
         if existing_count > 0:
-            print(f"[SEED] Найдено {existing_count} агентов. Пропускаем создание базовых агентов.")
+            logger.info("Найдено %d агентов. Пропускаем создание базовых агентов.", existing_count)
             return
         
-        print("[SEED] Создание базовых агентов...")
+        logger.info("Создание базовых агентов...")
         
         # Агент 1: Алекс - исследователь
         alex = (AgentBuilder()
@@ -26,8 +31,6 @@ async def seed_initial_agents():
             .set_mood(Mood.HAPPY, energy=0.8, stress=0.2, happiness=0.6)
             .set_system_prompt("Ты любознательный и энергичный исследователь. Ты всегда ищешь что-то новое и интересное.")
             .build())
-        await alex.insert()
-        print(f"[SEED] Создан агент: {alex.name}")
         
         # Агент 2: Мария - художник
         maria = (AgentBuilder()
@@ -38,8 +41,6 @@ async def seed_initial_agents():
             .set_mood(Mood.EXCITED, energy=0.7, stress=0.3, happiness=0.65)
             .set_system_prompt("Ты творческая и эмпатичная художница. Ты видишь красоту в простых вещах и выражаешь эмоции через искусство.")
             .build())
-        await maria.insert()
-        print(f"[SEED] Создан агент: {maria.name}")
         
         # Агент 3: Роберт - ученый
         robert = (AgentBuilder()
@@ -50,11 +51,10 @@ async def seed_initial_agents():
             .set_mood(Mood.NEUTRAL, energy=0.6, stress=0.2, happiness=0.5)
             .set_system_prompt("Ты логичный и методичный ученый. Ты анализируешь все вокруг и ищешь закономерности.")
             .build())
-        await robert.insert()
-        print(f"[SEED] Создан агент: {robert.name}")
         
-        print(f"[SEED] ✓ Успешно создано 3 базовых агента!")
+        # Одной пакетной вставкой, а не запросом на агента
+        seed = [alex, maria, robert]
+        await agent_repo().insert_many(seed)
+        logger.info("Создано %d базовых агента: %s", len(seed), ", ".join(a.name for a in seed))
     except Exception as e:
-        print(f"[SEED] ОШИБКА при создании базовых агентов: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Ошибка при создании базовых агентов: %s", e)
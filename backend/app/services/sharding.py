@@ -0,0 +1,188 @@
+"""
+Шардирование жизненного цикла между процессами-воркерами.
+
+Агенты раскладываются по фиксированному числу партиций хешем id.
+Партиции распределяются между живыми воркерами rendezvous-хешированием
+(при уходе или появлении воркера переезжает только его доля партиций),
+а владение закрепляется арендами в коллекции leases:
+
+- каждый воркер продлевает свою аренду членства "worker:<id>";
+- по списку живых воркеров он вычисляет свои партиции и захватывает их
+  аренды — только свободные или просроченные (упавший воркер перестает
+  продлевать аренды, и после истечения TTL их забирают другие);
+- партиции, которые по хешу теперь принадлежат другому воркеру,
+  отпускаются, чтобы новый владелец мог их подхватить.
+
+Время аренд — реальное (datetime.utcnow), а не мировые часы симуляции.
+
+Уникальный индекс по leases.key — часть протокола: без него upsert двух
+воркеров создал бы две аренды одного ключа. Поэтому LeaseManager создает
+его сам при первом продлении, даже если при подключении сверка индексов
+отключена (DB_SKIP_INDEX_CHECKS=1).
+
+Рядом с арендами (коллекция world_settings) лежит скорость времени мира:
+ее меняет API, а воркеры перечитывают перед каждым тиком. Там же — общее
+ведро бюджета LLM (app.services.llm_budget).
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.db.repository import get_storage
+from app.models.lease import Lease
+from app.services.world_state import get_time_speed, set_time_speed
+
+logger = logging.getLogger(__name__)
+
+NUM_PARTITIONS = int(os.getenv("LIFECYCLE_PARTITIONS", "16"))
+LEASE_TTL = float(os.getenv("LIFECYCLE_LEASE_TTL", "30"))
+HEARTBEAT_INTERVAL = LEASE_TTL / 3
+TIME_SPEED_ID = "time_speed"
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+def partition_of(agent_id) -> int:
+    """Партиция агента (стабильна между процессами, в отличие от hash())"""
+    return _hash(str(agent_id)) % NUM_PARTITIONS
+
+
+def partition_owner(partition: int, workers: list[str]) -> str:
+    """Rendezvous-хеширование: воркер с максимальным весом для партиции"""
+    return max(workers, key=lambda w: _hash(f"{w}/{partition}"))
+
+
+class LeaseManager:
+
+    def __init__(self, worker_id: str = WORKER_ID):
+        self.worker_id = worker_id
+        self.owned: set[int] = set()
+        self._indexed = False
+
+    def _collection(self):
+        return Lease.get_motor_collection()
+
+    async def _ensure_index(self):
+        if not self._indexed:
+            await self._collection().create_index("key", unique=True)
+            self._indexed = True
+
+    async def _acquire(self, key: str, now: datetime) -> bool:
+        """Захватить или продлить аренду: только свою или просроченную"""
+        try:
+            doc = await self._collection().find_one_and_update(
+                {"key": key, "$or": [{"owner": self.worker_id}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.worker_id, "expires_at": now + timedelta(seconds=LEASE_TTL),
+                          "heartbeat_at": now}},
+                upsert=True, return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Ключ существует и принадлежит живому воркеру
+            return False
+        return doc is not None and doc["owner"] == self.worker_id
+
+    async def live_workers(self, now: datetime) -> list[str]:
+        cursor = self._collection().find({"key": {"$regex": "^worker:"}, "expires_at": {"$gte": now}},
+                                         {"owner": 1})
+        return sorted({doc["owner"] async for doc in cursor})
+
+    async def refresh(self) -> set[int]:
+        """Heartbeat и перебалансировка. Возвращает множество своих партиций"""
+        await self._ensure_index()
+        now = datetime.utcnow()
+        await self._acquire(f"worker:{self.worker_id}", now)
+        workers = await self.live_workers(now) or [self.worker_id]
+        if self.worker_id not in workers:
+            workers.append(self.worker_id)
+
+        wanted = {p for p in range(NUM_PARTITIONS) if partition_owner(p, workers) == self.worker_id}
+        owned = set()
+        for p in sorted(wanted):
+            if await self._acquire(f"partition:{p}", now):
+                owned.add(p)
+        released = self.owned - wanted
+        if released:
+            await self._collection().delete_many(
+                {"key": {"$in": [f"partition:{p}" for p in released]}, "owner": self.worker_id})
+        if owned != self.owned:
+            logger.info("%s: партиции %s из %d, воркеров %d", self.worker_id, sorted(owned), NUM_PARTITIONS, len(workers))
+        self.owned = owned
+        return owned
+
+    async def release_all(self):
+        """Отпустить все аренды при штатной остановке"""
+        await self._collection().delete_many({"owner": self.worker_id})
+        self.owned = set()
+
+    async def run_heartbeat(self):
+        """Фоновое продление аренд (независимо от длины тика)"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error("Ошибка продления аренд: %s", e)
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+class LocalLeaseManager:
+    """Один процесс владеет всеми партициями (встроенное хранилище)"""
+
+    def __init__(self, worker_id: str = WORKER_ID):
+        self.worker_id = worker_id
+        self.owned: set[int] = set(range(NUM_PARTITIONS))
+
+    async def refresh(self) -> set[int]:
+        return self.owned
+
+    async def release_all(self):
+        pass
+
+    async def run_heartbeat(self):
+        pass
+
+
+def lease_manager() -> LeaseManager | LocalLeaseManager:
+    """Аренды в MongoDB или локальное владение для встроенного хранилища"""
+    if get_storage().name == "mongo":
+        return LeaseManager()
+    return LocalLeaseManager()
+
+
+def settings_collection():
+    return Lease.get_motor_collection().database["world_settings"]
+
+
+async def publish_time_speed(speed: float) -> float:
+    """Установить скорость времени для всех процессов с общей MongoDB"""
+    set_time_speed(speed)
+    if get_storage().name == "mongo":
+        await settings_collection().update_one({"_id": TIME_SPEED_ID}, {"$set": {"value": get_time_speed()}}, upsert=True)
+    return get_time_speed()
+
+
+async def sync_time_speed() -> float:
+    """Скорость времени из общего хранилища, если ее там задавали (перед каждым тиком)"""
+    if get_storage().name == "mongo":
+        doc = await settings_collection().find_one({"_id": TIME_SPEED_ID})
+        if doc:
+            set_time_speed(doc["value"])
+    return get_time_speed()
+
+
+async def lease_table() -> list[dict]:
+    """Текущие аренды (для диагностики)"""
+    if get_storage().name != "mongo":
+        return [{"key": "partition:*", "owner": WORKER_ID, "expires_at": None, "heartbeat_at": None}]
+    return [{"key": l.key, "owner": l.owner, "expires_at": l.expires_at, "heartbeat_at": l.heartbeat_at}
+            for l in await Lease.find_all().sort("+key").to_list()]
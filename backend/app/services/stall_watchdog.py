@@ -0,0 +1,177 @@
+"""
+Сторож цикла событий: находит блокирующие вызовы в async-коде.
+
+Отдельный поток каждые CHECK_INTERVAL секунд ставит в цикл событий пустой
+колбэк (call_soon_threadsafe) и ждет его выполнения. Не выполнился за
+порог — цикл занят синхронным кодом (клиент LLM, print в обернутый stdout,
+тяжелые вычисления). Тогда поток снимает стек потока цикла
+(sys._current_frames) прямо во время зависания и запоминает текущую
+задачу asyncio. Виновник (culprit) — самый глубокий кадр из кода
+приложения.
+
+Когда цикл освобождается, зависание с полной длительностью попадает в
+STALLS (GET /system/debug/stalls), в STALL_STATS (/metrics) и в журнал
+(WARNING, категория system). monitor_event_loop из app.services.metrics
+лишь измеряет опоздание; здесь — кто его вызвал.
+
+В тестах:
+    with capture_stalls() as stalls:
+        await handler()
+    assert not stalls
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from app.db.repository import log_repo
+from app.models.log import LogCategory, LogLevel
+from app.services.builder import LogBuilder
+
+STALL_THRESHOLD_MS = float(os.getenv("STALL_THRESHOLD_MS", "100"))
+WATCHDOG_ENABLED = os.getenv("STALL_WATCHDOG", "1") != "0"
+CHECK_INTERVAL = 0.05
+STALL_HISTORY = 100
+STACK_DEPTH = 40
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STALLS: deque = deque(maxlen=STALL_HISTORY)
+STALL_STATS = {"stalls": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0,
+               "threshold_ms": STALL_THRESHOLD_MS}
+
+logger = logging.getLogger(__name__)
+
+_state = {"thread": None, "stop": None, "log": True, "threshold": 0.0}
+_listeners: list[list] = []
+
+
+'''Снятие стека'''
+
+def _frame_line(f: traceback.FrameSummary) -> str:
+    path = os.path.relpath(f.filename, os.path.dirname(APP_ROOT)) if f.filename.startswith(APP_ROOT) else f.filename
+    return f"{path}:{f.lineno} in {f.name}" + (f": {f.line}" if f.line else "")
+
+
+def _capture(loop: asyncio.AbstractEventLoop, thread_id: int) -> dict:
+    frame = sys._current_frames().get(thread_id)
+    stack = traceback.extract_stack(frame, limit=STACK_DEPTH) if frame is not None else []
+    del frame
+    culprit = next((f for f in reversed(stack) if f.filename.startswith(APP_ROOT)), None)
+    task = None
+    try:
+        task = asyncio.current_task(loop)
+    except RuntimeError:
+        pass
+    coro = task.get_coro() if task is not None else None
+    return {
+        "started_at": datetime.utcnow().isoformat(),
+        "duration_ms": 0.0,
+        "task": task.get_name() if task is not None else None,
+        "coroutine": getattr(coro, "__qualname__", None),
+        "culprit": _frame_line(culprit) if culprit else (_frame_line(stack[-1]) if stack else None),
+        "stack": [_frame_line(f) for f in stack],
+    }
+
+
+'''Поток-сторож'''
+
+def _watch(loop: asyncio.AbstractEventLoop, thread_id: int, stop: threading.Event, threshold: float):
+    while not stop.is_set():
+        done = threading.Event()
+        sent = time.perf_counter()
+        try:
+            loop.call_soon_threadsafe(done.set)
+        except RuntimeError:
+            return  # цикл закрыт
+        if not done.wait(threshold):
+            stall = _capture(loop, thread_id)
+            # При остановке зависание пишется с длительностью на этот момент
+            while not done.wait(CHECK_INTERVAL) and not stop.is_set():
+                pass
+            stall["duration_ms"] = round((time.perf_counter() - sent) * 1000, 1)
+            _record(loop, stall)
+        stop.wait(CHECK_INTERVAL)
+
+
+def _record(loop: asyncio.AbstractEventLoop, stall: dict):
+    ms = stall["duration_ms"]
+    STALL_STATS["stalls"] += 1
+    STALL_STATS["last_ms"] = ms
+    STALL_STATS["max_ms"] = max(STALL_STATS["max_ms"], ms)
+    STALL_STATS["total_ms"] = round(STALL_STATS["total_ms"] + ms, 1)
+    STALLS.append(stall)
+    for found in list(_listeners):
+        found.append(stall)
+    logger.warning("Цикл событий заблокирован на %.1f мс: %s", ms, stall["culprit"],
+                   extra={"task": stall["task"], "coroutine": stall["coroutine"]})
+    if _state["log"]:
+        try:
+            loop.call_soon_threadsafe(_log_stall, stall)
+        except RuntimeError:
+            pass
+
+
+def _log_stall(stall: dict):
+    log = (LogBuilder().level(LogLevel.WARNING).category(LogCategory.SYSTEM)
+           .message(f"Цикл событий заблокирован на {stall['duration_ms']} мс: {stall['culprit']}")
+           .detail("task", stall["task"]).detail("coroutine", stall["coroutine"])
+           .detail("stack", stall["stack"][-10:]).build())
+    asyncio.ensure_future(_insert_log(log))
+
+
+async def _insert_log(log):
+    try:
+        await log_repo().insert(log)
+    except Exception as e:
+        logger.error("Не удалось записать в журнал: %s", e)
+
+
+def start(threshold_ms: float = None, log: bool = True) -> bool:
+    """Запустить сторож для текущего цикла событий (вызывать из async-кода).
+    False — уже запущен"""
+    if _state["thread"] is not None:
+        return False
+    loop = asyncio.get_running_loop()
+    threshold = (threshold_ms if threshold_ms is not None else STALL_THRESHOLD_MS) / 1000
+    STALL_STATS["threshold_ms"] = threshold * 1000
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_watch, args=(loop, threading.get_ident(), stop_event, threshold),
+                              name="stall-watchdog", daemon=True)
+    _state.update(thread=thread, stop=stop_event, log=log, threshold=threshold)
+    thread.start()
+    return True
+
+
+def stop():
+    thread, event = _state["thread"], _state["stop"]
+    if thread is None:
+        return
+    event.set()
+    thread.join(timeout=_state["threshold"] + 1.0)
+    _state.update(thread=None, stop=None)
+
+
+def recent_stalls(limit: int = STALL_HISTORY) -> list[dict]:
+    """Последние зависания, новые первыми"""
+    return list(reversed(STALLS))[:limit]
+
+
+@contextmanager
+def capture_stalls(threshold_ms: float = None):
+    """Зависания, случившиеся внутри блока (сторож запускается, если не запущен)"""
+    started = start(threshold_ms, log=False)
+    found: list[dict] = []
+    _listeners.append(found)
+    try:
+        yield found
+    finally:
+        if started:
+            stop()  # дописывает зависание, еще идущее на выходе из блока
+        _listeners.remove(found)
@@ -0,0 +1,169 @@
+"""
+Снимки мира: сохранение, форк и восстановление.
+
+Снимок — один файл gzip с NDJSON:
+    {"type": "header", "version": 1, "world_time": ..., "params": {...}, ...}
+    {"type": "agent", "doc": {...}}     # агент целиком: отношения, память
+    {"type": "event", "doc": {...}}     # последние события, от новых к старым
+    {"type": "end", "agents": N, "events": M}
+
+Запись и чтение идут порциями по CHUNK строк: мир целиком в памяти не
+собирается ни при сохранении, ни при восстановлении. Сжатие и файловый
+ввод-вывод вынесены в поток, чтобы не блокировать цикл событий.
+
+Снимок не атомарный: агенты, измененные во время обхода, попадут в него
+в той версии, которую успел прочитать курсор. Для форка это не важно.
+
+Восстановление пишет в текущее хранилище (get_storage()) пакетами
+insert_many, с сохранением идентификаторов — ссылки отношений остаются
+валидными. Форк для A/B-экспериментов: один снимок, восстановленный в
+две разные базы (python -m app.snapshot restore ... --db fork_a / fork_b).
+"""
+import asyncio
+import gzip
+import itertools
+import json
+import os
+import time
+from datetime import datetime
+
+from app.db.repository import agent_repo, event_repo, get_storage
+from app.models.agent import Agent
+from app.models.event import Event
+from app.services import world_state
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_EXT = ".ndjson.gz"
+FORMAT_VERSION = 1
+CHUNK = 500
+DEFAULT_EVENTS = 10000
+
+
+def _line(record: dict) -> bytes:
+    return json.dumps(record, ensure_ascii=False).encode() + b"\n"
+
+
+def snapshot_path(name: str) -> str:
+    """Путь к снимку в SNAPSHOT_DIR по имени (без каталогов)"""
+    if not name or os.path.basename(name) != name or name.startswith("."):
+        raise ValueError(f"Недопустимое имя снимка: {name!r}")
+    if not name.endswith(SNAPSHOT_EXT):
+        name += SNAPSHOT_EXT
+    return os.path.join(SNAPSHOT_DIR, name)
+
+
+def list_snapshots() -> list[dict]:
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    result = []
+    for name in sorted(os.listdir(SNAPSHOT_DIR)):
+        if name.endswith(SNAPSHOT_EXT):
+            st = os.stat(os.path.join(SNAPSHOT_DIR, name))
+            result.append({"name": name, "bytes": st.st_size,
+                           "modified_at": datetime.utcfromtimestamp(st.st_mtime)})
+    return result
+
+
+async def save_snapshot(path: str, events: int = DEFAULT_EVENTS) -> dict:
+    """Записать мир в path. events — сколько последних событий взять (0 — все)"""
+    started = time.perf_counter()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    counts = {"agents": 0, "events": 0}
+    f = await asyncio.to_thread(gzip.open, tmp, "wb", 6)
+    try:
+        header = {
+            "type": "header", "version": FORMAT_VERSION,
+            "created_at": datetime.utcnow().isoformat(),
+            "world_time": world_state.now().isoformat(),
+            "time_speed": world_state.get_time_speed(),
+            "storage": get_storage().name,
+            "params": world_state.get_params().model_dump(),
+            "events_limit": events,
+        }
+        buf = [_line(header)]
+
+        async def emit(kind: str, doc: dict):
+            buf.append(_line({"type": kind, "doc": doc}))
+            counts[kind + "s"] += 1
+            if len(buf) >= CHUNK:
+                data = b"".join(buf)
+                buf.clear()
+                await asyncio.to_thread(f.write, data)
+
+        async for agent in agent_repo().iter_all(CHUNK):
+            await emit("agent", agent.model_dump(mode="json", by_alias=True, exclude={"revision_id"}))
+        async for event in event_repo().iter_recent(events, CHUNK):
+            await emit("event", event.model_dump(mode="json", by_alias=True, exclude={"revision_id"}))
+        buf.append(_line({"type": "end", **counts}))
+        await asyncio.to_thread(f.write, b"".join(buf))
+    finally:
+        await asyncio.to_thread(f.close)
+    os.replace(tmp, path)
+    return {"path": path, **counts, "bytes": os.path.getsize(path),
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+async def _read_chunks(path: str):
+    """Строки снимка порциями по CHUNK"""
+    f = await asyncio.to_thread(gzip.open, path, "rb")
+    try:
+        while True:
+            lines = await asyncio.to_thread(lambda: list(itertools.islice(f, CHUNK)))
+            if not lines:
+                return
+            yield [json.loads(line) for line in lines if line.strip()]
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+def _first_line(path: str) -> bytes:
+    with gzip.open(path, "rb") as f:
+        return f.readline()
+
+
+async def read_header(path: str) -> dict:
+    try:
+        header = json.loads(await asyncio.to_thread(_first_line, path) or b"{}")
+    except (OSError, ValueError) as e:
+        raise ValueError(f"{path}: не удалось прочитать снимок: {e}")
+    if header.get("type") != "header":
+        raise ValueError(f"{path}: не снимок мира (нет заголовка)")
+    if header.get("version") != FORMAT_VERSION:
+        raise ValueError(f"{path}: неподдерживаемая версия снимка {header.get('version')}")
+    return header
+
+
+async def restore_snapshot(path: str, replace: bool = False) -> dict:
+    """Загрузить снимок в текущее хранилище. Непустое хранилище
+    перезаписывается только при replace=True"""
+    started = time.perf_counter()
+    header = await read_header(path)
+    storage = get_storage()
+    if await storage.agents.count():
+        if not replace:
+            raise ValueError("Хранилище не пустое: восстанавливайте в новую базу или с replace")
+        await storage.agents.delete_all()
+        await storage.events.delete_all()
+
+    counts = {"agents": 0, "events": 0}
+    footer = None
+    async with storage.bulk_load():
+        async for records in _read_chunks(path):
+            agents, events = [], []
+            for rec in records:
+                kind = rec.get("type")
+                if kind == "agent":
+                    agents.append(Agent.model_validate(rec["doc"]))
+                elif kind == "event":
+                    events.append(Event.model_validate(rec["doc"]))
+                elif kind == "end":
+                    footer = rec
+            await storage.agents.insert_many(agents)
+            await storage.events.insert_many(events)
+            counts["agents"] += len(agents)
+            counts["events"] += len(events)
+    if footer is None or footer.get("agents") != counts["agents"] or footer.get("events") != counts["events"]:
+        raise ValueError(f"{path}: снимок обрезан или поврежден, загружено {counts}")
+    return {"path": path, **counts, "world_time": header["world_time"],
+            "seconds": round(time.perf_counter() - started, 3)}
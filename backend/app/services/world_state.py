@@ -2,10 +2,22 @@
 Глобальное состояние мира (скорость времени и т.д.)
 """
 import asyncio
+import os
+from datetime import datetime, timedelta
+from pydantic import BaseModel
 
 # Глобальная скорость времени (умножается на интервалы)
 TIME_SPEED = 1.0
 
+# Сдвиг мировых часов относительно реального времени.
+# Headless-симуляция двигает часы вперед сама, не дожидаясь реальных секунд.
+CLOCK_OFFSET = timedelta(0)
+# Остановленные часы: время мира не зависит от реального и идет только через
+# advance_clock (воспроизводимая симуляция с --seed)
+FROZEN_AT: datetime | None = None
+# Начало остановленных часов, если мир не продолжается из снимка
+SIMULATION_EPOCH = datetime(2024, 1, 1)
+
 def get_time_speed() -> float:
     """Получить текущую скорость времени"""
     return TIME_SPEED
@@ -15,3 +27,89 @@ def set_time_speed(speed: float):
     global TIME_SPEED
     TIME_SPEED = max(0.1, min(5.0, speed))  # Ограничиваем от 0.1 до 5.0
 
+
+def now() -> datetime:
+    """Текущее мировое время (UTC с учетом сдвига симуляции)"""
+    if FROZEN_AT is not None:
+        return FROZEN_AT
+    return datetime.utcnow() + CLOCK_OFFSET
+
+
+def advance_clock(seconds: float):
+    """Перевести мировые часы вперед на seconds секунд"""
+    global CLOCK_OFFSET, FROZEN_AT
+    if FROZEN_AT is not None:
+        FROZEN_AT += timedelta(seconds=seconds)
+    else:
+        CLOCK_OFFSET += timedelta(seconds=seconds)
+
+
+def set_clock(moment: datetime):
+    """Выставить мировые часы на moment (продолжение мира из снимка)"""
+    global CLOCK_OFFSET, FROZEN_AT
+    if FROZEN_AT is not None:
+        FROZEN_AT = moment
+    else:
+        CLOCK_OFFSET = moment - datetime.utcnow()
+
+
+def freeze_clock(moment: datetime = None):
+    """Остановить часы на moment (по умолчанию SIMULATION_EPOCH)"""
+    global FROZEN_AT
+    FROZEN_AT = moment or SIMULATION_EPOCH
+
+
+class LifecycleParams(BaseModel):
+    """Настраиваемые константы жизненного цикла (подбираются через app.sweep)"""
+    action_factor: float = 0.5                 # вероятность действия = action_factor * скорость
+    conflict_probability: float = 0.3          # случайный конфликт в обычном настроении
+    bad_mood_conflict_probability: float = 0.5 # случайный конфликт в плохом настроении
+    hostile_threshold: float = -0.2            # ниже этой симпатии агент считается врагом
+    hostile_target_probability: float = 0.6    # шанс выбрать врага целью, если враги есть
+    # Изменения симпатии в update_relationship_after_interaction
+    sympathy_positive_base: float = 0.1
+    sympathy_positive_per_word: float = 0.05
+    sympathy_negative_base: float = -0.1
+    sympathy_negative_per_word: float = -0.05
+    sympathy_offended_base: float = -0.15
+    sympathy_aggressive_base: float = -0.2
+    sympathy_hostile_amplifier: float = 1.3    # усиление негатива при уже плохих отношениях
+    sympathy_mutual_factor: float = 0.5        # доля изменения для обратного отношения
+    # Матчмейкинг: веса кандидатов по типу отношений
+    match_hostile_weight: float = 1.0
+    match_friend_weight: float = 1.0
+    match_neutral_weight: float = 1.0
+    match_stranger_weight: float = 1.0
+    match_stranger_sample: int = 8             # сколько случайных незнакомцев рассматривать
+    match_mixing_rate: float = 0.25            # доля незнакомцев со всего мира, а не из своего сообщества
+    neighborhood_min_agents: int = 500         # с какого размера мира подбирать через индекс окрестностей (0 — никогда)
+    max_dialogues_per_tick: int = 0            # 0 — без лимита (не больше N/2)
+    max_parallel_steps: int = 8                # одновременных рефлексий/диалогов в тике
+    dialogue_batch_size: int = 0               # реплик тика в одном запросе к LLM (0/1 — по одной)
+    think_and_act: bool = False                # рефлексия и реплика одним JSON-запросом к LLM
+    # Бюджет вызовов LLM жизненного цикла в минуту (app.services.llm_budget), 0 — без ограничения
+    llm_calls_per_minute: float = float(os.getenv("LLM_CALLS_PER_MINUTE", "0"))
+
+
+PARAMS = LifecycleParams()
+
+
+def get_params() -> LifecycleParams:
+    """Текущие параметры жизненного цикла"""
+    return PARAMS
+
+
+def set_params(**overrides) -> LifecycleParams:
+    """Переопределить часть параметров жизненного цикла"""
+    global PARAMS
+    PARAMS = LifecycleParams(**{**PARAMS.model_dump(), **overrides})
+    return PARAMS
+
+
+def reset_world_state():
+    """Скорость, часы и параметры по умолчанию (новая симуляция в том же процессе)"""
+    global TIME_SPEED, CLOCK_OFFSET, FROZEN_AT, PARAMS
+    TIME_SPEED = 1.0
+    CLOCK_OFFSET = timedelta(0)
+    FROZEN_AT = None
+    PARAMS = LifecycleParams()
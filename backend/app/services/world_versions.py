@@ -0,0 +1,245 @@
+"""
+Версии мира для условных GET (ETag / If-None-Match).
+
+Каждая запись агентов или событий через репозитории поднимает монотонную
+версию мира ("world"), версию своей коллекции ("agents", "events") и
+версии затронутых элементов: агента ("agents/<id>") или участников
+события ("events/<id агента>"). Списки, граф отношений и лента отдают
+ETag из версии коллекции, а карточка агента и события агента — из версий
+своих элементов, так что запись одного агента не сбрасывает опрос
+остальных. Массовое удаление поднимает счетчик сброса коллекции
+("agents:reset"), который входит в ETag каждого ее элемента. На
+If-None-Match с той же версией эндпоинт отвечает 304 Not Modified — без
+запроса к базе и без сериализации. Cache-Control: no-cache заставляет браузер
+сверять свою копию на каждом опросе, так что фронтенд получает 304 сам.
+
+Версия берется до чтения данных: запись между ними даст ответ новее
+своего ETag, и следующий опрос просто получит его еще раз, а не застрянет
+на устаревшей копии.
+
+Встроенное хранилище — один процесс: счетчики ведутся в памяти, эпоха
+(случайная на запуск) не дает ETag совпасть после перезапуска. С MongoDB
+пишут несколько процессов (воркеры, --workers uvicorn): счетчики лежат в
+одном документе коллекции world_versions (версии элементов — в
+world_item_versions, по документу на элемент), запись атомарно
+увеличивает их ($inc), а процесс перечитывает документ и нужные элементы
+не чаще раза в WORLD_VERSION_REFRESH секунд. Свои записи видны сразу,
+чужие — с этой задержкой.
+
+Чтобы не обновлять этот документ на каждую запись, записи внутри блока
+deferred() только запоминают затронутые ресурсы, а версии поднимаются
+одним $inc: при сбросе пакета WriteBatch и один раз за HTTP-запрос
+(DeferredBumpMiddleware — до отправки заголовков ответа, поэтому
+следующий опрос клиента уже видит новую версию).
+"""
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from fastapi import Request
+
+from app.db.repository import get_storage
+
+REFRESH_SECONDS = float(os.getenv("WORLD_VERSION_REFRESH", "0.5"))
+RESOURCES = ("world", "agents", "events")
+
+VERSION_STATS = {"bumps": 0, "refreshes": 0, "not_modified": 0, "served": 0}
+
+# Счетчики коллекций, их сбросов и элементов ("agents/<id>")
+_versions: dict[str, int] = dict.fromkeys(RESOURCES, 0)
+_epoch = uuid.uuid4().hex[:8]
+_refreshed_at = float("-inf")
+# Когда версия элемента читалась из общего хранилища (MongoDB)
+_item_read_at: dict[str, float] = {}
+
+
+def keys(resource: str, items=(), reset: bool = False) -> set[str]:
+    """Счетчики, которые поднимает запись в resource: коллекция, элементы
+    items (id агентов) и, при массовом изменении, сброс всех элементов"""
+    touched = {resource, *(f"{resource}/{i}" for i in items if i)}
+    if reset:
+        touched.add(f"{resource}:reset")
+    return touched
+
+
+def is_item(key: str) -> bool:
+    return "/" in key
+
+
+class _Pending:
+    """Счетчики, поднятые записями внутри блока deferred()"""
+
+    def __init__(self):
+        self.resources: set[str] = set()
+        self.closed = False
+
+    async def flush(self):
+        if self.resources:
+            resources, self.resources = self.resources, set()
+            await get_storage().bump_versions(resources)
+
+
+_pending: ContextVar[_Pending | None] = ContextVar("world_versions_pending", default=None)
+
+
+class NotModified(Exception):
+    """If-None-Match совпал с текущим ETag — ответ 304 (обработчик в main)"""
+
+    def __init__(self, etag: str):
+        super().__init__(etag)
+        self.etag = etag
+
+
+def versions() -> dict[str, int]:
+    """Версии коллекций (без элементов)"""
+    return {resource: _versions[resource] for resource in RESOURCES}
+
+
+def bump(resource: str, items=(), reset: bool = False):
+    """Запись в хранилище процесса (встроенное хранилище)"""
+    _versions["world"] += 1
+    for key in keys(resource, items, reset):
+        _versions[key] = _versions.get(key, 0) + 1
+    VERSION_STATS["bumps"] += 1
+
+
+def defer(resource: str, items=(), reset: bool = False) -> bool:
+    """Отложить подъем версий до конца блока deferred(). False — блока нет"""
+    pending = _pending.get()
+    if pending is None or pending.closed:
+        return False
+    pending.resources.update(keys(resource, items, reset))
+    return True
+
+
+@asynccontextmanager
+async def deferred():
+    """Записи внутри блока поднимают версии одним обновлением на выходе.
+    Вложенный блок присоединяется к внешнему. Отдает _Pending (flush — поднять сейчас)"""
+    pending = _pending.get()
+    if pending is not None and not pending.closed:
+        yield pending
+        return
+    pending = _Pending()
+    token = _pending.set(pending)
+    try:
+        yield pending
+    finally:
+        # Задачи, унаследовавшие контекст, после выхода поднимают версии сами
+        pending.closed = True
+        _pending.reset(token)
+        await pending.flush()
+
+
+def observe(doc: dict | None):
+    """Счетчики из общего документа MongoDB. Версии только растут; новая
+    эпоха (база создана заново) заменяет их целиком"""
+    global _epoch
+    if not doc:
+        return
+    if doc.get("epoch") != _epoch:
+        _epoch = doc.get("epoch") or _epoch
+        _versions.clear()
+        _versions.update(dict.fromkeys(RESOURCES, 0))
+        _item_read_at.clear()
+    for key, value in doc.items():
+        if key not in ("_id", "epoch"):
+            _versions[key] = max(_versions.get(key, 0), value)
+
+
+def observe_items(found: dict[str, int]):
+    """Версии элементов из общего хранилища (только растут)"""
+    for key, value in found.items():
+        _versions[key] = max(_versions.get(key, 0), value)
+
+
+def forget(item_keys):
+    """Свои записи элементов: следующий запрос перечитает их версии"""
+    for key in item_keys:
+        _item_read_at.pop(key, None)
+
+
+def etag(resource: str, *items: str) -> str:
+    """ETag коллекции или ее элементов items"""
+    # Слабый: одна версия отдается и без сжатия, и в gzip/br
+    if not items:
+        return f'W/"{_epoch}-{resource}-{_versions[resource]}"'
+    # id элементов в ETag не нужны: клиент сравнивает его только для своего URL
+    reset = _versions.get(f"{resource}:reset", 0)
+    parts = ".".join(str(_versions.get(f"{resource}/{i}", 0)) for i in items)
+    return f'W/"{_epoch}-{resource}-{reset}.{parts}"'
+
+
+def headers(tag: str) -> dict[str, str]:
+    return {"ETag": tag, "Cache-Control": "no-cache"}
+
+
+def _matches(if_none_match: str | None, tag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Слабое сравнение: W/ не учитывается
+    opaque = tag.removeprefix("W/")
+    return any(item.strip().removeprefix("W/") == opaque for item in if_none_match.split(","))
+
+
+async def refresh():
+    """Перечитать общие счетчики, если пора (хранилище без общих счетчиков — ничего)"""
+    global _refreshed_at
+    now = time.monotonic()
+    if now - _refreshed_at < REFRESH_SECONDS:
+        return
+    _refreshed_at = now  # параллельные запросы не перечитывают документ следом
+    doc = await get_storage().read_versions()
+    if doc is not None:
+        observe(doc)
+        VERSION_STATS["refreshes"] += 1
+
+
+async def refresh_items(item_keys: list[str]):
+    """Перечитать общие версии элементов, которые давно не читались"""
+    now = time.monotonic()
+    stale = [k for k in item_keys if now - _item_read_at.get(k, float("-inf")) >= REFRESH_SECONDS]
+    if not stale:
+        return
+    found = await get_storage().read_item_versions(stale)
+    if found is not None:
+        _item_read_at.update(dict.fromkeys(stale, now))
+        observe_items(found)
+
+
+async def check(request: Request, resource: str, *items: str) -> str:
+    """ETag коллекции (или ее элементов items) для ответа.
+    Клиент уже видел эту версию — NotModified"""
+    await refresh()
+    if items:
+        await refresh_items([f"{resource}/{i}" for i in items])
+    tag = etag(resource, *items)
+    if _matches(request.headers.get("if-none-match"), tag):
+        VERSION_STATS["not_modified"] += 1
+        raise NotModified(tag)
+    VERSION_STATS["served"] += 1
+    return tag
+
+
+class DeferredBumpMiddleware:
+    """Одно обновление версий на изменяющий HTTP-запрос"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            await self.app(scope, receive, send)
+            return
+        async with deferred() as pending:
+
+            async def send_bumped(message):
+                if message["type"] == "http.response.start":
+                    await pending.flush()
+                await send(message)
+
+            await self.app(scope, receive, send_bumped)
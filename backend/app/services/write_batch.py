@@ -0,0 +1,224 @@
+"""
+Пакетная запись изменений в БД.
+
+Шаг жизненного цикла раньше делал десятки отдельных insert/save на агента.
+WriteBatch копит изменения (агенты, события, логи) в памяти и коммитит их
+несколькими пакетными операциями репозиториев — по одной на коллекцию.
+
+Заодно это identity map: все шаги тика работают с одними и теми же
+экземплярами агентов, поэтому цель диалога не перезаписывает изменения,
+сделанные другим шагом в том же тике.
+
+Агенты пишутся условно по revision (см. app.services.occ). Для каждого
+агента пакет помнит прочитанный документ (base); если запись не прошла
+из-за конкурента, изменения пакета сливаются со свежей версией и
+запись повторяется. Разница base → записанный документ уходит в историю
+агента (app.services.agent_history).
+"""
+import asyncio
+import logging
+import time
+
+from app.db.repository import agent_repo, event_repo, log_repo
+from app.models.agent import Agent
+from app.models.event import Event
+from app.models.log import Log
+from app.services import world_versions
+from app.services.agent_history import record_writes
+from app.services.occ import OCC_STATS, MAX_RETRIES, agent_document, merge_documents
+from app.services.sharding import partition_of
+
+# Метрики сброса пакетов
+FLUSH_STATS = {"flushes": 0, "agents": 0, "events": 0, "logs": 0,
+               "last_ms": 0.0, "max_ms": 0.0, "total_ms": 0.0}
+
+logger = logging.getLogger(__name__)
+
+
+def _split(items: list, busy: set[str], *fields: str) -> tuple[list, list]:
+    """(записи без участия занятых агентов, остальные)"""
+    ready, held = [], []
+    for item in items:
+        (held if any(getattr(item, f) in busy for f in fields) else ready).append(item)
+    return ready, held
+
+
+class WriteBatch:
+
+    def __init__(self, agents: list[Agent] = ()):
+        self.agents: dict[str, Agent] = {}
+        self._base: dict[str, dict] = {}
+        # Агенты чужих партиций — только кандидаты в собеседники; в identity map
+        # попадают, лишь когда их выбрали (запись — с той же проверкой revision)
+        self.foreign: dict[str, Agent] = {}
+        self._foreign_base: dict[str, dict] = {}
+        self._dirty: dict[str, Agent] = {}
+        self._events: list[Event] = []
+        self._logs: list[Log] = []
+        self._lock = asyncio.Lock()
+        self._flushed_at = time.monotonic()
+        for a in agents:
+            self.track(a)
+
+    @classmethod
+    async def load_active(cls, partitions: set[int] = None) -> "WriteBatch":
+        """Пакет с уже загруженными активными агентами. С partitions в пакет
+        попадают только агенты своих партиций, остальные — в foreign: мир для
+        подбора собеседников один на все воркеры"""
+        # Прочитанные документы сразу служат base для слияния при конфликте
+        batch = cls()
+        for agent, base in await agent_repo().load_with_base(active_only=True):
+            key = str(agent.id)
+            if partitions is None or partition_of(key) in partitions:
+                batch.track(agent, base=base)
+            else:
+                batch.foreign[key] = agent
+                batch._foreign_base[key] = base
+        return batch
+
+    @property
+    def pool(self) -> list[Agent]:
+        """Все кандидаты в собеседники: свои агенты и агенты чужих партиций"""
+        return [*self.agents.values(), *self.foreign.values()]
+
+    def track(self, agent: Agent, base: dict = None) -> Agent:
+        """Зарегистрировать экземпляр агента в identity map.
+        base — прочитанный документ; по умолчанию текущее состояние агента"""
+        key = str(agent.id)
+        self.agents[key] = agent
+        if self.foreign.pop(key, None) is not None:
+            base = self._foreign_base.pop(key) if base is None else base
+        if key not in self._base:
+            self._base[key] = base if base is not None else agent_document(agent)
+        return agent
+
+    async def get_agent(self, agent_id: str) -> Agent | None:
+        """Агент из пакета; если его там нет — загружается из БД один раз"""
+        if agent_id in self.foreign:
+            return self.track(self.foreign[agent_id])
+        agent = self.agents.get(agent_id)
+        if agent is None:
+            for loaded, base in await agent_repo().load_with_base([agent_id]):
+                agent = self.track(loaded, base=base)
+        return agent
+
+    def mark(self, agent: Agent):
+        """Агент изменен и должен быть записан при flush"""
+        self._dirty[str(agent.id)] = self.track(agent)
+
+    def is_dirty(self, agent: Agent) -> bool:
+        return str(agent.id) in self._dirty
+
+    def add_event(self, event: Event):
+        self._events.append(event)
+
+    def add_log(self, log: Log):
+        self._logs.append(log)
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty) + len(self._events) + len(self._logs)
+
+    async def flush_due(self, interval: float, busy: set[str] = frozenset()) -> float:
+        """Записать накопленное, если с прошлого сброса прошло не меньше interval секунд"""
+        if time.monotonic() - self._flushed_at < interval:
+            return 0.0
+        return await self.flush(busy)
+
+    async def flush(self, busy: set[str] = frozenset()) -> float:
+        """Записать накопленное. Возвращает время сброса в миллисекундах.
+        busy — id агентов, чей шаг еще идет: их изменения (и события, и логи
+        с их участием) остаются в пакете до следующего сброса, чтобы не
+        записать диалог наполовину.
+        Сбросы одного пакета идут по очереди: иначе агент, записанный одним
+        сбросом, ушел бы в другой со старой revision. Версии мира
+        поднимаются одним обновлением на весь сброс"""
+        async with self._lock, world_versions.deferred():
+            self._flushed_at = time.monotonic()
+            return await self._flush(busy)
+
+    async def _flush(self, busy: set[str]) -> float:
+        if not self.pending:
+            return 0.0
+        if busy:
+            # Выборка — до первого await: занятые агенты не попадут в сброс на полпути
+            dirty = [a for key, a in self._dirty.items() if key not in busy]
+            self._dirty = {key: a for key, a in self._dirty.items() if key in busy}
+            events, self._events = _split(self._events, busy, "agent_id", "target_agent_id")
+            logs, self._logs = _split(self._logs, busy, "agent_id")
+        else:
+            dirty, events, logs = list(self._dirty.values()), self._events, self._logs
+            self._dirty, self._events, self._logs = {}, [], []
+
+        started = time.perf_counter()
+        ops = []
+        if dirty:
+            ops.append(self._write_agents(dirty))
+        if events:
+            ops.append(event_repo().insert_many(events))
+        if logs:
+            ops.append(log_repo().insert_many(logs))
+        await asyncio.gather(*ops)
+        elapsed = (time.perf_counter() - started) * 1000
+
+        FLUSH_STATS["flushes"] += 1
+        FLUSH_STATS["agents"] += len(dirty)
+        FLUSH_STATS["events"] += len(events)
+        FLUSH_STATS["logs"] += len(logs)
+        FLUSH_STATS["last_ms"] = round(elapsed, 3)
+        FLUSH_STATS["max_ms"] = round(max(FLUSH_STATS["max_ms"], elapsed), 3)
+        FLUSH_STATS["total_ms"] = round(FLUSH_STATS["total_ms"] + elapsed, 3)
+        return elapsed
+
+    async def _write_agents(self, dirty: list[Agent]):
+        """Условная запись агентов с повтором через слияние при конфликтах"""
+        for attempt in range(MAX_RETRIES + 1):
+            failed = await self._bulk_replace(dirty)
+            if not failed:
+                return
+            OCC_STATS["conflicts"] += len(failed)
+            if attempt == MAX_RETRIES:
+                break
+            OCC_STATS["retries"] += len(failed)
+            dirty = await self._merge_fresh(failed)
+        OCC_STATS["failures"] += len(failed)
+        logger.warning("Не удалось записать %d агентов после %d повторов", len(failed), MAX_RETRIES)
+
+    async def _bulk_replace(self, agents: list[Agent]) -> list[Agent]:
+        """Один пакет условных замен. Возвращает агентов с конфликтом"""
+        docs = []
+        for a in agents:
+            doc = agent_document(a)
+            doc["revision"] = a.revision + 1
+            docs.append(doc)
+        failed, deleted = await agent_repo().bulk_replace_if_revision(list(zip(agents, docs)))
+        OCC_STATS["writes"] += len(agents)
+        written = []
+        for i, (a, doc) in enumerate(zip(agents, docs)):
+            if i not in failed and i not in deleted:
+                a.revision += 1
+                key = str(a.id)
+                written.append((key, self._base[key], doc))
+                self._base[key] = doc
+        await record_writes(written)
+        return [agents[i] for i in sorted(failed)]
+
+    async def _merge_fresh(self, agents: list[Agent]) -> list[Agent]:
+        """Слить изменения пакета со свежими версиями из хранилища"""
+        fresh = {str(a.id): base for a, base in await agent_repo().load_with_base([a.id for a in agents])}
+        merged_agents = []
+        for a in agents:
+            key = str(a.id)
+            theirs = fresh.get(key)
+            if theirs is None:
+                continue  # удален конкурентом
+            merged = merge_documents(self._base[key], agent_document(a), theirs)
+            merged["revision"] = theirs.get("revision") or 0
+            updated = Agent.model_validate({**merged, "_id": a.id})
+            for name in Agent.model_fields:
+                if name != "id":
+                    setattr(a, name, getattr(updated, name))
+            self._base[key] = theirs
+            merged_agents.append(a)
+            OCC_STATS["merges"] += 1
+        return merged_agents
@@ -0,0 +1,229 @@
+"""
+Headless-симуляция мира без uvicorn и без ожидания реального времени.
+
+Загружает (или создает) мир, прогоняет N тиков жизненного цикла так быстро,
+как позволяет CPU, на офлайн-бэкенде LLM и с фиксированным seed.
+В конце пишет финальное состояние агентов и статистику по времени тиков.
+
+Пример:
+    python -m app.simulate --ticks 200 --agents 1000 --seed 42 --db sim_world --reset --out sim.json
+    python -m app.simulate --ticks 200 --snapshot snapshots/world.ndjson.gz --memory   # старт из снимка
+    python -m app.simulate --ticks 50 --stall-ms 50   # блокирующие участки тика дольше 50 мс
+    python -m app.simulate --ticks 50 --cassette cassettes/day1.ndjson.gz --replay-latency 1.0   # записанный трафик GigaChat
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from app.db.database import connect, disconnect
+from app.db.repository import agent_repo, get_storage
+from app.models.agent import Agent, Mood
+from app.services.builder import AgentBuilder
+from app.services import (console_log, gigachat_service, lifecycle_service, llm_budget, llm_cassette, llm_usage,
+                          neighborhoods, stall_watchdog, world_state)
+from app.services.lifecycle_service import run_lifecycle_tick
+from app.services.seed_agents import seed_initial_agents
+from app.services.world_snapshot import restore_snapshot
+
+
+NAMES = ["Алекс", "Мария", "Роберт", "Ольга", "Иван", "Нина", "Павел", "Вера", "Олег", "Лиза"]
+
+
+def generate_agents(count: int, start: int = 0) -> list[Agent]:
+    """Синтетические агенты со случайной личностью и настроением"""
+    agents = []
+    for i in range(start, start + count):
+        agents.append(AgentBuilder()
+            .set_name(f"{NAMES[i % len(NAMES)]} #{i}")
+            .set_bio("Житель симулированного мира.")
+            .set_personality(*(round(random.random(), 2) for _ in range(5)))
+            .set_mood(random.choice(list(Mood)), energy=round(random.uniform(0.3, 1.0), 2),
+                      stress=round(random.uniform(0.0, 0.6), 2), happiness=round(random.uniform(0.2, 0.8), 2))
+            .build())
+    return agents
+
+
+async def prepare_world(agents: int, reset: bool):
+    """Очищает мир (reset) и догоняет число агентов до agents"""
+    if reset:
+        await get_storage().drop()
+    await seed_initial_agents()
+    existing = await agent_repo().count()
+    if agents > existing:
+        await agent_repo().insert_many(generate_agents(agents - existing, start=existing))
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def world_metrics(agents: list[Agent]) -> dict:
+    """Итоговые метрики мира: распределение настроений и поляризация графа"""
+    moods = {m.value: 0 for m in Mood}
+    for a in agents:
+        moods[a.emotion.mood.value] += 1
+    total = len(agents) or 1
+    sympathies = [r.sympathy for a in agents for r in a.relationships]
+    edges = len(sympathies) or 1
+    return {
+        "mood_distribution": {k: round(v / total, 3) for k, v in moods.items()},
+        "happiness_mean": round(statistics.fmean(a.emotion.happiness for a in agents), 3) if agents else 0.0,
+        # Поляризация: средний модуль симпатии и доли ярко выраженных связей
+        "polarization": round(statistics.fmean(abs(s) for s in sympathies), 3) if sympathies else 0.0,
+        "hostile_edges": round(sum(1 for s in sympathies if s < -0.3) / edges, 3),
+        "friendly_edges": round(sum(1 for s in sympathies if s > 0.3) / edges, 3),
+    }
+
+
+async def run_simulation(ticks: int, seed: int, tick_seconds: float = 10.0,
+                         agents: int = 0, reset: bool = False, speed: float = 1.0,
+                         params: dict = None, start_at: datetime = None) -> dict:
+    """Прогоняет ticks тиков на уже подключенной БД. start_at — мировое время
+    начала (мир из снимка; иначе world_state.SIMULATION_EPOCH). Возвращает статистику"""
+    random.seed(seed)
+    gigachat_service.set_llm_backend("offline")
+    # Процесс-воркер app.sweep прогоняет симуляции одну за другой: состояние
+    # прошлого прогона (часы, параметры, кэши) не должно влиять на следующий
+    world_state.reset_world_state()
+    # Часы мира стоят и идут только на tick_seconds за тик: реальное время
+    # не попадает ни в метки агентов, ни в dt динамики эмоций
+    world_state.freeze_clock(start_at)
+    world_state.set_time_speed(speed)
+    if params:
+        world_state.set_params(**params)
+    lifecycle_service.reset_state()
+    llm_budget.reset_governor()
+    neighborhoods.reset_index()
+    await prepare_world(agents, reset)
+
+    durations = []
+    steps = 0
+    started = time.perf_counter()
+    for i in range(ticks):
+        t0 = time.perf_counter()
+        steps += await run_lifecycle_tick(dt=tick_seconds if i else 0.0)
+        durations.append(time.perf_counter() - t0)
+        world_state.advance_clock(tick_seconds)
+    total = time.perf_counter() - started
+    counters = lifecycle_service.STATS
+    await llm_usage.flush()  # остаток журнала расхода LLM (фоновой задачи сброса здесь нет)
+
+    return {
+        "ticks": ticks,
+        "seed": seed,
+        "agents": await agent_repo().count(),
+        "agent_steps": steps,
+        "total_seconds": round(total, 4),
+        "tick_ms_mean": round(statistics.fmean(durations) * 1000, 3) if durations else 0.0,
+        "tick_ms_p50": round(percentile(durations, 0.5) * 1000, 3),
+        "tick_ms_p95": round(percentile(durations, 0.95) * 1000, 3),
+        "tick_ms_max": round(max(durations, default=0.0) * 1000, 3),
+        "step_us_mean": round(total / steps * 1e6, 1) if steps else 0.0,
+        "dialogues": counters["dialogues"],
+        "reflections": counters["reflections"],
+        "conflict_rate": round(counters["conflicts"] / counters["dialogues"], 3) if counters["dialogues"] else 0.0,
+        **world_metrics(await agent_repo().find_all()),
+    }
+
+
+async def dump_state() -> list[dict]:
+    agents = await agent_repo().find_all()
+    return [a.model_dump(mode="json") for a in agents]
+
+
+async def main(args):
+    # Лог — в stderr, чтобы в stdout оставался только итоговый JSON
+    console_log.setup_logging("WARNING" if args.quiet else None, stream=sys.stderr)
+    await connect(args.db, backend=args.storage, persist=not args.memory)
+    if args.cassette:
+        llm_cassette.use_cassette(args.cassette, args.cassette_mode, args.replay_latency, args.on_miss)
+    try:
+        start_at = None
+        if args.snapshot:
+            restored = await restore_snapshot(args.snapshot, replace=True)
+            start_at = datetime.fromisoformat(restored["world_time"])
+            print(f"Мир восстановлен из снимка: {restored['agents']} агентов, "
+                  f"{restored['events']} событий за {restored['seconds']} с")
+        with stall_watchdog.capture_stalls(args.stall_ms) if args.stall_ms else contextlib.nullcontext([]) as stalls:
+            params = {}
+            if args.dialogue_batch:
+                params["dialogue_batch_size"] = args.dialogue_batch
+            if args.think_and_act:
+                params["think_and_act"] = True
+            if args.llm_budget:
+                params["llm_calls_per_minute"] = args.llm_budget
+            if args.neighborhoods is not None:
+                params["neighborhood_min_agents"] = args.neighborhoods
+            stats = await run_simulation(args.ticks, args.seed, args.tick_seconds,
+                                         args.agents, args.reset, args.speed, params, start_at)
+        if args.stall_ms:
+            # Тик целиком синхронен между await'ами БД — виновники его самые долгие участки
+            stats["stalls"] = len(stalls)
+            stats["stall_culprits"] = sorted({s["culprit"] for s in stalls if s["culprit"]})
+        if args.dialogue_batch:
+            stats["dialogue_batch"] = dict(gigachat_service.BATCH_STATS)
+        if args.think_and_act:
+            stats["think_and_act"] = dict(lifecycle_service.THINK_STATS)
+        if args.llm_budget:
+            stats["llm_budget"] = dict(llm_budget.BUDGET_STATS)
+        if neighborhoods.NEIGHBORHOOD_STATS["agents"]:
+            stats["neighborhoods"] = dict(neighborhoods.NEIGHBORHOOD_STATS)
+        if args.cassette:
+            stats["cassette"] = dict(llm_cassette.CASSETTE_STATS)
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump({"stats": stats, "agents": await dump_state()}, f, ensure_ascii=False)
+            print(f"Состояние мира записано в {args.out}")
+    finally:
+        llm_cassette.close_cassette()
+        await disconnect()
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Headless fast-forward симуляция мира")
+    p.add_argument("--ticks", type=int, default=100, help="количество тиков жизненного цикла")
+    p.add_argument("--seed", type=int, default=42, help="seed генератора случайных чисел")
+    p.add_argument("--agents", type=int, default=0, help="догенерировать агентов до этого числа")
+    p.add_argument("--db", default="virtual_world_sim", help="имя базы данных для симуляции")
+    p.add_argument("--storage", choices=["embedded", "mongo"], default="embedded",
+                   help="хранилище: встроенное (по умолчанию, без сервера) или MongoDB")
+    p.add_argument("--memory", action="store_true", help="встроенное хранилище только в памяти, без журнала")
+    p.add_argument("--reset", action="store_true", help="очистить базу перед запуском")
+    p.add_argument("--snapshot", default=None, help="начать с мира из снимка (app.snapshot); заменяет агентов и события")
+    p.add_argument("--tick-seconds", type=float, default=10.0, help="сколько мирового времени занимает тик")
+    p.add_argument("--speed", type=float, default=1.0, help="скорость времени мира (0.1–5.0)")
+    p.add_argument("--out", default=None, help="файл для финального состояния и статистики (JSON)")
+    p.add_argument("--quiet", action="store_true", help="только предупреждения и ошибки в логе")
+    p.add_argument("--dialogue-batch", type=int, default=0,
+                   help="реплик тика в одном запросе к LLM (LifecycleParams.dialogue_batch_size)")
+    p.add_argument("--think-and-act", action="store_true",
+                   help="рефлексия и реплика одним запросом к LLM (LifecycleParams.think_and_act)")
+    p.add_argument("--llm-budget", type=float, default=0,
+                   help="бюджет вызовов LLM в минуту мирового времени (LifecycleParams.llm_calls_per_minute)")
+    p.add_argument("--neighborhoods", type=int, default=None,
+                   help="подбор собеседников через индекс окрестностей с этого числа агентов (0 — никогда)")
+    p.add_argument("--cassette", default=None, help="кассета LLM (app.services.llm_cassette)")
+    p.add_argument("--cassette-mode", choices=["replay", "record"], default="replay",
+                   help="replay — ответы из кассеты вместо офлайн-бэкенда; record — записать ответы")
+    p.add_argument("--replay-latency", type=float, default=0.0,
+                   help="множитель записанных задержек при воспроизведении (0 — без задержек)")
+    p.add_argument("--on-miss", choices=list(llm_cassette.MISS_POLICIES), default="kind",
+                   help="запроса нет в кассете: ответ того же типа / офлайн-бэкенд / ошибка")
+    p.add_argument("--stall-ms", type=float, default=0,
+                   help="искать блокировки цикла событий дольше этого порога (мс), 0 — выключено")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,50 @@
+"""
+Снимки мира из командной строки (формат — app.services.world_snapshot).
+
+Примеры:
+    python -m app.snapshot save world.ndjson.gz --db virtual_world --storage mongo --events 20000
+    python -m app.snapshot restore world.ndjson.gz --db fork_a --storage embedded
+    python -m app.snapshot restore world.ndjson.gz --db fork_b --storage mongo
+    python -m app.snapshot info world.ndjson.gz
+"""
+import argparse
+import asyncio
+import json
+
+from app.db.database import connect, disconnect
+from app.services.world_snapshot import DEFAULT_EVENTS, read_header, restore_snapshot, save_snapshot
+
+
+async def main(args):
+    if args.command == "info":
+        print(json.dumps(await read_header(args.path), ensure_ascii=False, indent=2))
+        return
+    await connect(args.db, backend=args.storage)
+    try:
+        if args.command == "save":
+            result = await save_snapshot(args.path, args.events)
+        else:
+            result = await restore_snapshot(args.path, replace=args.replace)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    finally:
+        await disconnect()
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Сохранение и восстановление снимков мира")
+    p.add_argument("command", choices=["save", "restore", "info"])
+    p.add_argument("path", help="файл снимка (.ndjson.gz)")
+    p.add_argument("--db", default=None, help="имя базы данных (по умолчанию DATABASE_NAME)")
+    p.add_argument("--storage", choices=["embedded", "mongo"], default=None,
+                   help="хранилище (по умолчанию STORAGE_BACKEND)")
+    p.add_argument("--events", type=int, default=DEFAULT_EVENTS,
+                   help="сколько последних событий сохранить (0 — все)")
+    p.add_argument("--replace", action="store_true", help="восстановить поверх непустой базы")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except ValueError as e:
+        raise SystemExit(f"Ошибка: {e}")
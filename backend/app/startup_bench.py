@@ -0,0 +1,136 @@
+"""
+Замер холодного старта API: время импорта app.main и время до первого
+ответа (time-to-first-request).
+
+Каждый прогон — новый процесс uvicorn и, для встроенного хранилища,
+пустой каталог данных: старт включает подключение к базе, создание
+базовых агентов и подъем фоновых задач. Время до первого ответа считается
+от запуска процесса до первого успешного GET /api/v1/system/agents (uvicorn
+принимает соединения только после старта lifespan).
+
+Примеры:
+    python -m app.startup_bench --runs 5
+    python -m app.startup_bench --storage mongo --skip-index-checks --out startup.json
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+FIRST_REQUEST = "/api/v1/system/agents?limit=1"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(env: dict) -> float:
+    """Время импорта app.main в новом интерпретаторе, мс"""
+    code = "import time; t = time.perf_counter(); import app.main; print((time.perf_counter() - t) * 1000)"
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def measure_first_request(env: dict, timeout: float) -> dict:
+    """Запустить uvicorn и ждать первого ответа. Времена — от запуска процесса, мс"""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}{FIRST_REQUEST}"
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+                             "--log-level", "warning"],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn завершился с кодом {proc.returncode}: "
+                                   f"{proc.stderr.read().decode(errors='replace')[-2000:]}")
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError(f"Нет ответа за {timeout} с")
+            sent = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as resp:
+                    total = json.loads(resp.read())["total"]
+                break
+            except urllib.error.HTTPError as e:
+                raise RuntimeError(f"GET {FIRST_REQUEST}: HTTP {e.code}")
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        done = time.perf_counter()
+        return {"ttfr_ms": round((done - started) * 1000, 1),
+                "first_request_ms": round((done - sent) * 1000, 1),
+                "agents": total}
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def _summary(values: list[float]) -> dict:
+    return {"median": round(statistics.median(values), 1), "min": round(min(values), 1),
+            "max": round(max(values), 1)}
+
+
+def run(args) -> dict:
+    env = dict(os.environ, LLM_BACKEND="offline", LIFECYCLE_ROLE=args.role,
+               STALL_WATCHDOG="0", LOG_LEVEL="WARNING")
+    if args.storage:
+        env["STORAGE_BACKEND"] = args.storage
+    if args.db:
+        env["DATABASE_NAME"] = args.db
+    if args.skip_index_checks:
+        env["DB_SKIP_INDEX_CHECKS"] = "1"
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+
+    runs = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory(prefix="vw_startup_") as data_dir:
+            env["EMBEDDED_DATA_DIR"] = data_dir
+            result = {"import_ms": round(measure_import(env), 1)}
+            result.update(measure_first_request(env, args.timeout))
+        runs.append(result)
+    return {
+        "runs": runs,
+        "storage": env.get("STORAGE_BACKEND", "mongo"),
+        "role": args.role,
+        "skip_index_checks": args.skip_index_checks,
+        "import_ms": _summary([r["import_ms"] for r in runs]),
+        "ttfr_ms": _summary([r["ttfr_ms"] for r in runs]),
+        "first_request_ms": _summary([r["first_request_ms"] for r in runs]),
+    }
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Замер холодного старта API")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--storage", choices=["embedded", "mongo"], default="embedded")
+    p.add_argument("--db", default="virtual_world_startup", help="имя базы данных")
+    p.add_argument("--role", choices=["api", "all"], default="all",
+                   help="LIFECYCLE_ROLE: all — с циклом жизнедеятельности в процессе API")
+    p.add_argument("--skip-index-checks", action="store_true", help="DB_SKIP_INDEX_CHECKS=1")
+    p.add_argument("--timeout", type=float, default=60.0, help="ожидание первого ответа, с")
+    p.add_argument("--out", default=None, help="записать результат в JSON-файл")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run(args)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
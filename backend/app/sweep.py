@@ -0,0 +1,130 @@
+"""
+Перебор параметров жизненного цикла в нескольких процессах.
+
+Каждая комбинация параметров × seed — отдельная headless-симуляция
+(см. app.simulate) в своем процессе ProcessPoolExecutor и со своей
+изолированной базой (по умолчанию встроенное хранилище в памяти). Итоговые метрики (настроения, поляризация,
+доля конфликтов) сводятся в одну таблицу.
+
+Пример:
+    python -m app.sweep --ticks 100 --agents 200 --seeds 3 \
+        --param conflict_probability=0.1,0.3,0.5 --param hostile_threshold=-0.4,-0.2
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from app.services.world_state import LifecycleParams
+
+
+COLUMNS = ["conflict_rate", "polarization", "hostile_edges", "friendly_edges", "happiness_mean", "dialogues", "total_seconds"]
+
+
+def parse_grid(specs: list[str]) -> dict[str, list[float]]:
+    """'name=v1,v2,...' → {name: [v1, v2, ...]}"""
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        name = name.strip()
+        if name not in LifecycleParams.model_fields:
+            raise SystemExit(f"Неизвестный параметр: {name}. Доступны: {', '.join(LifecycleParams.model_fields)}")
+        grid[name] = [float(v) for v in values.split(",") if v.strip()]
+    return grid
+
+
+def build_runs(grid: dict[str, list[float]], seeds: int, base_seed: int) -> list[dict]:
+    names = list(grid)
+    runs = []
+    for combo in itertools.product(*(grid[n] for n in names)):
+        for s in range(seeds):
+            runs.append({"params": dict(zip(names, combo)), "seed": base_seed + s})
+    for i, run in enumerate(runs):
+        run["index"] = i
+    return runs
+
+
+async def _run_one(run: dict, ticks: int, agents: int, db_prefix: str, storage: str) -> dict:
+    from app.db import database
+    from app.db.repository import get_storage
+    from app.simulate import run_simulation
+
+    db_name = f"{db_prefix}_{os.getpid()}_{run['index']}"
+    # Встроенное хранилище — только в памяти: базе прогона не нужна долговечность
+    await database.connect(db_name, backend=storage, persist=False)
+    try:
+        return await run_simulation(ticks, run["seed"], agents=agents, reset=True, params=run["params"])
+    finally:
+        await get_storage().drop()
+        await database.disconnect()
+
+
+def run_one(run: dict, ticks: int, agents: int, db_prefix: str, storage: str = "embedded") -> dict:
+    """Точка входа процесса-воркера: одна симуляция от начала до конца"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        stats = asyncio.run(_run_one(run, ticks, agents, db_prefix, storage))
+    return {**run, "stats": stats}
+
+
+def format_table(results: list[dict], names: list[str]) -> str:
+    header = names + ["seed"] + COLUMNS + ["moods"]
+    rows = []
+    for r in sorted(results, key=lambda r: r["index"]):
+        st = r["stats"]
+        moods = " ".join(f"{k}:{v:.2f}" for k, v in st["mood_distribution"].items() if v)
+        rows.append([f"{r['params'][n]:g}" for n in names] + [str(r["seed"])]
+                    + [f"{st[c]:g}" for c in COLUMNS] + [moods])
+    widths = [max(len(h), *(len(row[i]) for row in rows)) if rows else len(h) for i, h in enumerate(header)]
+    lines = ["  ".join(h.ljust(w) for h, w in zip(header, widths))]
+    lines += ["  ".join(v.ljust(w) for v, w in zip(row, widths)) for row in rows]
+    return "\n".join(lines)
+
+
+def write_csv(path: str, results: list[dict], names: list[str]):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(names + ["seed"] + COLUMNS + [f"mood_{m}" for m in results[0]["stats"]["mood_distribution"]])
+        for r in sorted(results, key=lambda r: r["index"]):
+            st = r["stats"]
+            w.writerow([r["params"][n] for n in names] + [r["seed"]] + [st[c] for c in COLUMNS]
+                       + list(st["mood_distribution"].values()))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Перебор параметров жизненного цикла")
+    p.add_argument("--param", action="append", default=[], help="name=v1,v2,... (можно несколько раз)")
+    p.add_argument("--ticks", type=int, default=50)
+    p.add_argument("--agents", type=int, default=50)
+    p.add_argument("--seeds", type=int, default=1, help="сколько seed на каждую комбинацию")
+    p.add_argument("--seed", type=int, default=42, help="первый seed")
+    p.add_argument("--workers", type=int, default=os.cpu_count(), help="число процессов (по умолчанию — все ядра)")
+    p.add_argument("--db-prefix", default="virtual_world_sweep")
+    p.add_argument("--storage", choices=["embedded", "mongo"], default="embedded",
+                   help="хранилище прогонов: встроенное в памяти (по умолчанию) или MongoDB")
+    p.add_argument("--csv", default=None, help="сохранить таблицу в CSV")
+    args = p.parse_args(argv)
+
+    grid = parse_grid(args.param)
+    runs = build_runs(grid, args.seeds, args.seed)
+    print(f"[SWEEP] {len(runs)} симуляций на {args.workers} процессах")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(run_one, run, args.ticks, args.agents, args.db_prefix, args.storage) for run in runs]
+        for fut in as_completed(futures):
+            res = fut.result()
+            results.append(res)
+            print(f"[SWEEP] {len(results)}/{len(runs)} готово: {res['params']} seed={res['seed']}")
+
+    names = list(grid)
+    print(format_table(results, names))
+    if args.csv and results:
+        write_csv(args.csv, results, names)
+        print(f"[SWEEP] Таблица сохранена в {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
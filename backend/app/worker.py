@@ -0,0 +1,60 @@
+"""
+Процесс-воркер жизненного цикла.
+
+Ведет симуляцию только тех агентов, чьи партиции он арендовал
+(см. app.services.sharding). Воркеров можно запускать сколько угодно
+на одной или нескольких машинах с общей MongoDB; при падении воркера
+его партиции по истечении аренды подхватывают остальные.
+API при этом запускается с LIFECYCLE_ROLE=api, чтобы не симулировать сам.
+
+Пример:
+    LIFECYCLE_ROLE=api uvicorn app.main:app --workers 4
+    python -m app.worker --db virtual_world   # в нескольких экземплярах
+"""
+import argparse
+import asyncio
+import signal
+
+from app.db.database import connect, disconnect
+from app.services.console_log import setup_logging
+from app.services.llm_usage import run_usage_sink
+from app.services.lifecycle_service import run_lifecycle_loop
+from app.services.sharding import publish_time_speed
+
+
+async def main(args):
+    setup_logging(args.log_level)
+    await connect(args.db)
+    if args.speed:
+        await publish_time_speed(args.speed)
+    task = asyncio.create_task(run_lifecycle_loop())
+    usage_sink = asyncio.create_task(run_usage_sink())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, task.cancel)
+        except NotImplementedError:
+            pass  # Windows: остановка по Ctrl+C через KeyboardInterrupt
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        usage_sink.cancel()
+        try:
+            await usage_sink  # дописывает остаток журнала расхода
+        except asyncio.CancelledError:
+            pass
+        await disconnect()
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Воркер жизненного цикла агентов")
+    p.add_argument("--db", default=None, help="имя базы данных (по умолчанию DATABASE_NAME)")
+    p.add_argument("--speed", type=float, default=None, help="скорость времени мира (0.1–5.0), общая для всех процессов")
+    p.add_argument("--log-level", default=None, help="уровень лога (по умолчанию LOG_LEVEL)")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,13 @@
+import asyncio
+
+import pytest
+from beanie import init_beanie
+
+from app.db.database import DOCUMENT_MODELS
+from app.db.embedded import StubDatabase
+
+
+@pytest.fixture(scope="session", autouse=True)
+def beanie_models():
+    """Модели Beanie как pydantic-модели, без MongoDB (как во встроенном хранилище)"""
+    asyncio.run(init_beanie(database=StubDatabase(), document_models=DOCUMENT_MODELS, skip_indexes=True))
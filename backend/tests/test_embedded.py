@@ -0,0 +1,217 @@
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.db.embedded import EmbeddedStorage
+from app.models.agent import Agent, Memory
+from app.models.event import Event, EventType
+from app.models.log import Log, LogCategory, LogLevel
+
+
+async def _open(path) -> EmbeddedStorage:
+    storage = EmbeddedStorage(str(path))
+    await storage.open()
+    return storage
+
+
+def test_reopen_from_snapshot(tmp_path):
+    async def main():
+        storage = await _open(tmp_path)
+        await storage.agents.insert_many([Agent(name="Анна"), Agent(name="Борис")])
+        await storage.events.insert(Event(event_type=EventType.CHAT, description="привет"))
+        await storage.close()  # снимок
+
+        storage = await _open(tmp_path)
+        names = sorted(a.name for a in await storage.agents.find_all())
+        events = len(storage.engine.events)
+        await storage.close()
+        return names, events
+
+    assert asyncio.run(main()) == (["Анна", "Борис"], 1)
+
+
+def test_writes_during_snapshot_survive_reopen(tmp_path):
+    async def main():
+        storage = await _open(tmp_path)
+        await storage.agents.insert_many([Agent(name=f"Агент {i}") for i in range(200)])
+        # Запись в то время, как снимок сериализуется в потоке
+        snapshot = asyncio.create_task(storage.engine.snapshot())
+        await asyncio.sleep(0)
+        await storage.agents.insert_many([Agent(name="Поздний")])
+        await snapshot
+        await storage.engine.flush()
+        storage.engine._flusher.cancel()
+
+        storage = await _open(tmp_path)
+        count = await storage.agents.count()
+        await storage.close()
+        return count
+
+    assert asyncio.run(main()) == 201
+
+
+def test_load_with_base_returns_copies(tmp_path):
+    async def main():
+        storage = await _open(tmp_path)
+        agent = Agent(name="Анна")
+        await storage.agents.insert_many([agent])
+        [(_, base)] = await storage.agents.load_with_base([str(agent.id)])
+        base["name"] = "Борис"
+        base["memories"].append({"content": "чужая правка"})
+        stored = storage.engine.agents[agent.id]
+        await storage.close()
+        return stored["name"], stored["memories"]
+
+    assert asyncio.run(main()) == ("Анна", [])
+
+
+def test_replay_wal_after_crash(tmp_path):
+    async def main():
+        storage = await _open(tmp_path)
+        agent = Agent(name="Анна")
+        await storage.agents.insert_many([agent])
+        agent.memories.append(Memory(content="встретила Бориса"))
+        doc = agent.model_dump(exclude={"id", "revision_id"})
+        doc["revision"] = 1
+        assert await storage.agents.replace_if_revision(agent, doc)
+        await storage.agents.insert_many([Agent(name="Борис")])
+        await storage.agents.delete(str(agent.id))
+        await storage.engine.flush()
+        storage.engine._flusher.cancel()  # падение: без снимка при закрытии
+
+        # Недописанная последняя строка журнала пропускается
+        wal = max(p for p in os.listdir(tmp_path) if p.startswith("wal."))
+        with open(tmp_path / wal, "ab") as f:
+            f.write(b'{"op": "put", "c": "agents", "doc": {"na')
+
+        storage = await _open(tmp_path)
+        agents = await storage.agents.find_all()
+        await storage.close()
+        return agents
+
+    agents = asyncio.run(main())
+    assert [a.name for a in agents] == ["Борис"]
+
+
+def test_replay_keeps_latest_revision(tmp_path):
+    async def main():
+        storage = await _open(tmp_path)
+        agent = Agent(name="Анна")
+        await storage.agents.insert_many([agent])
+        for revision in range(1, 4):
+            doc = agent.model_dump(exclude={"id", "revision_id"})
+            doc["revision"] = revision
+            doc["current_goal"] = f"цель {revision}"
+            assert await storage.agents.replace_if_revision(agent, doc)
+            agent.revision = revision
+        await storage.engine.flush()
+        storage.engine._flusher.cancel()
+
+        storage = await _open(tmp_path)
+        loaded = await storage.agents.get(str(agent.id))
+        await storage.close()
+        return loaded
+
+    loaded = asyncio.run(main())
+    assert (loaded.revision, loaded.current_goal) == (3, "цель 3")
+
+
+'''Индексы: ответы совпадают с полным перебором'''
+
+AGENT_IDS = [f"a{i}" for i in range(6)]
+EVENT_TYPES = [EventType.CHAT, EventType.ACTION, EventType.RELATIONSHIP]
+START = datetime(2024, 1, 1)
+
+
+def ids(items) -> list:
+    return [item.id for item in items]
+
+
+def newest_first(items, predicate) -> list:
+    return sorted((x for x in items if predicate(x)), key=lambda x: x.timestamp, reverse=True)
+
+
+@pytest.fixture
+def indexed():
+    """Хранилище в памяти со случайными событиями и логами (часть удалена)"""
+    rng = random.Random(5)
+    moments = rng.sample(range(100_000), 700)
+    events = []
+    for t in moments[:400]:
+        agent = rng.choice(AGENT_IDS + [None])
+        target = rng.choice([a for a in AGENT_IDS if a != agent] + [None])
+        events.append(Event(event_type=rng.choice(EVENT_TYPES), description="e", agent_id=agent,
+                            target_agent_id=target, timestamp=START + timedelta(seconds=t)))
+    logs = [Log(level=rng.choice(list(LogLevel)), category=rng.choice([LogCategory.DIALOGUE, LogCategory.SYSTEM,
+                                                                         LogCategory.REFLECTION]),
+                message="l", agent_id=rng.choice(AGENT_IDS + [None]), timestamp=START + timedelta(seconds=t))
+            for t in moments[400:]]
+
+    async def fill():
+        storage = EmbeddedStorage(None)
+        await storage.open()
+        await storage.events.insert_many(events)
+        await storage.logs.insert_many(logs)
+        for e in rng.sample(events, 50):
+            await storage.events.delete(str(e.id))
+        return storage
+
+    storage = asyncio.run(fill())
+    return storage, list(storage.engine.events.values()), list(storage.engine.logs.values())
+
+
+@pytest.mark.parametrize("event_type", [None, "chat"])
+@pytest.mark.parametrize("agent_id", [None, "a1"])
+def test_feed_cursor_pages_match_scan(indexed, event_type, agent_id):
+    storage, events, _ = indexed
+    expected = newest_first(events, lambda e: (not event_type or e.event_type.value == event_type)
+                            and (not agent_id or agent_id in (e.agent_id, e.target_agent_id)))
+    got, before = [], None
+    while True:
+        page = asyncio.run(storage.events.feed(17, before=before, event_type=event_type, agent_id=agent_id))
+        if not page:
+            break
+        got += page
+        before = page[-1].timestamp
+    assert ids(got) == ids(expected)
+
+
+@pytest.mark.parametrize("event_type", [None, "action"])
+def test_for_agent_matches_scan(indexed, event_type):
+    storage, events, _ = indexed
+    expected = newest_first(events, lambda e: "a2" in (e.agent_id, e.target_agent_id)
+                            and (not event_type or e.event_type.value == event_type))
+    page, total = asyncio.run(storage.events.for_agent("a2", event_type, skip=5, limit=10))
+    assert total == len(expected)
+    assert ids(page) == ids(expected[5:15])
+
+
+@pytest.mark.parametrize("pair", [("a1", "a3"), ("a4", "a0")])
+def test_between_matches_scan(indexed, pair):
+    storage, events, _ = indexed
+    expected = newest_first(events, lambda e: {e.agent_id, e.target_agent_id} == set(pair))
+    page, total = asyncio.run(storage.events.between(*pair, skip=2, limit=5))
+    assert total == len(expected)
+    assert ids(page) == ids(expected[2:7])
+
+
+@pytest.mark.parametrize("levels,category,agent_id,skip", [
+    (None, None, None, 3),
+    (["error"], None, None, 3),
+    (["info", "warning"], None, None, 3),
+    (None, "dialogue", None, 3),
+    (["debug", "error"], "system", None, 3),
+    (None, None, "a5", 3),
+    (["info"], "reflection", "a1", 0),
+])
+def test_log_filters_match_scan(indexed, levels, category, agent_id, skip):
+    storage, _, logs = indexed
+    expected = newest_first(logs, lambda l: (not levels or l.level.value in levels)
+                            and (not category or l.category.value == category)
+                            and (not agent_id or l.agent_id == agent_id))
+    page, total = asyncio.run(storage.logs.query(levels, category, agent_id, skip=skip, limit=20))
+    assert total == len(expected)
+    assert ids(page) == ids(expected[skip:skip + 20])
@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+from beanie import PydanticObjectId
+
+from app.models.agent import Agent, Relationship
+from app.services import emotion_dynamics
+from app.services.emotion_dynamics import SYMPATHY_STEP, _decay_sympathy
+
+
+def _agent(name, sympathy, idle):
+    now = datetime(2030, 1, 1)
+    other = str(PydanticObjectId())
+    rel = Relationship(agent_id=other, agent_name="кто-то", sympathy=sympathy,
+                       last_interaction=now - timedelta(seconds=idle) if idle is not None else None)
+    return Agent(id=PydanticObjectId(), name=name, relationships=[rel])
+
+
+def test_sympathy_decay_touches_only_changed_agents():
+    emotion_dynamics.reset_state()
+    now = datetime(2030, 1, 1)
+    agents = [
+        _agent("сильная", 0.9, 10_000),
+        _agent("слабая", 0.05, 10_000),
+        _agent("недавняя", 0.9, 60),
+        _agent("незнакомая", 0.0, None),
+    ]
+    assert _decay_sympathy(agents, SYMPATHY_STEP, now) == {0}
+    assert agents[0].relationships[0].sympathy < 0.9
+    assert [a.relationships[0].sympathy for a in agents[1:]] == [0.05, 0.9, 0.0]
+
+    # Слабая симпатия не теряет остывание: оно копится, пока сдвиг не станет заметным
+    steps = 1
+    while _decay_sympathy(agents[1:2], SYMPATHY_STEP, now) != {0}:
+        steps += 1
+    assert steps > 1
+    assert 0.05 - agents[1].relationships[0].sympathy >= emotion_dynamics.SYMPATHY_MIN_CHANGE
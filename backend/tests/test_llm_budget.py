@@ -0,0 +1,22 @@
+from datetime import datetime, timedelta
+
+from beanie import PydanticObjectId
+
+from app.models.agent import Agent
+from app.services import llm_budget
+from app.services.llm_usage import record_call, usage_source
+
+
+def test_broadcast_calls_spend_lifecycle_budget():
+    llm_budget.reset_governor()
+    governor = llm_budget.governor()
+    agents = [Agent(id=PydanticObjectId(), name=f"Агент {i}") for i in range(10)]
+    start = datetime(2030, 1, 1)
+    assert len(governor.grant([(a, 1.0) for a in agents], 10, start)) == 10
+
+    with usage_source("broadcast"):
+        for _ in range(6):
+            record_call("chat", "offline")
+    # Через 30 секунд ведро пополнилось на 5, но 6 вызовов рассылки уже списаны
+    granted = governor.grant([(a, 1.0) for a in agents], 10, start + timedelta(seconds=30))
+    assert len(granted) == 9
@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+from app.services import llm_resilience
+from app.services.llm_resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_resilience.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failures=3, open_seconds=30)
+    breaker.failure()
+    breaker.failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker(failures=3, open_seconds=30)
+    breaker.failure()
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    breaker.failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_probe_closes_on_success(clock):
+    breaker = CircuitBreaker(failures=1, open_seconds=30)
+    breaker.failure()
+    clock[0] += 29
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()  # одна пробная попытка
+    breaker.success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_half_open_probe_reopens_on_failure(clock):
+    breaker = CircuitBreaker(failures=2, open_seconds=30)
+    breaker.failure()
+    breaker.failure()
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    clock[0] += 30
+    assert breaker.allow()
+
+
+'''guarded'''
+
+@pytest.fixture
+def fresh_breaker(monkeypatch):
+    breaker = CircuitBreaker(failures=2, open_seconds=30)
+    monkeypatch.setattr(llm_resilience, "breaker", breaker)
+    monkeypatch.setitem(llm_resilience.TIMEOUTS, "test", 0.2)
+    monkeypatch.setattr(llm_resilience, "_latencies", {})
+    return breaker
+
+
+def attempt_after(delay: float, result="ответ"):
+    async def attempt():
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return attempt
+
+
+def test_guarded_returns_result(fresh_breaker):
+    fresh_breaker.failure()
+    assert asyncio.run(llm_resilience.guarded("test", attempt_after(0))) == "ответ"
+    assert fresh_breaker.failures == 0
+    assert len(llm_resilience._latencies["test"]) == 1
+
+
+def test_guarded_deadline_counts_as_failure(fresh_breaker):
+    timeouts = llm_resilience.RESILIENCE_STATS["timeouts"]
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            asyncio.run(llm_resilience.guarded("test", attempt_after(5)))
+    assert llm_resilience.RESILIENCE_STATS["timeouts"] == timeouts + 2
+    assert fresh_breaker.state == OPEN
+
+
+def test_guarded_error_propagates(fresh_breaker):
+    with pytest.raises(ValueError):
+        asyncio.run(llm_resilience.guarded("test", attempt_after(0, ValueError("нет связи"))))
+    assert fresh_breaker.failures == 1
+    assert fresh_breaker.state == CLOSED
+
+
+def test_guarded_cancelled_probe_does_not_stick(fresh_breaker):
+    fresh_breaker.open_seconds = 0
+    fresh_breaker.failure()
+    fresh_breaker.failure()
+    assert fresh_breaker.allow() and fresh_breaker.state == HALF_OPEN
+
+    async def main():
+        probe = asyncio.create_task(llm_resilience.guarded("test", attempt_after(5)))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(main())
+    assert fresh_breaker.state == OPEN
+    assert fresh_breaker.allow()  # следующий вызов — новая пробная попытка
+    assert fresh_breaker.failures == 2
+
+
+def test_guarded_hedge_wins_over_slow_attempt(fresh_breaker, monkeypatch):
+    monkeypatch.setattr(llm_resilience, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(llm_resilience, "HEDGE_KINDS", {"test"})
+    monkeypatch.setattr(llm_resilience, "HEDGE_DEFAULT_DELAY", 0.02)
+    delays = iter([5, 0])
+
+    async def attempt():
+        delay = next(delays)
+        await asyncio.sleep(delay)
+        return "второй" if delay == 0 else "первый"
+
+    wins = llm_resilience.RESILIENCE_STATS["hedge_wins"]
+    assert asyncio.run(llm_resilience.guarded("test", attempt)) == "второй"
+    assert llm_resilience.RESILIENCE_STATS["hedge_wins"] == wins + 1
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+from beanie import PydanticObjectId
+
+from app.models.agent import Agent, Relationship
+from app.services.matchmaking import match_pairs
+from app.services.neighborhoods import NeighborhoodIndex
+from app.services.world_state import LifecycleParams
+
+
+def population(n: int, seed: int) -> list[Agent]:
+    rng = random.Random(seed)
+    agents = [Agent(id=PydanticObjectId(), name=f"agent{i}") for i in range(n)]
+    for a in agents:
+        for b in rng.sample(agents, 5):
+            if b is not a:
+                a.relationships.append(Relationship(agent_id=str(b.id), agent_name=b.name,
+                                                    sympathy=rng.uniform(-1, 1)))
+    return agents
+
+
+def assert_disjoint(pairs):
+    seen = [str(agent.id) for a, t, _ in pairs for agent in (a, t)]
+    assert len(seen) == len(set(seen))
+    assert all(a is not t for a, t, _ in pairs)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_pairs_never_overlap(seed):
+    random.seed(seed)
+    agents = population(40, seed)
+    pairs = match_pairs(agents, agents, LifecycleParams())
+    assert pairs
+    assert_disjoint(pairs)
+    assert len(pairs) <= len(agents) // 2
+
+
+def test_pairs_never_overlap_with_neighborhoods():
+    random.seed(1)
+    agents = population(60, 1)
+    index = NeighborhoodIndex()
+    index.sync(agents)
+    for _ in range(10):
+        assert_disjoint(match_pairs(agents, agents, LifecycleParams(), index))
+
+
+def test_dialogue_limit_and_inactive_agents():
+    random.seed(2)
+    agents = population(30, 2)
+    for a in agents[:10]:
+        a.is_active = False
+    pairs = match_pairs(agents, agents, LifecycleParams(max_dialogues_per_tick=3))
+    assert len(pairs) <= 3
+    inactive = {str(a.id) for a in agents[:10]}
+    assert not any(str(agent.id) in inactive for a, t, _ in pairs for agent in (a, t))
@@ -0,0 +1,62 @@
+from pytest import approx
+
+from app.services.occ import merge_documents
+
+
+def rel(agent_id, sympathy, description=""):
+    return {"agent_id": agent_id, "agent_name": agent_id, "sympathy": sympathy, "description": description}
+
+
+def test_float_deltas_add_up():
+    assert merge_documents(0.5, 0.6, 0.7) == approx(0.8)
+    assert merge_documents(0.5, 0.4, 0.7) == approx(0.6)
+
+
+def test_emotions_clamped_to_unit_interval():
+    merged = merge_documents({"emotion": {"stress": 0.2}}, {"emotion": {"stress": 0.1}},
+                             {"emotion": {"stress": 0.05}})
+    assert merged == {"emotion": {"stress": 0.0}}
+
+
+def test_sympathy_keeps_negative_delta():
+    # base, mine и theirs неотрицательны, но итог уходит ниже нуля
+    merged = merge_documents({"sympathy": 0.1}, {"sympathy": 0.0}, {"sympathy": 0.05})
+    assert merged["sympathy"] < 0
+    assert merge_documents({"sympathy": 0.0}, {"sympathy": -0.9}, {"sympathy": -0.5}) == {"sympathy": -1.0}
+
+
+def test_untouched_side_wins():
+    assert merge_documents({"a": 1}, {"a": 1}, {"a": 2}) == {"a": 2}
+    assert merge_documents({"a": 1}, {"a": 3}, {"a": 1}) == {"a": 3}
+
+
+def test_relationships_merged_by_agent_id():
+    base = {"relationships": [rel("x", 0.2), rel("y", 0.0)]}
+    mine = {"relationships": [rel("x", 0.1), rel("y", 0.0), rel("z", 0.3)]}
+    theirs = {"relationships": [rel("y", 0.0, "друг"), rel("x", 0.3), rel("w", -0.4)]}
+    merged = {r["agent_id"]: r for r in merge_documents(base, mine, theirs)["relationships"]}
+    assert set(merged) == {"x", "y", "z", "w"}
+    assert merged["x"]["sympathy"] == approx(0.2)
+    assert merged["y"]["description"] == "друг"
+    assert merged["z"]["sympathy"] == 0.3
+    assert merged["w"]["sympathy"] == -0.4
+
+
+def test_relationship_removed_by_either_side():
+    base = {"relationships": [rel("x", 0.2), rel("y", 0.1)]}
+    mine = {"relationships": [rel("x", 0.5), rel("y", 0.1)]}
+    theirs = {"relationships": [rel("x", 0.2)]}
+    assert merge_documents(base, mine, theirs) == {"relationships": [rel("x", 0.5)]}
+
+
+def test_memories_added_and_removed():
+    a, b, c, d = ({"content": s, "importance": 0.5} for s in "abcd")
+    base = {"memories": [a, b]}
+    mine = {"memories": [b, c]}     # удалили a, добавили c
+    theirs = {"memories": [a, b, d]}  # добавили d
+    assert merge_documents(base, mine, theirs) == {"memories": [b, d, c]}
+
+
+def test_memory_added_by_both_sides_once():
+    a, c = {"content": "a"}, {"content": "c"}
+    assert merge_documents({"memories": [a]}, {"memories": [a, c]}, {"memories": [a, c]}) == {"memories": [a, c]}
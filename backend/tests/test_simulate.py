@@ -0,0 +1,34 @@
+import asyncio
+
+from app.db.database import connect, disconnect
+from app.simulate import dump_state, run_simulation
+
+
+def world_state_after(seed: int) -> list[dict]:
+    """Состояние агентов без случайных id (ObjectId различаются между прогонами)"""
+    async def main():
+        await connect(backend="embedded", persist=False)
+        try:
+            await run_simulation(ticks=15, seed=seed, agents=20, reset=True)
+            agents = await dump_state()
+        finally:
+            await disconnect()
+        names = {a["id"]: a["name"] for a in agents}
+        for a in agents:
+            del a["id"]
+            for r in a["relationships"]:
+                r["agent_id"] = names.get(r["agent_id"])
+            for m in a["memories"]:
+                m["related_agent_id"] = names.get(m["related_agent_id"])
+        return agents
+
+    return asyncio.run(main())
+
+
+def test_same_seed_same_world():
+    assert world_state_after(7) == world_state_after(7)
+
+
+def test_world_clock_is_frozen():
+    agents = world_state_after(3)
+    assert all(a["created_at"].startswith("2024-01-01T00:00:00") for a in agents)
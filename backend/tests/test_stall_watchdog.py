@@ -0,0 +1,36 @@
+import asyncio
+import time
+
+from app.db.database import connect, disconnect
+from app.services.stall_watchdog import capture_stalls
+from app.simulate import run_simulation
+
+
+def test_blocking_call_is_captured():
+    async def blocking():
+        time.sleep(0.3)
+
+    async def main():
+        with capture_stalls(100) as stalls:
+            await blocking()
+            await asyncio.sleep(0.1)
+        return stalls
+
+    stalls = asyncio.run(main())
+    assert len(stalls) == 1
+    assert stalls[0]["duration_ms"] >= 250
+    assert any("blocking" in line for line in stalls[0]["stack"])
+
+
+def test_offline_ticks_do_not_block_loop():
+    async def main():
+        await connect(backend="embedded", persist=False)
+        try:
+            await run_simulation(ticks=1, seed=1, agents=30, reset=True)  # прогрев импортов и кэшей
+            with capture_stalls(500) as stalls:
+                await run_simulation(ticks=5, seed=1)
+        finally:
+            await disconnect()
+        return stalls
+
+    assert asyncio.run(main()) == []
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from app.db.database import connect, disconnect
+from app.db.repository import agent_repo, event_repo
+from app.models.agent import Agent
+from app.models.event import Event, EventType
+from app.services import world_versions
+
+
+class FakeStorage:
+
+    def __init__(self):
+        self.bumps: list[set[str]] = []
+
+    async def bump_versions(self, resources):
+        self.bumps.append(set(resources))
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    fake = FakeStorage()
+    monkeypatch.setattr(world_versions, "get_storage", lambda: fake)
+    return fake
+
+
+def test_defer_outside_block(storage):
+    assert not world_versions.defer("agents")
+
+
+def test_one_bump_per_block(storage):
+    async def write(resource):
+        await asyncio.sleep(0)
+        return world_versions.defer(resource)
+
+    async def main():
+        async with world_versions.deferred():
+            assert world_versions.defer("agents")
+            assert await asyncio.gather(write("agents"), write("events")) == [True, True]
+            async with world_versions.deferred():  # вложенный — в тот же подъем
+                world_versions.defer("events")
+            assert storage.bumps == []
+
+    asyncio.run(main())
+    assert storage.bumps == [{"agents", "events"}]
+
+
+def test_no_bump_without_writes(storage):
+    async def main():
+        async with world_versions.deferred():
+            pass
+
+    asyncio.run(main())
+    assert storage.bumps == []
+
+
+def test_task_outliving_block_bumps_itself(storage):
+    async def main():
+        started = asyncio.Event()
+
+        async def late_write():
+            started.set()
+            await asyncio.sleep(0.01)
+            return world_versions.defer("events")
+
+        async with world_versions.deferred():
+            task = asyncio.create_task(late_write())
+            await started.wait()
+        return await task
+
+    assert asyncio.run(main()) is False
+
+
+def test_middleware_bumps_before_response(storage):
+    messages = []
+
+    async def app(scope, receive, send):
+        world_versions.defer("agents")
+        world_versions.defer("events")
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        messages.append(list(storage.bumps))
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def send(message):
+        messages.append(message["type"])
+
+    middleware = world_versions.DeferredBumpMiddleware(app)
+    asyncio.run(middleware({"type": "http", "method": "POST"}, None, send))
+    assert messages == ["http.response.start", [{"agents", "events"}], "http.response.body"]
+    assert storage.bumps == [{"agents", "events"}]
+
+
+def test_middleware_skips_reads(storage):
+    async def app(scope, receive, send):
+        assert not world_versions.defer("agents")
+
+    asyncio.run(world_versions.DeferredBumpMiddleware(app)({"type": "http", "method": "GET"}, None, None))
+    assert storage.bumps == []
+
+
+def test_item_tags_follow_their_own_writes():
+    async def main():
+        await connect(backend="embedded", persist=False)
+        try:
+            anna, boris = Agent(name="Анна"), Agent(name="Борис")
+            await agent_repo().insert_many([anna, boris])
+
+            def tags():
+                return (world_versions.etag("agents"), world_versions.etag("agents", str(anna.id)),
+                        world_versions.etag("agents", str(boris.id)), world_versions.etag("events", str(boris.id)))
+
+            before = tags()
+            anna.current_goal = "поговорить"
+            doc = anna.model_dump(exclude={"id", "revision_id"})
+            doc["revision"] = 1
+            assert await agent_repo().replace_if_revision(anna, doc)
+            after_write = tags()
+            await event_repo().insert(Event(event_type=EventType.CHAT, description="привет",
+                                            agent_id=str(anna.id), target_agent_id=str(boris.id)))
+            after_event = tags()
+            await agent_repo().delete_all()
+            after_clear = tags()
+        finally:
+            await disconnect()
+        return before, after_write, after_event, after_clear
+
+    before, after_write, after_event, after_clear = asyncio.run(main())
+    # Запись Анны меняет список и ее карточку, но не карточку Бориса
+    assert after_write[0] != before[0] and after_write[1] != before[1]
+    assert after_write[2:] == before[2:]
+    # Событие с участием Бориса — только его события
+    assert after_event[:3] == after_write[:3] and after_event[3] != after_write[3]
+    # Очистка коллекции сбрасывает все карточки
+    assert after_clear[1] != after_event[1] and after_clear[2] != after_event[2]
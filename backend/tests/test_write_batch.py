@@ -0,0 +1,66 @@
+import asyncio
+
+from beanie import PydanticObjectId
+
+from app.db.database import connect, disconnect
+from app.db.repository import agent_repo, event_repo
+from app.models.agent import Agent
+from app.models.event import Event, EventType
+from app.services.sharding import partition_of
+from app.services.write_batch import WriteBatch
+
+
+def test_busy_agents_stay_in_batch():
+    async def main():
+        await connect(backend="embedded", persist=False)
+        try:
+            await agent_repo().insert_many([Agent(name="Анна"), Agent(name="Борис")])
+            batch = await WriteBatch.load_active()
+            anna, boris = sorted(batch.agents.values(), key=lambda a: a.name)
+            busy = {str(anna.id)}
+            for agent in (anna, boris):
+                agent.current_goal = "поговорить"
+                batch.mark(agent)
+            batch.add_event(Event(event_type=EventType.CHAT, description="начало диалога",
+                                  agent_id=str(boris.id), target_agent_id=str(anna.id)))
+            batch.add_event(Event(event_type=EventType.ACTION, description="прогулка", agent_id=str(boris.id)))
+
+            await batch.flush(busy)
+            first = ({a.name: a.revision for a in await agent_repo().find_all()},
+                     [e.description for e in await event_repo().feed(10)])
+            await batch.flush()
+            second = ({a.name: a.revision for a in await agent_repo().find_all()},
+                      sorted(e.description for e in await event_repo().feed(10)))
+        finally:
+            await disconnect()
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == ({"Анна": 0, "Борис": 1}, ["прогулка"])
+    assert second == ({"Анна": 1, "Борис": 1}, ["начало диалога", "прогулка"])
+
+
+def test_foreign_partitions_are_candidates_only():
+    async def main():
+        await connect(backend="embedded", persist=False)
+        try:
+            anna = Agent(id=PydanticObjectId(), name="Анна")
+            boris = Agent(id=PydanticObjectId(), name="Борис")
+            while partition_of(boris.id) == partition_of(anna.id):
+                boris.id = PydanticObjectId()
+            await agent_repo().insert_many([anna, boris])
+            batch = await WriteBatch.load_active({partition_of(anna.id)})
+            owned, pool = list(batch.agents), sorted(a.name for a in batch.pool)
+            target = batch.foreign[str(boris.id)]
+            target.current_goal = "ответить Анне"
+            batch.mark(target)
+            await batch.flush()
+            stored = {a.name: a.revision for a in await agent_repo().find_all()}
+        finally:
+            await disconnect()
+        return owned, pool, stored
+
+    owned, pool, stored = asyncio.run(main())
+    assert len(owned) == 1
+    assert pool == ["Анна", "Борис"]
+    assert stored == {"Анна": 0, "Борис": 1}